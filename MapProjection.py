@@ -1,54 +1,220 @@
 # from utils import spherical_to_cartesian, cartesian_to_spherical
 import numpy as np
 
+# "local" is the original tangent-plane approximation: fastest, but it drifts away from the origin.
+# "transverse_mercator" is the MGA zone 56 grid; "geodesic" is an exact azimuthal equidistant map.
+PROJECTION_BACKENDS = ("local", "transverse_mercator", "geodesic")
+DEFAULT_PROJECTION_BACKEND = "local"
+# MGA zone 56 (GDA94/GDA2020), which covers the whole Sydney Trains network.
+MGA56_CENTRAL_MERIDIAN = 153.0
+MGA_SCALE_FACTOR = 0.9996
+VINCENTY_TOLERANCE = 1e-12
+VINCENTY_MAX_ITERATIONS = 200
+
+
 class MapProjection:
     """The 'Single Source of Truth' for map math."""
-    def __init__(self, origin_lon, origin_lat, scale=1.0, pcb_origin_mm=(0.0, 0.0)):
+    def __init__(
+        self,
+        origin_lon,
+        origin_lat,
+        scale=1.0,
+        pcb_origin_mm=(0.0, 0.0),
+        backend=DEFAULT_PROJECTION_BACKEND,
+        central_meridian=MGA56_CENTRAL_MERIDIAN,
+    ):
+        if backend not in PROJECTION_BACKENDS:
+            raise ValueError(f"Unknown projection backend {backend!r}, expected one of {PROJECTION_BACKENDS}")
         self.origin = (origin_lon, origin_lat)
         self.scale = scale
         self.pcb_origin_mm = pcb_origin_mm
+        self.backend = backend
+        self.central_meridian = central_meridian
 
         # equatorial radius (m)
         self.a = 6378137
         # eccentricity
         self.e = 0.081819191
+        self._setup()
 
-    def geo_to_map(self, lon, lat):
-        """Converts GPS to meters (x, y) from origin."""
-        latitudes = np.array(lat)
-        longitudes = np.array(lon)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_constants", None)
+        return state
+
+    def __setstate__(self, state):
+        # Projections pickled before backends existed are all local tangent planes.
+        state.setdefault("backend", "local")
+        state.setdefault("central_meridian", MGA56_CENTRAL_MERIDIAN)
+        self.__dict__.update(state)
+        self._setup()
 
+    def _setup(self):
+        """Precomputes the per-origin constants each backend needs."""
         phi0, theta0 = self.origin
-        M = np.pi * self.a * (1 - self.e**2) / (180 * ((1 - self.e**2 * np.sin(np.deg2rad(theta0))**2))**(3/2))
-        N = np.pi * self.a * np.cos(np.deg2rad(theta0)) / (180 * ((1 - self.e**2 * np.sin(np.deg2rad(theta0))**2))**(1/2))
-        y = M * (latitudes - theta0)
-        x = N * (longitudes - phi0)
-        return x, y
-    
+        f = 1 - np.sqrt(1 - self.e**2)
+        self._constants = constants = {"f": f, "b": self.a * (1 - f)}
+        if self.backend == "local":
+            constants["M"] = np.pi * self.a * (1 - self.e**2) / (180 * ((1 - self.e**2 * np.sin(np.deg2rad(theta0))**2))**(3/2))
+            constants["N"] = np.pi * self.a * np.cos(np.deg2rad(theta0)) / (180 * ((1 - self.e**2 * np.sin(np.deg2rad(theta0))**2))**(1/2))
+        elif self.backend == "transverse_mercator":
+            n = f / (2 - f)
+            constants["n"] = n
+            constants["A"] = self.a / (1 + n) * (1 + n**2 / 4 + n**4 / 64)
+            constants["alpha"] = (n / 2 - 2 * n**2 / 3 + 5 * n**3 / 16, 13 * n**2 / 48 - 3 * n**3 / 5, 61 * n**3 / 240)
+            constants["beta"] = (n / 2 - 2 * n**2 / 3 + 37 * n**3 / 96, n**2 / 48 + n**3 / 15, 17 * n**3 / 480)
+            constants["delta"] = (2 * n - 2 * n**2 / 3 - 2 * n**3, 7 * n**2 / 3 - 8 * n**3 / 5, 56 * n**3 / 15)
+            constants["origin_grid"] = self._tm_forward(np.array(phi0), np.array(theta0))
+
     def geo_to_map(self, lon, lat):
         """Converts GPS to map meters (x, y) from origin."""
         latitudes = np.array(lat)
         longitudes = np.array(lon)
+        if self.backend == "transverse_mercator":
+            easting, northing = self._tm_forward(longitudes, latitudes)
+            origin_easting, origin_northing = self._constants["origin_grid"]
+            return easting - origin_easting, northing - origin_northing
+        if self.backend == "geodesic":
+            phi0, theta0 = self.origin
+            distance, azimuth = self._vincenty_inverse(phi0, theta0, longitudes, latitudes)
+            return distance * np.sin(azimuth), distance * np.cos(azimuth)
 
         phi0, theta0 = self.origin
-        M = np.pi * self.a * (1 - self.e**2) / (180 * ((1 - self.e**2 * np.sin(np.deg2rad(theta0))**2))**(3/2))
-        N = np.pi * self.a * np.cos(np.deg2rad(theta0)) / (180 * ((1 - self.e**2 * np.sin(np.deg2rad(theta0))**2))**(1/2))
-        y = M * (latitudes - theta0)
-        x = N * (longitudes - phi0)
+        y = self._constants["M"] * (latitudes - theta0)
+        x = self._constants["N"] * (longitudes - phi0)
         return x, y
-    
+
     def map_to_geo(self, x, y):
         """Converts map meters (x, y) from origin.to GPS"""
         x = np.array(x)
         y = np.array(y)
+        if self.backend == "transverse_mercator":
+            origin_easting, origin_northing = self._constants["origin_grid"]
+            return self._tm_inverse(x + origin_easting, y + origin_northing)
+        if self.backend == "geodesic":
+            phi0, theta0 = self.origin
+            return self._vincenty_direct(phi0, theta0, np.arctan2(x, y), np.hypot(x, y))
 
         phi0, theta0 = self.origin
-        M = np.pi * self.a * (1 - self.e**2) / (180 * ((1 - self.e**2 * np.sin(np.deg2rad(theta0))**2))**(3/2))
-        N = np.pi * self.a * np.cos(np.deg2rad(theta0)) / (180 * ((1 - self.e**2 * np.sin(np.deg2rad(theta0))**2))**(1/2))
-        latitudes  = y / M + theta0
-        longitudes = x / N + phi0
+        latitudes  = y / self._constants["M"] + theta0
+        longitudes = x / self._constants["N"] + phi0
         return longitudes, latitudes
 
+    def _tm_forward(self, lon, lat):
+        """Krüger series transverse Mercator to third order in n (sub-millimetre within a zone)."""
+        c = self._constants
+        phi = np.deg2rad(lat)
+        dlambda = np.deg2rad(lon - self.central_meridian)
+        t = np.sinh(np.arctanh(np.sin(phi)) - self.e * np.arctanh(self.e * np.sin(phi)))
+        xi_prime = np.arctan2(t, np.cos(dlambda))
+        eta_prime = np.arctanh(np.sin(dlambda) / np.sqrt(1 + t**2))
+        xi = xi_prime.copy()
+        eta = eta_prime.copy()
+        for j, alpha in enumerate(c["alpha"], start=1):
+            xi = xi + alpha * np.sin(2 * j * xi_prime) * np.cosh(2 * j * eta_prime)
+            eta = eta + alpha * np.cos(2 * j * xi_prime) * np.sinh(2 * j * eta_prime)
+        k = MGA_SCALE_FACTOR * c["A"]
+        return k * eta, k * xi
+
+    def _tm_inverse(self, easting, northing):
+        c = self._constants
+        k = MGA_SCALE_FACTOR * c["A"]
+        xi = northing / k
+        eta = easting / k
+        xi_prime = xi.copy()
+        eta_prime = eta.copy()
+        for j, beta in enumerate(c["beta"], start=1):
+            xi_prime = xi_prime - beta * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+            eta_prime = eta_prime - beta * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+        chi = np.arcsin(np.sin(xi_prime) / np.cosh(eta_prime))
+        phi = chi.copy()
+        for j, delta in enumerate(c["delta"], start=1):
+            phi = phi + delta * np.sin(2 * j * chi)
+        dlambda = np.arctan2(np.sinh(eta_prime), np.cos(xi_prime))
+        return self.central_meridian + np.rad2deg(dlambda), np.rad2deg(phi)
+
+    def _vincenty_inverse(self, lon1, lat1, lon2, lat2):
+        """Vectorised Vincenty inverse: geodesic distance (m) and forward azimuth (rad) from point 1."""
+        f, a, b = self._constants["f"], self.a, self._constants["b"]
+        U1 = np.arctan((1 - f) * np.tan(np.deg2rad(lat1)))
+        U2 = np.arctan((1 - f) * np.tan(np.deg2rad(lat2)))
+        L = np.deg2rad(lon2 - lon1)
+        sinU1, cosU1, sinU2, cosU2 = np.sin(U1), np.cos(U1), np.sin(U2), np.cos(U2)
+
+        lam = np.array(L, dtype=float)
+        for _ in range(VINCENTY_MAX_ITERATIONS):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)
+            cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            # Coincident points have no direction; any azimuth with zero distance is right.
+            safe_sin_sigma = np.where(sin_sigma == 0, 1.0, sin_sigma)
+            sin_alpha = cosU1 * cosU2 * sin_lam / safe_sin_sigma
+            cos2_alpha = 1 - sin_alpha**2
+            safe_cos2_alpha = np.where(cos2_alpha == 0, 1.0, cos2_alpha)
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sinU1 * sinU2 / safe_cos2_alpha)
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            previous = lam
+            lam = L + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m**2))
+            )
+            if np.all(np.abs(lam - previous) < VINCENTY_TOLERANCE):
+                break
+
+        u2 = cos2_alpha * (a**2 - b**2) / b**2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m**2)
+            - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma**2) * (-3 + 4 * cos_2sigma_m**2)
+        ))
+        distance = b * A * (sigma - delta_sigma)
+        azimuth = np.arctan2(cosU2 * np.sin(lam), cosU1 * sinU2 - sinU1 * cosU2 * np.cos(lam))
+        return distance, azimuth
+
+    def _vincenty_direct(self, lon1, lat1, azimuth, distance):
+        """Vectorised Vincenty direct: the point distance (m) from point 1 along azimuth (rad)."""
+        f, a, b = self._constants["f"], self.a, self._constants["b"]
+        U1 = np.arctan((1 - f) * np.tan(np.deg2rad(lat1)))
+        sigma1 = np.arctan2(np.tan(U1), np.cos(azimuth))
+        sin_alpha = np.cos(U1) * np.sin(azimuth)
+        cos2_alpha = 1 - sin_alpha**2
+        u2 = cos2_alpha * (a**2 - b**2) / b**2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+
+        sigma = distance / (b * A)
+        for _ in range(VINCENTY_MAX_ITERATIONS):
+            cos_2sigma_m = np.cos(2 * sigma1 + sigma)
+            sin_sigma, cos_sigma = np.sin(sigma), np.cos(sigma)
+            delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m**2)
+                - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma**2) * (-3 + 4 * cos_2sigma_m**2)
+            ))
+            previous = sigma
+            sigma = distance / (b * A) + delta_sigma
+            if np.all(np.abs(sigma - previous) < VINCENTY_TOLERANCE):
+                break
+
+        sinU1, cosU1 = np.sin(U1), np.cos(U1)
+        sin_sigma, cos_sigma = np.sin(sigma), np.cos(sigma)
+        cos_2sigma_m = np.cos(2 * sigma1 + sigma)
+        lat2 = np.arctan2(
+            sinU1 * cos_sigma + cosU1 * sin_sigma * np.cos(azimuth),
+            (1 - f) * np.hypot(sin_alpha, sinU1 * sin_sigma - cosU1 * cos_sigma * np.cos(azimuth)),
+        )
+        lam = np.arctan2(sin_sigma * np.sin(azimuth), cosU1 * cos_sigma - sinU1 * sin_sigma * np.cos(azimuth))
+        C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+        L = lam - (1 - C) * f * sin_alpha * (
+            sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m**2))
+        )
+        return lon1 + np.rad2deg(L), np.rad2deg(lat2)
+
+    def geodesic_distance(self, lon1, lat1, lon2, lat2):
+        """Exact ellipsoidal distance in metres, whatever the backend."""
+        distance, _ = self._vincenty_inverse(np.array(lon1), np.array(lat1), np.array(lon2), np.array(lat2))
+        return distance
+
     def map_to_pcb(self, map_x, map_y):
         """Converts map coordinates to PCB coordinates."""
         origin_x, origin_y = self.pcb_origin_mm
@@ -62,7 +228,7 @@ class MapProjection:
         map_x = (pcb_x - origin_x) / self.scale / 1000
         map_y = (origin_y - pcb_y) / self.scale / 1000
         return map_x, map_y
-    
+
     def geo_to_pcb(self, lon, lat):
         """Converts GPS coordinates to PCB coordinates."""
         map_x, map_y = self.geo_to_map(lon, lat)
@@ -74,3 +240,30 @@ class MapProjection:
         map_x, map_y = self.pcb_to_map(pcb_x, pcb_y)
         lon, lat = self.map_to_geo(map_x, map_y)
         return lon, lat
+
+
+def measure_projection_error(projection, width_metres, height_metres, samples=2000, seed=0):
+    """
+    Worst-case errors of a projection over a board extent centred on its
+    origin: how far map distances between random point pairs stray from the
+    exact geodesic distance, and how far a geo -> map -> geo round trip
+    lands from where it started, both in metres.
+    """
+    rng = np.random.default_rng(seed)
+    reference = MapProjection(*projection.origin, backend="geodesic")
+    half_extent = np.array([width_metres / 2, height_metres / 2])
+    corners = rng.uniform(-half_extent, half_extent, size=(2, samples, 2))
+    lon_a, lat_a = reference.map_to_geo(corners[0, :, 0], corners[0, :, 1])
+    lon_b, lat_b = reference.map_to_geo(corners[1, :, 0], corners[1, :, 1])
+
+    x_a, y_a = projection.geo_to_map(lon_a, lat_a)
+    x_b, y_b = projection.geo_to_map(lon_b, lat_b)
+    map_distance = np.hypot(x_b - x_a, y_b - y_a)
+    true_distance = reference.geodesic_distance(lon_a, lat_a, lon_b, lat_b)
+
+    round_trip_lon, round_trip_lat = projection.map_to_geo(x_a, y_a)
+    round_trip = reference.geodesic_distance(lon_a, lat_a, round_trip_lon, round_trip_lat)
+    return {
+        "max_distance_error_m": float(np.abs(map_distance - true_distance).max()),
+        "max_round_trip_m": float(round_trip.max()),
+    }
@@ -1,5 +1,4 @@
 import Track
-from shapely.geometry import Point
 
 class Station:
     def __init__(self, name, longitude, latitude, track: Track):
@@ -20,12 +19,14 @@ class Station:
     @property
     def orientation(self):
         """Queries the track for the angle at its location."""
+        from shapely.geometry import Point
         x, y = self.track.projection.geo_to_map(self.longitude, self.latitude)
         dist = self.track.line_cartesian.project(Point(x, y))
         return self.track.get_tangent_at_dist(dist)
 
     @property
     def chainage(self):
+        from shapely.geometry import Point
         pt = Point(self.map_x, self.map_y)
         length = self.track.line_cartesian.project(pt)
         return length
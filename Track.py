@@ -1,6 +1,10 @@
-from shapely.geometry import LineString, Point
+from functools import cached_property
 import MapProjection
 import math
+import numpy as np
+
+# Geometry built on demand; dropped when pickling so loading a track does not import shapely.
+CACHED_GEOMETRY_ATTRIBUTES = ("line_cartesian", "line_spherical")
 
 class Track:
     def __init__(self, name, longitudes, latitudes, projection: MapProjection):
@@ -11,16 +15,39 @@ class Track:
         
         # Build geometry using the shared projection
         self.map_x, self.map_y = self.projection.geo_to_map(longitudes, latitudes)
-        self.line_cartesian = LineString(list(zip(self.map_x, self.map_y)))
-        self.line_spherical = LineString(list(zip(longitudes, latitudes)))
         self.stations = []
 
+    @cached_property
+    def line_cartesian(self):
+        from shapely.geometry import LineString
+        return LineString(list(zip(self.map_x, self.map_y)))
+
+    @cached_property
+    def line_spherical(self):
+        from shapely.geometry import LineString
+        return LineString(list(zip(self.longitudes, self.latitudes)))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for attribute in CACHED_GEOMETRY_ATTRIBUTES:
+            state.pop(attribute, None)
+        return state
+
     def get_tangent_at_dist(self, dist):
         """Calculates rotation at a specific distance along the track."""
         p1 = self.line_cartesian.interpolate(dist)
         p2 = self.line_cartesian.interpolate(min(dist + 0.1, self.line_cartesian.length))
         return math.degrees(math.atan2(p2.y - p1.y, p2.x - p1.x))
 
+    def get_tangents_at_dists(self, dists):
+        """Vectorised get_tangent_at_dist for an array of distances."""
+        import shapely
+        dists = np.asarray(dists, dtype=float)
+        ahead = np.minimum(dists + 0.1, self.line_cartesian.length)
+        p1 = shapely.get_coordinates(shapely.line_interpolate_point(self.line_cartesian, dists))
+        p2 = shapely.get_coordinates(shapely.line_interpolate_point(self.line_cartesian, ahead))
+        return np.degrees(np.arctan2(p2[:, 1] - p1[:, 1], p2[:, 0] - p1[:, 0]))
+
 # from utils import spherical_to_cartesian
 # from shapely.geometry import LineString, Point
 
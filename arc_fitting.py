@@ -0,0 +1,192 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+# Copper is laid 1 mm wide, so a twentieth of a millimetre off the midline is invisible
+# and well inside the clearance the pre-flight allows around the tracks.
+ARC_FIT_TOLERANCE_MM = 0.05
+# Flatter than this is drawn as a straight track; tighter would pinch the 1 mm copper.
+MAX_ARC_RADIUS_MM = 10000.0
+MIN_ARC_RADIUS_MM = 1.0
+# Arcs are sampled this finely for clearance checks: the chords sit at most this far inside the arc.
+ARC_SAMPLE_SAGITTA_MM = 0.001
+
+
+@dataclass(frozen=True)
+class FittedPiece:
+    """One track item in PCB millimetres: straight from start to end, or an arc through mid when it has one."""
+    start: tuple[float, float]
+    end: tuple[float, float]
+    mid: tuple[float, float] | None = None
+
+    @property
+    def is_arc(self):
+        return self.mid is not None
+
+
+@dataclass(frozen=True)
+class ArcFitReport:
+    name: str
+    vertices_in: int
+    lines: int
+    arcs: int
+    max_deviation_mm: float
+
+    @property
+    def pieces(self):
+        return self.lines + self.arcs
+
+    def describe(self):
+        return (
+            f"{self.name}: {self.vertices_in} vertices -> {self.lines} tracks + {self.arcs} arcs "
+            f"(max deviation {self.max_deviation_mm:.3f} mm)"
+        )
+
+
+def line_deviation(points):
+    """Largest distance from the points to the chord between the first and last."""
+    start, end = points[0], points[-1]
+    chord = end - start
+    length = np.hypot(*chord)
+    offsets = points - start
+    if length == 0:
+        return float(np.hypot(offsets[:, 0], offsets[:, 1]).max())
+    return float(np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]).max() / length)
+
+
+def circle_through(first, second, third):
+    """Centre and radius of the circle through three points, or None when they are collinear."""
+    (ax, ay), (bx, by), (cx, cy) = first, second, third
+    determinant = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    if abs(determinant) < 1e-12:
+        return None
+    a2, b2, c2 = ax * ax + ay * ay, bx * bx + by * by, cx * cx + cy * cy
+    centre = np.array((
+        (a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / determinant,
+        (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / determinant,
+    ))
+    return centre, float(np.hypot(*(np.asarray(first) - centre)))
+
+
+def fit_arc(points, min_radius_mm=MIN_ARC_RADIUS_MM, max_radius_mm=MAX_ARC_RADIUS_MM):
+    """
+    The arc from the first point to the last through the middle one, as
+    (deviation, mid point), or (inf, None) when the points do not sweep
+    steadily one way round it. The deviation also covers the midpoint of
+    every edge, so long straight edges cannot cut a corner off the arc.
+    """
+    circle = circle_through(points[0], points[len(points) // 2], points[-1])
+    if circle is None:
+        return np.inf, None
+    centre, radius = circle
+    if not min_radius_mm <= radius <= max_radius_mm:
+        return np.inf, None
+
+    offsets = points - centre
+    angles = np.unwrap(np.arctan2(offsets[:, 1], offsets[:, 0]))
+    steps = np.diff(angles)
+    if not (np.all(steps > 0) or np.all(steps < 0)) or abs(angles[-1] - angles[0]) >= 2 * np.pi:
+        return np.inf, None
+
+    samples = np.concatenate((offsets, (offsets[:-1] + offsets[1:]) / 2))
+    deviation = float(np.abs(np.hypot(samples[:, 0], samples[:, 1]) - radius).max())
+    mid_angle = (angles[0] + angles[-1]) / 2
+    mid = centre + radius * np.array((np.cos(mid_angle), np.sin(mid_angle)))
+    return deviation, (float(mid[0]), float(mid[1]))
+
+
+def fit_window(points, tolerance_mm):
+    """The best single piece over the points as (deviation, mid), mid None for a line; None if neither fits."""
+    deviation = line_deviation(points)
+    if deviation <= tolerance_mm:
+        return deviation, None
+    deviation, mid = fit_arc(points)
+    if deviation <= tolerance_mm:
+        return deviation, mid
+    return None
+
+
+def fit_polyline(name, points, tolerance_mm=ARC_FIT_TOLERANCE_MM):
+    """
+    Greedily covers a polyline in PCB millimetres with as few straight and
+    arc pieces as keep every vertex within tolerance_mm. Each piece is
+    grown from the previous one's end by doubling its vertex span until it
+    no longer fits, then bisecting back, so a line of n vertices costs
+    O(n log n) small fits rather than one per pair. Pieces start and end
+    on original vertices, so consecutive pieces always meet.
+    """
+    points = np.asarray(points, dtype=float)
+    # Repeated vertices would make zero-length edges and degenerate arcs.
+    if len(points) > 1:
+        points = points[np.concatenate(([True], np.any(np.diff(points, axis=0) != 0, axis=1)))]
+    if len(points) < 2:
+        return [], ArcFitReport(name, len(points), 0, 0, 0.0)
+
+    pieces = []
+    max_deviation_mm = 0.0
+    start = 0
+    last = len(points) - 1
+    while start < last:
+        # Any two vertices fit a straight line, so the piece always reaches start + 1.
+        best_end, best_fit = start + 1, (0.0, None)
+        span = 2
+        while start + span <= last:
+            fit = fit_window(points[start:start + span + 1], tolerance_mm)
+            if fit is None:
+                break
+            best_end, best_fit = start + span, fit
+            span *= 2
+        low, high = best_end, min(start + span, last + 1)
+        while high - low > 1:
+            middle = (low + high) // 2
+            fit = fit_window(points[start:middle + 1], tolerance_mm)
+            if fit is None:
+                high = middle
+            else:
+                low, best_end, best_fit = middle, middle, fit
+
+        deviation, mid = best_fit
+        pieces.append(FittedPiece(tuple(points[start].tolist()), tuple(points[best_end].tolist()), mid))
+        max_deviation_mm = max(max_deviation_mm, deviation)
+        start = best_end
+
+    arcs = sum(piece.is_arc for piece in pieces)
+    return pieces, ArcFitReport(name, len(points), len(pieces) - arcs, arcs, max_deviation_mm)
+
+
+def combine_fit_reports(name, reports):
+    reports = list(reports)
+    return ArcFitReport(
+        name=name,
+        vertices_in=sum(report.vertices_in for report in reports),
+        lines=sum(report.lines for report in reports),
+        arcs=sum(report.arcs for report in reports),
+        max_deviation_mm=max((report.max_deviation_mm for report in reports), default=0.0),
+    )
+
+
+def sample_arc(piece, max_sagitta_mm=ARC_SAMPLE_SAGITTA_MM):
+    """Points along an arc piece, start and end included, with chords no further than max_sagitta_mm inside it."""
+    centre, radius = circle_through(piece.start, piece.mid, piece.end)
+    angles = np.unwrap([np.arctan2(y - centre[1], x - centre[0]) for x, y in (piece.start, piece.mid, piece.end)])
+    sweep = angles[2] - angles[0]
+    step = 2 * np.arccos(max(1 - max_sagitta_mm / radius, -1.0))
+    count = max(int(np.ceil(abs(sweep) / step)), 2)
+    sample_angles = angles[0] + sweep * np.linspace(0.0, 1.0, count + 1)
+    points = centre + radius * np.column_stack((np.cos(sample_angles), np.sin(sample_angles)))
+    # Keep the piece's own ends exactly, so sampled pieces still meet.
+    points[0], points[-1] = piece.start, piece.end
+    return points
+
+
+def pieces_to_polyline(pieces, max_sagitta_mm=ARC_SAMPLE_SAGITTA_MM):
+    """The fitted pieces of one line as a single polyline in PCB millimetres, arcs sampled by sample_arc."""
+    if not pieces:
+        return np.zeros((0, 2))
+    parts = [np.array([pieces[0].start])]
+    for piece in pieces:
+        if piece.is_arc:
+            parts.append(sample_arc(piece, max_sagitta_mm)[1:])
+        else:
+            parts.append(np.array([piece.end]))
+    return np.concatenate(parts)
@@ -0,0 +1,499 @@
+import argparse
+import json
+import pickle
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+import digest_coastline_geojson
+import digest_tracks
+import feed_decoder
+import generate_synthetic_network
+import tiling
+from line_refs import LIGHT_RAIL_REFS, TRAIN_REFS
+from MapProjection import DEFAULT_PROJECTION_BACKEND, PROJECTION_BACKENDS, MapProjection, measure_projection_error
+
+BENCHMARK_HISTORY_PATH = "benchmark_history.json"
+DEFAULT_SCALES = (1, 4)
+# A stage counts as regressed when it is this much slower than the previous run at the same scale.
+REGRESSION_THRESHOLD = 0.25
+# Changes smaller than this are timer noise whatever their percentage.
+REGRESSION_MIN_SECONDS = 0.005
+DEFAULT_REPEAT = 3
+PROJECTION_BENCHMARK_POINTS = 1_000_000
+COASTLINE_INPUT_PATH = "coastline.geojson"
+BOARD_WIDTH_METRES = 5000
+BOARD_HEIGHT_METRES = 8000
+BENCHMARK_TILE_GRID = (4, 4)
+# A full-network VehiclePositions feed is mostly buses, with the map's lines a small share.
+FEED_FIXTURE_VEHICLES = 3000
+FEED_FIXTURE_BUS_ROUTES = 300
+FEED_FIXTURE_RAIL_SHARE = 0.25
+# The live runtime only needs Track and Station, and has to start quickly on a Raspberry Pi.
+STARTUP_MODULES = ("Track", "Station")
+STARTUP_BUDGET_SECONDS = 0.5
+# Dependencies the startup modules must leave to the code paths that need them.
+LAZY_MODULES = ("shapely", "matplotlib", "kipy")
+STARTUP_PROBE = """
+import json, resource, sys, time
+start = time.process_time()
+for name in sys.argv[1:]:
+    __import__(name)
+print(json.dumps({
+    "cpu_s": time.process_time() - start,
+    "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3,
+    "loaded": sorted(sys.modules),
+}))
+"""
+
+
+class StubBoard:
+    """Stands in for the KiCad board so item generation can run without IPC."""
+
+    def get_nets(self):
+        return []
+
+    def create_items(self, items):
+        return items
+
+    def update_items(self, items):
+        return items
+
+
+def densify_coordinates(coords, factor):
+    """Inserts factor - 1 evenly spaced vertices into every segment of a coordinate list."""
+    coords = np.asarray(coords, dtype=float)
+    if factor <= 1 or len(coords) < 2:
+        return coords.tolist()
+    steps = np.arange(factor) / factor
+    starts = coords[:-1, None, :]
+    deltas = (coords[1:] - coords[:-1])[:, None, :]
+    dense = (starts + deltas * steps[None, :, None]).reshape(-1, coords.shape[1])
+    return np.vstack((dense, coords[-1:])).tolist()
+
+
+def scale_export(data, factor):
+    """Returns a copy of an overpass export with every line densified by factor."""
+    if factor <= 1:
+        return data
+    features = []
+    for feature in data["features"]:
+        geometry = feature["geometry"]
+        if geometry["type"] == "LineString":
+            geometry = {"type": "LineString", "coordinates": densify_coordinates(geometry["coordinates"], factor)}
+        elif geometry["type"] == "MultiLineString":
+            geometry = {
+                "type": "MultiLineString",
+                "coordinates": [densify_coordinates(coords, factor) for coords in geometry["coordinates"]],
+            }
+        features.append({**feature, "geometry": geometry})
+    return {**data, "features": features}
+
+
+def measure(stage, scale, function, *args, repeat=DEFAULT_REPEAT, **kwargs):
+    """
+    Times the best of repeat untraced runs, then runs once more under
+    tracemalloc for peak memory, whose tracing overhead would skew the timing.
+    """
+    wall_seconds = cpu_seconds = float("inf")
+    for _ in range(repeat):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        function(*args, **kwargs)
+        cpu_seconds = min(cpu_seconds, time.process_time() - cpu_start)
+        wall_seconds = min(wall_seconds, time.perf_counter() - wall_start)
+
+    tracemalloc.start()
+    result = function(*args, **kwargs)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    record = {
+        "stage": stage,
+        "scale": scale,
+        "wall_s": wall_seconds,
+        "cpu_s": cpu_seconds,
+        "peak_mb": peak_bytes / 1e6,
+    }
+    return result, record
+
+
+def measure_startup(modules=STARTUP_MODULES, repeat=DEFAULT_REPEAT):
+    """
+    Times a fresh interpreter importing modules, best of repeat, including
+    interpreter start-up. Peak is the child's resident set, not tracemalloc.
+    """
+    wall_seconds = float("inf")
+    for _ in range(repeat):
+        wall_start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE, *modules],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).resolve().parent,
+        )
+        wall_seconds = min(wall_seconds, time.perf_counter() - wall_start)
+    probe = json.loads(result.stdout)
+    loaded = {name.split(".")[0] for name in probe["loaded"]}
+    return {
+        "stage": f"import {', '.join(modules)}",
+        "scale": 1,
+        "wall_s": wall_seconds,
+        "cpu_s": probe["cpu_s"],
+        "peak_mb": probe["peak_mb"],
+        "budget_s": STARTUP_BUDGET_SECONDS,
+        "eager_imports": sorted(loaded.intersection(LAZY_MODULES)),
+    }
+
+
+def skipped(stage, scale, reason):
+    return {"stage": stage, "scale": scale, "skipped": reason}
+
+
+def load_inputs():
+    inputs = {}
+    for name, path in (
+        ("lightrail", digest_tracks.LIGHT_RAIL_INPUT_PATH),
+        ("trains", "trains.geojson"),
+        ("coastline", COASTLINE_INPUT_PATH),
+    ):
+        with open(path) as file:
+            inputs[name] = json.load(file)
+    return inputs
+
+
+def get_projection(backend=DEFAULT_PROJECTION_BACKEND):
+    return MapProjection(
+        origin_lon=digest_coastline_geojson.MAP_ORIGIN_LON,
+        origin_lat=digest_coastline_geojson.MAP_ORIGIN_LAT,
+        scale=digest_coastline_geojson.MAP_SCALE,
+        pcb_origin_mm=digest_coastline_geojson.PCB_ORIGIN_MM,
+        backend=backend,
+    )
+
+
+def measure_projections(points=PROJECTION_BENCHMARK_POINTS):
+    """Throughput of geo_to_map for every backend, with its worst error over the board extent."""
+    records = []
+    rng = np.random.default_rng(0)
+    reference = get_projection("geodesic")
+    half_extent = np.array([BOARD_WIDTH_METRES / 2, BOARD_HEIGHT_METRES / 2])
+    map_points = rng.uniform(-half_extent, half_extent, size=(points, 2))
+    longitudes, latitudes = reference.map_to_geo(map_points[:, 0], map_points[:, 1])
+    for backend in PROJECTION_BACKENDS:
+        projection = get_projection(backend)
+        _, record = measure(f"geo_to_map[{backend}]", 1, projection.geo_to_map, longitudes, latitudes)
+        record["points_per_s"] = points / record["wall_s"]
+        record.update(measure_projection_error(projection, BOARD_WIDTH_METRES, BOARD_HEIGHT_METRES))
+        records.append(record)
+    return records
+
+
+def build_feed_fixture(vehicles=FEED_FIXTURE_VEHICLES, seed=0):
+    """A VehiclePositions feed shaped like the full Sydney one: buses on many routes, then trains and light rail."""
+    rng = np.random.default_rng(seed)
+    bus_routes = [f"{2000 + index}_{100 + index}" for index in range(FEED_FIXTURE_BUS_ROUTES)]
+    rail_routes = [f"{ref}_1" for ref in (*feed_decoder.MAP_ROUTE_REFS, "L1", "M1", "BMT", "CCN", "SCO")]
+    route_ids = np.where(
+        rng.random(vehicles) < FEED_FIXTURE_RAIL_SHARE,
+        rng.choice(rail_routes, size=vehicles),
+        rng.choice(bus_routes, size=vehicles),
+    )
+    rows = [
+        (
+            f"{index}.T.1.10",
+            str(route_id),
+            int(rng.integers(2)),
+            float(digest_coastline_geojson.MAP_ORIGIN_LAT + rng.uniform(-0.2, 0.2)),
+            float(digest_coastline_geojson.MAP_ORIGIN_LON + rng.uniform(-0.2, 0.2)),
+            float(rng.uniform(0, 360)),
+            1_700_000_000 + index,
+        )
+        for index, route_id in enumerate(route_ids)
+    ]
+    return feed_decoder.encode_vehicle_feed(1_700_000_000, rows)
+
+
+def measure_feed_decoding(fixture_path=None):
+    """
+    Decode time of one VehiclePositions message, selective against the full
+    gtfs-realtime-bindings decode. Peak memory only sees Python allocations,
+    so it undercounts the bindings, which allocate in C.
+    """
+    data = build_feed_fixture() if fixture_path is None else Path(fixture_path).read_bytes()
+    records = []
+    for name, refs in (("map refs", feed_decoder.MAP_ROUTE_REFS), ("light rail", LIGHT_RAIL_REFS)):
+        decoder = feed_decoder.VehiclePositionDecoder(refs)
+        (_, vehicles), record = measure(f"decode_feed[{name}]", 1, decoder.decode, data)
+        record["vehicles"] = len(vehicles)
+        records.append(record)
+    try:
+        (_, vehicles), record = measure("decode_feed[bindings]", 1, feed_decoder.decode_vehicle_positions_generic, data)
+    except ImportError:
+        records.append(skipped("decode_feed[bindings]", 1, "gtfs-realtime-bindings not installed"))
+        return records
+    record["vehicles"] = len(vehicles)
+    for compact_record in records:
+        compact_record["speedup"] = record["wall_s"] / compact_record["wall_s"]
+    records.append(record)
+    return records
+
+
+def build_coastline_polygons(data, projection):
+    extent = digest_coastline_geojson.get_extent(
+        BOARD_WIDTH_METRES, BOARD_HEIGHT_METRES, digest_coastline_geojson.EXTENT_MARGIN_METRES
+    )
+    chains = digest_coastline_geojson.join_ways(list(digest_coastline_geojson.iter_coastline_ways(data)))
+    chains_map = [np.column_stack(projection.geo_to_map(chain[:, 0], chain[:, 1])) for chain in chains]
+    land, water, _ = digest_coastline_geojson.build_coastline_polygons(chains_map, extent)
+    return {"extent": extent, "land": land, "water": water}
+
+
+def run_board_stages(scale, projection, coastline, light_rail_lines, train_route_groups, records):
+    try:
+        import create_board
+    except ImportError as error:
+        reason = f"create_board unavailable: {error}"
+        records.append(skipped("build_ground_pour_zones", scale, reason))
+        records.append(skipped("create_line", scale, reason))
+        return
+
+    create_board.board = StubBoard()
+    create_board.nets_by_name = None
+    create_board.board_clip_rect = None
+    board_rect_pcb = create_board.get_board_rect_pcb(projection, BOARD_WIDTH_METRES, BOARD_HEIGHT_METRES)
+
+    with tempfile.TemporaryDirectory() as directory:
+        create_board.COASTLINE_POLYGONS_PATH = str(Path(directory) / "coastline_polygons.pckl")
+        create_board.GROUND_POUR_CACHE_PATH = str(Path(directory) / "ground_pour_geometry.pckl")
+        with open(create_board.COASTLINE_POLYGONS_PATH, "wb") as file:
+            pickle.dump(coastline, file)
+        _, record = measure(
+            "build_ground_pour_zones", scale, create_board.build_ground_pour_zones, projection, board_rect_pcb
+        )
+        records.append(record)
+
+    def create_all_lines():
+        create_board.items_to_add = []
+        for line in light_rail_lines:
+            create_board.create_line(line.track, projection, layer="BL_B_Cu", width=1)
+        for ref in TRAIN_REFS:
+            if ref in train_route_groups:
+                create_board.create_line(train_route_groups[ref], projection, layer="BL_F_Mask", width=0.3)
+        return len(create_board.items_to_add)
+
+    item_count, record = measure("create_line", scale, create_all_lines)
+    record["items"] = item_count
+    records.append(record)
+
+
+def get_synthetic_inputs(routes, vertices_per_route):
+    spec = generate_synthetic_network.SyntheticNetworkSpec(
+        light_rail_routes=2,
+        train_routes=max(routes, len(TRAIN_REFS)),
+        vertices_per_route=vertices_per_route,
+    )
+    return generate_synthetic_network.generate_network(spec), generate_synthetic_network.get_light_rail_specs(spec)
+
+
+def run_benchmarks(
+    scales, synthetic_routes=None, synthetic_vertices=None, backend=DEFAULT_PROJECTION_BACKEND, feed_fixture=None
+):
+    records = [measure_startup(), *measure_projections(), *measure_feed_decoding(feed_fixture)]
+    projection = get_projection(backend)
+    if synthetic_routes is None:
+        raw_inputs, record = measure("load_geojson", 1, load_inputs)
+        light_rail_specs = digest_tracks.LIGHT_RAIL_SPECS
+    else:
+        (raw_inputs, light_rail_specs), record = measure(
+            "generate_synthetic_network", 1, get_synthetic_inputs, synthetic_routes, synthetic_vertices, repeat=1
+        )
+    records.append(record)
+
+    for scale in scales:
+        lightrail = scale_export(raw_inputs["lightrail"], scale)
+        trains = scale_export(raw_inputs["trains"], scale)
+        coastline_data = scale_export(raw_inputs["coastline"], scale)
+
+        def merge_all_routes():
+            for spec in light_rail_specs:
+                for destination in (spec.destination_a, spec.destination_b):
+                    segments = digest_tracks.get_light_rail_route_segments(lightrail, spec.ref, destination)
+                    if segments:
+                        digest_tracks.merge_line_segments(segments)
+
+        _, record = measure("merge_line_segments", scale, merge_all_routes)
+        records.append(record)
+
+        def build_all_light_rail_lines():
+            return [digest_tracks.build_light_rail_line(spec, lightrail, projection) for spec in light_rail_specs]
+
+        light_rail_lines, record = measure("build_light_rail_line", scale, build_all_light_rail_lines)
+        records.append(record)
+
+        def rebuild_pseudo_stations():
+            for line in light_rail_lines:
+                digest_tracks.get_pseudo_stations(line.stations, line.track, projection, 75.0)
+
+        _, record = measure("get_pseudo_stations", scale, rebuild_pseudo_stations)
+        records.append(record)
+
+        train_route_groups, record = measure(
+            "build_train_route_groups", scale, digest_tracks.build_train_route_groups, trains, projection
+        )
+        records.append(record)
+
+        lines_by_ref = {line.ref: line.track for line in light_rail_lines}
+        lines_by_ref.update(train_route_groups)
+        stations = [station for line in light_rail_lines for station in line.stations]
+        tiles = tiling.make_tiles(projection, BOARD_WIDTH_METRES, BOARD_HEIGHT_METRES, *BENCHMARK_TILE_GRID)
+        _, record = measure("split_digest_into_tiles", scale, tiling.split_digest_into_tiles, lines_by_ref, stations, tiles)
+        records.append(record)
+
+        coastline, record = measure("build_coastline_polygons", scale, build_coastline_polygons, coastline_data, projection)
+        records.append(record)
+
+        run_board_stages(scale, projection, coastline, light_rail_lines, train_route_groups, records)
+    return records
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not Path(path).exists():
+        return []
+    with open(path) as file:
+        return json.load(file)
+
+
+def find_regressions(records, previous_run):
+    if previous_run is None:
+        return {}
+    previous = {
+        (record["stage"], record["scale"]): record
+        for record in previous_run["records"]
+        if "wall_s" in record
+    }
+    changes = {}
+    for record in records:
+        earlier = previous.get((record["stage"], record["scale"]))
+        if earlier is None or "wall_s" not in record or earlier["wall_s"] <= 0:
+            continue
+        if abs(record["wall_s"] - earlier["wall_s"]) < REGRESSION_MIN_SECONDS:
+            changes[(record["stage"], record["scale"])] = 0.0
+            continue
+        changes[(record["stage"], record["scale"])] = record["wall_s"] / earlier["wall_s"] - 1
+    return changes
+
+
+def print_report(records, changes):
+    print(f"{'stage':34s} {'scale':>5s} {'wall s':>9s} {'cpu s':>9s} {'peak MB':>9s} {'vs last':>9s}")
+    for record in records:
+        if "skipped" in record:
+            print(f"{record['stage']:34s} {record['scale']:>5d} skipped ({record['skipped']})")
+            continue
+        change = changes.get((record["stage"], record["scale"]))
+        change_text = "" if change is None else f"{change:+.0%}"
+        flag = "  REGRESSION" if change is not None and change > REGRESSION_THRESHOLD else ""
+        if record["wall_s"] > record.get("budget_s", float("inf")):
+            flag += f"  OVER BUDGET ({record['budget_s']} s)"
+        if record.get("eager_imports"):
+            flag += f"  EAGER IMPORTS ({', '.join(record['eager_imports'])})"
+        if "max_distance_error_m" in record:
+            flag += (
+                f"  {record['points_per_s'] / 1e6:.1f} Mpts/s, max distance error {record['max_distance_error_m']:.4f} m,"
+                f" round trip {record['max_round_trip_m']:.1e} m"
+            )
+        if "vehicles" in record:
+            flag += f"  {record['vehicles']} vehicles"
+        if "speedup" in record:
+            flag += f", {record['speedup']:.1f}x the bindings"
+        print(
+            f"{record['stage']:34s} {record['scale']:>5d} {record['wall_s']:>9.4f} "
+            f"{record['cpu_s']:>9.4f} {record['peak_mb']:>9.2f} {change_text:>9s}{flag}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time each stage of the digest -> board pipeline")
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_SCALES),
+        help="Densification factors applied to every input line",
+    )
+    parser.add_argument("--history", default=BENCHMARK_HISTORY_PATH, help="JSON file the results are appended to")
+    parser.add_argument("--no-save", action="store_true", help="Print results without appending them to the history")
+    parser.add_argument(
+        "--projection",
+        choices=PROJECTION_BACKENDS,
+        default=DEFAULT_PROJECTION_BACKEND,
+        help="Projection backend used by the pipeline stages",
+    )
+    parser.add_argument(
+        "--synthetic-routes",
+        type=int,
+        help="Benchmark a generated network with this many train routes instead of the Sydney exports",
+    )
+    parser.add_argument(
+        "--synthetic-vertices",
+        type=int,
+        default=generate_synthetic_network.SyntheticNetworkSpec.vertices_per_route,
+        help="Vertices per direction of each generated route",
+    )
+    parser.add_argument(
+        "--feed-fixture",
+        help="Recorded GTFS-realtime VehiclePositions message to decode instead of the generated one",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    records = run_benchmarks(
+        args.scales, args.synthetic_routes, args.synthetic_vertices, args.projection, args.feed_fixture
+    )
+    if args.synthetic_routes is None:
+        inputs = "sydney"
+    else:
+        inputs = f"synthetic:{args.synthetic_routes}x{args.synthetic_vertices}"
+    if args.projection != DEFAULT_PROJECTION_BACKEND:
+        inputs += f" ({args.projection})"
+    if args.feed_fixture:
+        inputs += f" feed:{Path(args.feed_fixture).name}"
+    history = load_history(args.history)
+    # Only runs over the same inputs are comparable.
+    previous_runs = [run for run in history if run.get("inputs", "sydney") == inputs]
+    changes = find_regressions(records, previous_runs[-1] if previous_runs else None)
+    print_report(records, changes)
+
+    if not args.no_save:
+        history.append({
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": get_git_commit(),
+            "python": platform.python_version(),
+            "inputs": inputs,
+            "records": records,
+        })
+        with open(args.history, "w") as file:
+            json.dump(history, file, indent=2)
+        print(f"Appended results to {args.history}")
+
+
+if __name__ == "__main__":
+    main()
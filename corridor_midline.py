@@ -0,0 +1,168 @@
+from dataclasses import dataclass
+
+import numpy as np
+import shapely
+
+from lod_pyramid import cumulative_chainage
+
+# Midline vertex spacing in map metres: about what 3000 fixed points gave a 12 km line,
+# but a 2 km line now gets 500 points rather than the same 3000.
+CORRIDOR_SAMPLE_SPACING_M = 4.0
+# Spacing of the samples used only to score how well two directional tracks pair up.
+CORRIDOR_PAIRING_SPACING_M = 25.0
+# Opposite directions further apart than this have split onto different streets.
+CORRIDOR_MAX_SEPARATION_M = 40.0
+# Midlines of two lines this close run along the same corridor...
+SHARED_CORRIDOR_TOLERANCE_M = 15.0
+# ...once they stay together for at least this far.
+SHARED_CORRIDOR_MIN_LENGTH_M = 150.0
+
+
+@dataclass(frozen=True)
+class SharedCorridor:
+    """A stretch of one line's track, by chainage, that runs along an earlier line's track."""
+    ref: str
+    shared_with: str
+    start_chainage: float
+    end_chainage: float
+
+    @property
+    def length(self):
+        return self.end_chainage - self.start_chainage
+
+    def contains(self, chainage):
+        return self.start_chainage <= chainage <= self.end_chainage
+
+    def describe(self):
+        return (
+            f"{self.ref} shares {self.length:.0f} m with {self.shared_with} "
+            f"(chainage {self.start_chainage:.0f}-{self.end_chainage:.0f} m)"
+        )
+
+
+def resample_by_spacing(xs, ys, spacing_m):
+    """Evenly spaced points along a polyline, as many as its length needs at spacing_m apart."""
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    chainage = cumulative_chainage(xs, ys)
+    count = max(2, int(np.ceil(chainage[-1] / spacing_m)) + 1)
+    target_chainage = np.linspace(0.0, chainage[-1], count)
+    return np.interp(target_chainage, chainage, xs), np.interp(target_chainage, chainage, ys)
+
+
+def nearest_points_on_line(xs, ys, point_xs, point_ys):
+    """
+    The closest point on the polyline (xs, ys) to each query point, and its
+    distance. An STRtree over the polyline's segments finds each point's
+    nearest segment, so the cost is O((n + m) log m) rather than O(n * m).
+    """
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    point_xs = np.asarray(point_xs, dtype=float)
+    point_ys = np.asarray(point_ys, dtype=float)
+    starts = np.column_stack((xs[:-1], ys[:-1]))
+    ends = np.column_stack((xs[1:], ys[1:]))
+    segments = shapely.linestrings(np.stack((starts, ends), axis=1))
+    points = shapely.points(point_xs, point_ys)
+
+    point_indices, segment_indices = shapely.STRtree(segments).query_nearest(points, all_matches=False)
+    nearest_segment = np.empty(len(points), dtype=np.int64)
+    nearest_segment[point_indices] = segment_indices
+
+    start = starts[nearest_segment]
+    direction = ends[nearest_segment] - start
+    length_squared = np.einsum("ij,ij->i", direction, direction)
+    offset = np.column_stack((point_xs, point_ys)) - start
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.clip(np.einsum("ij,ij->i", offset, direction) / length_squared, 0.0, 1.0)
+    t = np.nan_to_num(t)
+    nearest = start + t[:, None] * direction
+    distance = np.hypot(nearest[:, 0] - point_xs, nearest[:, 1] - point_ys)
+    return nearest[:, 0], nearest[:, 1], distance
+
+
+def pairing_distance(line_a, line_b, spacing_m=CORRIDOR_PAIRING_SPACING_M):
+    """
+    How far apart two polylines typically are: the larger of the median
+    distances from each one's samples to the other. Taking the larger stops
+    a short working, which lies on its full-length route, from pairing with it.
+    """
+    distances = []
+    for (xs, ys), (other_xs, other_ys) in ((line_a, line_b), (line_b, line_a)):
+        sample_xs, sample_ys = resample_by_spacing(xs, ys, spacing_m)
+        distances.append(float(np.median(nearest_points_on_line(other_xs, other_ys, sample_xs, sample_ys)[2])))
+    return max(distances)
+
+
+def pair_directional_lines(lines, max_separation_m=CORRIDOR_MAX_SEPARATION_M):
+    """
+    Pairs up directional tracks, given as {name: (xs, ys)}, closest pair
+    first. Tracks with no partner within max_separation_m stay on their own.
+    Returns tuples of one or two names, longest corridor first.
+    """
+    names = list(lines)
+    candidates = sorted(
+        (pairing_distance(lines[name_a], lines[name_b]), name_a, name_b)
+        for index, name_a in enumerate(names)
+        for name_b in names[index + 1:]
+    )
+    paired = set()
+    corridors = []
+    for distance, name_a, name_b in candidates:
+        if distance > max_separation_m or name_a in paired or name_b in paired:
+            continue
+        paired.update((name_a, name_b))
+        corridors.append((name_a, name_b))
+    corridors.extend((name,) for name in names if name not in paired)
+
+    def corridor_length(corridor):
+        return max(cumulative_chainage(*lines[name])[-1] for name in corridor)
+
+    return sorted(corridors, key=corridor_length, reverse=True)
+
+
+def corridor_midline(
+    line_a,
+    line_b,
+    spacing_m=CORRIDOR_SAMPLE_SPACING_M,
+    max_separation_m=CORRIDOR_MAX_SEPARATION_M,
+):
+    """
+    The midline of two directional tracks, following line_a. Each sample of
+    line_a is matched to its nearest point on line_b, whichever way line_b
+    runs. Where the directions split the midline eases back onto line_a, so
+    there is no step where they part.
+    """
+    sample_xs, sample_ys = resample_by_spacing(*line_a, spacing_m)
+    nearest_xs, nearest_ys, distance = nearest_points_on_line(*line_b, sample_xs, sample_ys)
+    half_separation_m = max_separation_m / 2
+    weight = 0.5 * np.clip((max_separation_m - distance) / half_separation_m, 0.0, 1.0)
+    return (
+        sample_xs + weight * (nearest_xs - sample_xs),
+        sample_ys + weight * (nearest_ys - sample_ys),
+    )
+
+
+def find_shared_corridors(
+    ref,
+    line,
+    other_ref,
+    other_line,
+    tolerance_m=SHARED_CORRIDOR_TOLERANCE_M,
+    min_length_m=SHARED_CORRIDOR_MIN_LENGTH_M,
+    spacing_m=CORRIDOR_SAMPLE_SPACING_M,
+):
+    """The stretches of line, by chainage along it, that run within tolerance_m of other_line."""
+    sample_xs, sample_ys = resample_by_spacing(*line, spacing_m)
+    chainage = cumulative_chainage(sample_xs, sample_ys)
+    close = nearest_points_on_line(*other_line, sample_xs, sample_ys)[2] <= tolerance_m
+
+    # Run boundaries: +1 where a close stretch starts, -1 one past where it ends.
+    edges = np.diff(np.concatenate(([0], close.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return [
+        SharedCorridor(ref, other_ref, float(chainage[start]), float(chainage[end]))
+        for start, end in zip(starts, ends)
+        if chainage[end] - chainage[start] >= min_length_m
+    ]
@@ -5,13 +5,23 @@ from kipy.proto.board.board_types_pb2 import BoardLayer
 from kipy.geometry import Vector2, Angle, PolygonWithHoles, PolyLineNode, PolyLine
 from kipy.util import from_mm
 from kipy.proto.common import HorizontalAlignment, VerticalAlignment, StrokeLineStyle
-from MapProjection import MapProjection
-import json
-import matplotlib.pyplot as plt
+from MapProjection import DEFAULT_PROJECTION_BACKEND, PROJECTION_BACKENDS, MapProjection
+from profiling import add_profile_arguments, profiler_from_args, report_profile
+from tiling import TILE_GEOMETRY_PATH, iter_line_parts, line_to_map_geometries, load_tile_geometry
+from line_refs import LIGHT_RAIL_REFS, TRAIN_REFS
+from led_allocation import LED_ALLOCATION_PATH, allocate_leds, write_led_allocation
+from label_placement import format_station_name, label_alignment, label_anchor, label_offset, place_labels, preferred_label_angle
+from arc_fitting import ARC_FIT_TOLERANCE_MM, combine_fit_reports, fit_polyline, pieces_to_polyline
+from preflight import FEED_WIDTH_MM, PREFLIGHT_MODES, VIA_DIAMETER_MM, run_preflight
+import argparse
 import math
+import os
 import pickle
-from matplotlib import colormaps
-from shapely.geometry import GeometryCollection, LineString, MultiLineString, MultiPolygon, Polygon, box
+import numpy as np
+import shapely
+from dataclasses import dataclass
+from shapely.geometry import GeometryCollection, LineString, MultiPolygon, Polygon, box
+from shapely.prepared import prep
 
 MAP_ORIGIN_LON = 151.22289335
 MAP_ORIGIN_LAT = -33.8937485
@@ -19,18 +29,41 @@ PCB_ORIGIN_MM = (148.5, 210.0)
 KICAD_TIMEOUT_MS = 15000
 CREATE_ITEMS_BATCH_SIZE = 500
 GROUND_NET_NAME = "GND"
+POWER_NET_NAME = "+5V"
 MIN_ZONE_AREA_MM2 = 1.0
+COASTLINE_POLYGONS_PATH = 'coastline_polygons.pckl'
+GROUND_POUR_CACHE_PATH = 'ground_pour_geometry.pckl'
+LED_VIA_OFFSET_MM = 0.6
 board_clip_rect = None
+nets_by_name = None
+
+
+@dataclass
+class StationPlacement:
+    """Everything placed around each station LED, one array row per station."""
+    names: list[str]
+    pcb_x: np.ndarray
+    pcb_y: np.ndarray
+    orientation: np.ndarray
+    gnd_pad: np.ndarray
+    gnd_via: np.ndarray
+    power_pad: np.ndarray
+    power_via: np.ndarray
+    power_tap: np.ndarray
+    outline_corners: np.ndarray
+    label_angle: np.ndarray
+    label_anchor: np.ndarray
+    leader_end: np.ndarray
+
 
 def get_net_by_name(name: str):
-    nets = board.get_nets()
-    for net in nets:
-        if net.name == name:
-            return net
-    return None
+    global nets_by_name
+    if nets_by_name is None:
+        nets_by_name = {net.name: net for net in board.get_nets()}
+    return nets_by_name.get(name)
     
 def add_via(
-    x: float, y: float, net: str, diameter_mm: float = 0.5, drill_mm: float = 0.3
+    x: float, y: float, net: str, diameter_mm: float = VIA_DIAMETER_MM, drill_mm: float = 0.3
 ):
     via = Via()
     net_object = get_net_by_name(net)
@@ -48,6 +81,31 @@ def get_pad_position(footprint, net):
     return None
 
 
+def rotate_kicad(dx, dy, angle_degrees):
+    """Rotates offsets by angles in KiCad's convention (counter-clockwise on screen, y down)."""
+    theta = np.radians(angle_degrees)
+    cos_theta = np.cos(theta)
+    sin_theta = np.sin(theta)
+    return dx * cos_theta + dy * sin_theta, -dx * sin_theta + dy * cos_theta
+
+
+def get_pad_offsets(footprints, nets):
+    """
+    Reads each footprint's pads once and returns, per net, an (N, 2) array of
+    pad offsets in the footprint's own unrotated frame.
+    """
+    offsets = {net: np.zeros((len(footprints), 2)) for net in nets}
+    for idx, footprint in enumerate(footprints):
+        origin_x = footprint.position.x / 1e6
+        origin_y = footprint.position.y / 1e6
+        for pad in footprint.definition.pads:
+            if pad.net.name in offsets:
+                offsets[pad.net.name][idx] = (pad.position.x / 1e6 - origin_x, pad.position.y / 1e6 - origin_y)
+        for net in nets:
+            offsets[net][idx] = rotate_kicad(*offsets[net][idx], -footprint.orientation.degrees)
+    return offsets
+
+
 def get_pad_by_number(footprint, pad_number):
     for pad in footprint.definition.pads:
         if str(pad.number) == str(pad_number):
@@ -105,30 +163,32 @@ def create_items_in_batches(items, batch_size=CREATE_ITEMS_BATCH_SIZE):
         board.create_items(items[start:start + batch_size])
 
 
-def map_polyline_to_pcb_polyline(xs, ys, projection, reverse=False):
-    polyline = PolyLine()
-    points = list(zip(xs, ys))
-    if reverse:
-        points.reverse()
+def nm_from_mm(values):
+    """Vectorised from_mm: converts an array of millimetres to integer nanometres."""
+    return np.round(np.asarray(values, dtype=float) * 1_000_000).astype(np.int64)
 
-    for map_x, map_y in points:
-        pcb_x, pcb_y = projection.map_to_pcb(map_x, map_y)
-        polyline.append(PolyLineNode.from_xy(from_mm(pcb_x), from_mm(pcb_y)))
 
+def pcb_points_to_polyline(points_nm, closed=False):
+    polyline = PolyLine()
+    for x_nm, y_nm in points_nm.tolist():
+        polyline.append(PolyLineNode.from_xy(x_nm, y_nm))
+    polyline.closed = closed
     return polyline
 
 
-def pcb_ring_to_polyline(coords):
-    polyline = PolyLine()
-    ring_points = list(coords)
-    if ring_points and ring_points[0] == ring_points[-1]:
-        ring_points = ring_points[:-1]
+def map_polyline_to_pcb_polyline(xs, ys, projection, reverse=False):
+    pcb_x, pcb_y = projection.map_to_pcb(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+    points_nm = nm_from_mm(np.column_stack((pcb_x, pcb_y)))
+    if reverse:
+        points_nm = points_nm[::-1]
+    return pcb_points_to_polyline(points_nm)
 
-    for pcb_x, pcb_y in ring_points:
-        polyline.append(PolyLineNode.from_xy(from_mm(pcb_x), from_mm(pcb_y)))
 
-    polyline.closed = True
-    return polyline
+def pcb_ring_to_polyline(coords):
+    ring = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if len(ring) > 1 and np.array_equal(ring[0], ring[-1]):
+        ring = ring[:-1]
+    return pcb_points_to_polyline(nm_from_mm(ring), closed=True)
 
 
 def get_board_rect_pcb(projection, width_metres, height_metres):
@@ -142,31 +202,17 @@ def get_board_rect_pcb(projection, width_metres, height_metres):
     )
 
 
-def project_map_geometry_to_pcb_polygon(geometry, projection):
-    xs, ys = geometry
-    pcb_x, pcb_y = projection.map_to_pcb(xs, ys)
-    return Polygon(zip(pcb_x, pcb_y)).buffer(0)
+def get_board_rect_map(projection, board_rect_pcb):
+    min_x, min_y, max_x, max_y = board_rect_pcb.bounds
+    map_x, map_y = projection.pcb_to_map(np.array([min_x, max_x]), np.array([min_y, max_y]))
+    return box(map_x.min(), map_y.min(), map_x.max(), map_y.max())
 
 
-def build_water_polygon(coastline_geometry, projection, board_rect_pcb):
-    xs, ys = coastline_geometry
-    pcb_x, pcb_y = projection.map_to_pcb(xs, ys)
-    coastline_coords = list(zip(pcb_x, pcb_y))
-    min_x, min_y, max_x, _ = board_rect_pcb.bounds
-    margin = max(max_x - min_x, board_rect_pcb.bounds[3] - min_y)
+def project_map_geometry_to_pcb(geometry, projection):
+    def to_pcb(coords):
+        return np.column_stack(projection.map_to_pcb(coords[:, 0], coords[:, 1]))
 
-    if coastline_coords[0][0] >= coastline_coords[-1][0]:
-        closure_points = [
-            (min_x - margin, min_y - margin),
-            (max_x + margin, min_y - margin),
-        ]
-    else:
-        closure_points = [
-            (max_x + margin, min_y - margin),
-            (min_x - margin, min_y - margin),
-        ]
-
-    return Polygon(coastline_coords + closure_points).buffer(0).intersection(board_rect_pcb)
+    return shapely.transform(geometry, to_pcb)
 
 
 def iter_polygons(geometry):
@@ -199,73 +245,82 @@ def create_zone_from_polygon(polygon, layer='BL_F_Cu', net_name=GROUND_NET_NAME)
     return zone
 
 
-def build_ground_pour_zones(projection, board_rect_pcb):
-    with open('coastline_geometry.pckl', 'rb') as file:
-        coastline_geometry_roi = pickle.load(file)
-    with open('clark_island_geometry.pckl', 'rb') as file:
-        clark_island_geometry = pickle.load(file)
-
-    water_polygon = build_water_polygon(coastline_geometry_roi, projection, board_rect_pcb)
-    island_polygon = project_map_geometry_to_pcb_polygon(clark_island_geometry, projection)
-
-    min_x, _, _, max_y = board_rect_pcb.bounds
-    exclusion_rect = box(min_x, 300.0, 150.0, max_y)
-
-    copper_geometry = board_rect_pcb.difference(exclusion_rect).difference(
-        water_polygon.difference(island_polygon)
+def build_copper_polygons(projection, board_rect_pcb, legend_keep_out=True):
+    with open(COASTLINE_POLYGONS_PATH, 'rb') as file:
+        coastline = pickle.load(file)
+
+    # The coastline stage already simplified to PCB tolerance; cut it down to
+    # the board in map coordinates before projecting and overlaying.
+    board_rect_map = get_board_rect_map(projection, board_rect_pcb)
+    water_map = shapely.clip_by_rect(coastline['water'], *board_rect_map.bounds)
+    board_prepared = prep(board_rect_pcb)
+    water_polygons = []
+    for polygon in iter_polygons(project_map_geometry_to_pcb(water_map, projection)):
+        if board_prepared.contains(polygon):
+            water_polygons.append(polygon)
+        elif board_prepared.intersects(polygon):
+            water_polygons.append(shapely.intersection(polygon, board_rect_pcb))
+    water_polygon = shapely.union_all(water_polygons)
+
+    copper_geometry = board_rect_pcb
+    if legend_keep_out:
+        min_x, _, _, max_y = board_rect_pcb.bounds
+        exclusion_rect = box(min_x, 300.0, 150.0, max_y)
+        copper_geometry = shapely.difference(copper_geometry, exclusion_rect)
+    copper_geometry = shapely.difference(copper_geometry, water_polygon)
+
+    return [
+        polygon
+        for polygon in iter_polygons(copper_geometry)
+        if polygon.area >= MIN_ZONE_AREA_MM2
+    ]
+
+
+def ground_pour_cache_key(projection, board_rect_pcb, legend_keep_out=True):
+    return (
+        (COASTLINE_POLYGONS_PATH, os.path.getmtime(COASTLINE_POLYGONS_PATH), os.path.getsize(COASTLINE_POLYGONS_PATH)),
+        tuple(projection.origin),
+        projection.scale,
+        tuple(projection.pcb_origin_mm),
+        projection.backend,
+        tuple(board_rect_pcb.bounds),
+        legend_keep_out,
     )
 
-    zones = []
-    for polygon in iter_polygons(copper_geometry):
-        if polygon.area < MIN_ZONE_AREA_MM2:
-            continue
-        zones.append(create_zone_from_polygon(polygon))
-    return zones
 
+def load_copper_polygons(projection, board_rect_pcb, cache_path=None, legend_keep_out=True):
+    """Returns the ground pour polygons, rebuilding them only when the coastline or board changed."""
+    cache_path = cache_path or GROUND_POUR_CACHE_PATH
+    cache_key = ground_pour_cache_key(projection, board_rect_pcb, legend_keep_out)
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as file:
+            cached = pickle.load(file)
+        if cached.get('key') == cache_key:
+            return cached['polygons']
 
-def create_line(line, projection, layer='BL_F_SilkS', width=0.1):
-    if hasattr(line, "track_components"):
-        for track_component in line.track_components:
-            create_line(track_component, projection, layer=layer, width=width)
-        return
-
-    if hasattr(line, "map_x") and hasattr(line, "map_y"):
-        xs = line.map_x
-        ys = line.map_y
-    elif isinstance(line, tuple) and len(line) == 2:
-        xs, ys = line
-    else:
-        raise TypeError(f"Unsupported line geometry type: {type(line)}")
+    polygons = build_copper_polygons(projection, board_rect_pcb, legend_keep_out)
+    with open(cache_path, 'wb') as file:
+        pickle.dump({'key': cache_key, 'polygons': polygons}, file)
+    return polygons
 
-    segments = []
-    line_geometry = LineString(zip(xs, ys))
-    if board_clip_rect is not None:
-        line_geometry = line_geometry.intersection(board_clip_rect)
 
-    if line_geometry.is_empty:
-        return
+def build_ground_pour_zones(projection, board_rect_pcb, cache_path=None, legend_keep_out=True):
+    return [
+        create_zone_from_polygon(polygon)
+        for polygon in load_copper_polygons(projection, board_rect_pcb, cache_path, legend_keep_out)
+    ]
 
-    if isinstance(line_geometry, LineString):
-        line_geometries = [line_geometry]
-    elif isinstance(line_geometry, MultiLineString):
-        line_geometries = list(line_geometry.geoms)
-    elif isinstance(line_geometry, GeometryCollection):
-        line_geometries = [
-            geometry for geometry in line_geometry.geoms if isinstance(geometry, LineString)
-        ]
-    else:
-        return
 
-    for line_part in line_geometries:
-        coords = list(line_part.coords)
+def create_line_segments(line_parts, projection, layer='BL_F_SilkS', width=0.1):
+    """Emits one BoardSegment per edge of already clipped map-coordinate LineStrings."""
+    segments = []
+    for line_part in line_parts:
+        coords = shapely.get_coordinates(line_part)
+        pcb_x, pcb_y = projection.map_to_pcb(coords[:, 0], coords[:, 1])
         for idx in range(len(coords) - 1):
-            x0, y0 = coords[idx]
-            x1, y1 = coords[idx + 1]
-            start_x, start_y = projection.map_to_pcb(x0, y0)
-            end_x, end_y = projection.map_to_pcb(x1, y1)
             boardSegment = BoardSegment()
-            boardSegment.start = Vector2.from_xy_mm(start_x, start_y)
-            boardSegment.end = Vector2.from_xy_mm(end_x, end_y)
+            boardSegment.start = Vector2.from_xy_mm(pcb_x[idx], pcb_y[idx])
+            boardSegment.end = Vector2.from_xy_mm(pcb_x[idx + 1], pcb_y[idx + 1])
             boardSegment.attributes.stroke.width = from_mm(width)
             # arcTrack.attributes.stroke.style = StrokeLineStyle.SLS_SOLID
             boardSegment.layer = layer
@@ -273,45 +328,141 @@ def create_line(line, projection, layer='BL_F_SilkS', width=0.1):
     items_to_add.extend(segments)
 
 
-def format_station_name(name, wrap_at=14):
-    if len(name) <= wrap_at or " " not in name:
-        return name
+def create_fitted_tracks(
+    line_parts, projection, name, layer='BL_B_Cu', width=1.0, net=POWER_NET_NAME, tolerance_mm=ARC_FIT_TOLERANCE_MM
+):
+    """
+    Emits already clipped map-coordinate LineStrings as copper on a net: the
+    fewest straight Track and ArcTrack items that keep the projected midline
+    within tolerance_mm. Returns the copper actually laid, as one PCB
+    LineString per part with its arcs sampled, and the combined ArcFitReport.
+    """
+    net_object = get_net_by_name(net)
+    fitted_lines = []
+    reports = []
+    for line_part in line_parts:
+        coords = shapely.get_coordinates(line_part)
+        pcb_x, pcb_y = projection.map_to_pcb(coords[:, 0], coords[:, 1])
+        pieces, report = fit_polyline(name, np.column_stack((pcb_x, pcb_y)), tolerance_mm)
+        reports.append(report)
+        if pieces:
+            fitted_lines.append(LineString(pieces_to_polyline(pieces)))
+        for piece in pieces:
+            track = ArcTrack() if piece.is_arc else Track()
+            track.start = Vector2.from_xy_mm(*piece.start)
+            if piece.is_arc:
+                track.mid = Vector2.from_xy_mm(*piece.mid)
+            track.end = Vector2.from_xy_mm(*piece.end)
+            track.width = from_mm(width)
+            track.layer = layer
+            if net_object is not None:
+                track.net = net_object
+            items_to_add.append(track)
+    return fitted_lines, combine_fit_reports(name, reports)
+
+
+def clip_line_parts(line):
+    line_parts = line_to_map_geometries(line)
+    if board_clip_rect is not None:
+        line_parts = [
+            part
+            for line_part in line_parts
+            for part in iter_line_parts(line_part.intersection(board_clip_rect))
+        ]
+    return line_parts
+
+
+def create_line(line, projection, layer='BL_F_SilkS', width=0.1):
+    create_line_segments(clip_line_parts(line), projection, layer=layer, width=width)
 
-    words = name.split()
-    best_text = name
-    best_score = len(name)
-    for idx in range(1, len(words)):
-        line1 = " ".join(words[:idx])
-        line2 = " ".join(words[idx:])
-        score = max(len(line1), len(line2))
-        if score < best_score:
-            best_text = f"{line1}\n{line2}"
-            best_score = score
-    return best_text
 
+def get_station_orientations(stations):
+    """Track tangent at every station, one vectorised projection per track."""
+    orientations = np.zeros(len(stations))
+    stations_by_track = {}
+    for idx, station in enumerate(stations):
+        stations_by_track.setdefault(id(station.track), (station.track, []))[1].append(idx)
 
-def add_station_label(station, offset_mm=4.0, size_mm=2.5, layer=BoardLayer.BL_F_SilkS, flip_label_side=False):
-    if not station.name:
-        return
+    for track, indices in stations_by_track.values():
+        points = shapely.points([(stations[idx].map_x, stations[idx].map_y) for idx in indices])
+        dists = shapely.line_locate_point(track.line_cartesian, points)
+        orientations[indices] = track.get_tangents_at_dists(dists)
+    return orientations
 
-    text = BoardText()
-    text.value = format_station_name(station.name)
 
-    label_angle = (station.orientation + 90) % 360
-    if 90 < label_angle < 270:
-        label_angle = (station.orientation - 90) % 360
+def update_label_positions(placement, label_angle, offset_mm):
+    centre = np.column_stack((placement.pcb_x, placement.pcb_y))
+    placement.label_angle = label_angle
+    placement.label_anchor = label_anchor(centre, label_angle, offset_mm)
+    placement.leader_end = label_anchor(centre, label_angle, offset_mm - 1.0)
 
-    if flip_label_side:
-        label_angle = (label_angle + 180) % 360
 
-    if 60 < label_angle < 120 or 240 < label_angle < 300:
-        offset_mm += 0.5
+def compute_station_placements(
+    stations,
+    pad_offsets,
+    via_offset_mm=LED_VIA_OFFSET_MM,
+    outline_size_mm=(2.8, 2.0),
+    label_offset_mm=4.0,
+):
+    names = [station.name for station in stations]
+    pcb_x = np.array([station.pcb_x for station in stations], dtype=float)
+    pcb_y = np.array([station.pcb_y for station in stations], dtype=float)
+    orientation = get_station_orientations(stations)
+    led_orientation = orientation + 180
+    centre = np.column_stack((pcb_x, pcb_y))
+
+    def pad_and_via(net, angle):
+        pad = centre + np.column_stack(rotate_kicad(*pad_offsets[net].T, led_orientation))
+        via_angle = np.radians(led_orientation + angle)
+        via = pad + np.column_stack((-via_offset_mm * np.cos(via_angle), via_offset_mm * np.sin(via_angle)))
+        return pad, via
+
+    gnd_pad, gnd_via = pad_and_via('GND', 90)
+    power_pad, power_via = pad_and_via('+5V', 270)
+
+    # Foot of the perpendicular from the +5V via onto the LED's axis, where the backside feed joins.
+    s = -np.tan(np.radians(led_orientation))
+    x1, y1 = pcb_x, pcb_y
+    x2, y2 = power_via[:, 0], power_via[:, 1]
+    power_tap = np.column_stack((
+        (s**2 * x1 + s * (y2 - y1) + x2) / (s**2 + 1),
+        (s**2 * y2 + s * (x2 - x1) + y1) / (s**2 + 1),
+    ))
+
+    half_width, half_height = outline_size_mm[0] / 2, outline_size_mm[1] / 2
+    corner_dx = np.array([-half_width, half_width, half_width, -half_width])
+    corner_dy = np.array([-half_height, -half_height, half_height, half_height])
+    theta = np.radians(orientation)[:, None]
+    outline_corners = np.stack((
+        pcb_x[:, None] + corner_dx * -np.cos(theta) - corner_dy * np.sin(theta),
+        pcb_y[:, None] + corner_dx * np.sin(theta) + corner_dy * -np.cos(theta),
+    ), axis=-1)
+
+    placement = StationPlacement(
+        names=names,
+        pcb_x=pcb_x,
+        pcb_y=pcb_y,
+        orientation=orientation,
+        gnd_pad=gnd_pad,
+        gnd_via=gnd_via,
+        power_pad=power_pad,
+        power_via=power_via,
+        power_tap=power_tap,
+        outline_corners=outline_corners,
+        label_angle=None,
+        label_anchor=None,
+        leader_end=None,
+    )
+    label_angle = preferred_label_angle(orientation)
+    update_label_positions(placement, label_angle, label_offset(label_angle, label_offset_mm))
+    return placement
 
-    text_x = round(station.pcb_x + offset_mm * math.cos(math.radians(label_angle)), 10)
-    text_y = round(station.pcb_y - offset_mm * math.sin(math.radians(label_angle)), 10)
 
-    text.layer = layer
-    text.position = Vector2.from_xy_mm(text_x, text_y)
+def create_station_label(name, anchor, label_angle, station_x, size_mm=2.5, layer=None):
+    text = BoardText()
+    text.value = format_station_name(name)
+    text.layer = BoardLayer.BL_F_SilkS if layer is None else layer
+    text.position = Vector2.from_xy_mm(*anchor)
     text.attributes.font_name = "Roboto Slab"
     text.attributes.size = Vector2.from_xy_mm(size_mm, size_mm)
     text.attributes.stroke_width = from_mm(0.12)
@@ -320,86 +471,58 @@ def add_station_label(station, offset_mm=4.0, size_mm=2.5, layer=BoardLayer.BL_F
     text.attributes.multiline = "\n" in text.value
     text.attributes.line_spacing = 0.8
 
-    if 80 < label_angle < 100:
-        text.attributes.vertical_alignment = VerticalAlignment.VA_BOTTOM
-        text.attributes.horizontal_alignment = HorizontalAlignment.HA_CENTER
-    elif 260 < label_angle < 280:
-        text.attributes.vertical_alignment = VerticalAlignment.VA_TOP
-        text.attributes.horizontal_alignment = HorizontalAlignment.HA_CENTER
-    else:
-        text.attributes.vertical_alignment = VerticalAlignment.VA_CENTER
-        if text_x >= station.pcb_x:
-            text.attributes.horizontal_alignment = HorizontalAlignment.HA_LEFT
-        else:
-            text.attributes.horizontal_alignment = HorizontalAlignment.HA_RIGHT
-
-    line_end_x = round(station.pcb_x + (offset_mm - 1.0) * math.cos(math.radians(label_angle)), 10)
-    line_end_y = round(station.pcb_y - (offset_mm - 1.0) * math.sin(math.radians(label_angle)), 10)
-    draw_line(station.pcb_x, station.pcb_y, line_end_x, line_end_y, width=0.6, layer='BL_F_SilkS')
-
-    items_to_add.append(text)
-
-
-def draw_station_rectangle(
-    x: float,
-    y: float,
-    width: float,
-    height: float,
-    angle: float = 0,
-    line_width: float = 0.4,
-    layer='BL_F_SilkS',
-):
-    hw = width / 2
-    hh = height / 2
-    corners = [(x - hw, y - hh), (x + hw, y - hh), (x + hw, y + hh), (x - hw, y + hh)]
-
-    theta = math.radians(angle)
-    cos_theta = math.cos(theta)
-    sin_theta = math.sin(theta)
-    rotated_corners = []
-    for cx, cy in corners:
-        dx = cx - x
-        dy = cy - y
-        rx = x + dx * -cos_theta - dy * sin_theta
-        ry = y + dx * sin_theta + dy * -cos_theta
-        rotated_corners.append((rx, ry))
-
-    for idx in range(4):
-        x1, y1 = rotated_corners[idx]
-        x2, y2 = rotated_corners[(idx + 1) % 4]
-        draw_line(x1, y1, x2, y2, width=line_width, layer=layer)
-
-
-def add_station_outline(station, width_mm=2.8, height_mm=2.0, line_width=0.4, layer='BL_F_SilkS'):
-    if not station.name:
-        return
+    horizontal, vertical = label_alignment(label_angle, anchor[0], station_x)
+    text.attributes.horizontal_alignment = {
+        "left": HorizontalAlignment.HA_LEFT,
+        "center": HorizontalAlignment.HA_CENTER,
+        "right": HorizontalAlignment.HA_RIGHT,
+    }[horizontal]
+    text.attributes.vertical_alignment = {
+        "top": VerticalAlignment.VA_TOP,
+        "center": VerticalAlignment.VA_CENTER,
+        "bottom": VerticalAlignment.VA_BOTTOM,
+    }[vertical]
+    return text
+
+
+def emit_station_placements(placement, footprints, copper_layer='BL_F_Cu', outline_width=0.4, feed_width=FEED_WIDTH_MM):
+    led_orientation = placement.orientation + 180
+    for idx, footprint in enumerate(footprints):
+        footprint.position = Vector2.from_xy_mm(placement.pcb_x[idx], placement.pcb_y[idx])
+        footprint.orientation = Angle.from_degrees(led_orientation[idx])
+
+    for pad, via, net in ((placement.gnd_pad, placement.gnd_via, 'GND'), (placement.power_pad, placement.power_via, '+5V')):
+        for (pad_x, pad_y), (via_x, via_y) in zip(pad.tolist(), via.tolist()):
+            add_via(via_x, via_y, net=net)
+            draw_line(pad_x, pad_y, via_x, via_y, width=feed_width, net=net, layer=copper_layer)
+    for (tap_x, tap_y), (via_x, via_y) in zip(placement.power_tap.tolist(), placement.power_via.tolist()):
+        draw_line(tap_x, tap_y, via_x, via_y, width=feed_width, net='+5V', layer='BL_B_Cu')
+
+    for idx, name in enumerate(placement.names):
+        if not name:
+            continue
+        corners = placement.outline_corners[idx].tolist()
+        for corner_idx in range(4):
+            draw_line(*corners[corner_idx], *corners[(corner_idx + 1) % 4], width=outline_width, layer='BL_F_SilkS')
+        draw_line(
+            placement.pcb_x[idx], placement.pcb_y[idx], *placement.leader_end[idx],
+            width=0.6, layer='BL_F_SilkS',
+        )
+        items_to_add.append(
+            create_station_label(name, placement.label_anchor[idx], placement.label_angle[idx], placement.pcb_x[idx])
+        )
+
+
+def board_edges(rect_map, projection):
+    min_x, min_y, max_x, max_y = rect_map.bounds
+    return [
+        board_edge(min_x, max_x, max_y, max_y, projection),
+        board_edge(min_x, max_x, min_y, min_y, projection),
+        board_edge(max_x, max_x, max_y, min_y, projection),
+        board_edge(min_x, min_x, max_y, min_y, projection),
+    ]
 
-    draw_station_rectangle(
-        station.pcb_x,
-        station.pcb_y,
-        width_mm,
-        height_mm,
-        angle=station.orientation,
-        line_width=line_width,
-        layer=layer,
-    )
 
-def add_adjacent_via(footprint, offset_mm, angle, net, layer, width=0.5, backside_power = False):
-    pad_x, pad_y = get_pad_position(footprint, net)
-    via_offset_x = -offset_mm * math.cos(math.radians(footprint.orientation.degrees + angle))
-    via_offset_y = offset_mm * math.sin(math.radians(footprint.orientation.degrees + angle))
-    add_via(pad_x + via_offset_x, pad_y + via_offset_y, net = net)
-    draw_line(pad_x, pad_y, pad_x + via_offset_x, pad_y + via_offset_y, width = width, net = net, layer = layer)
-    if backside_power:
-        s = -math.tan(math.radians(footprint.orientation.degrees))
-        x1 = footprint.position.x/1e6
-        y1 = footprint.position.y/1e6
-        x2 = pad_x + via_offset_x
-        y2 = pad_y + via_offset_y
-
-        x = (s**2 * x1 + s * (y2 - y1) + x2)/(s**2 +1)
-        y = (s**2 * y2 + s * (x2 - x1) + y1)/(s**2 +1)
-        draw_line(x, y, pad_x + via_offset_x, pad_y + via_offset_y, width = width, net = net, layer = 'BL_B_Cu')
 def board_edge(x0, x1, y0, y1, projection):
     arcTrack = BoardSegment()
     start_x, start_y = projection.map_to_pcb(x0, y0)
@@ -411,11 +534,55 @@ def board_edge(x0, x1, y0, y1, projection):
     return arcTrack
 
 
+def track_to_pcb_lines(line, projection):
+    if hasattr(line, "track_components"):
+        return [
+            pcb_line
+            for track_component in line.track_components
+            for pcb_line in track_to_pcb_lines(track_component, projection)
+        ]
+    pcb_x, pcb_y = projection.map_to_pcb(np.asarray(line.map_x), np.asarray(line.map_y))
+    return [LineString(np.column_stack((pcb_x, pcb_y)))]
+
+
 def reproject_stations(stations, projection):
     for station in stations:
         station.pcb_x, station.pcb_y = projection.geo_to_pcb(station.longitude, station.latitude)
 
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Draw the digested map geometry onto the open KiCad board")
+    add_profile_arguments(parser)
+    parser.add_argument(
+        "--projection",
+        choices=PROJECTION_BACKENDS,
+        default=DEFAULT_PROJECTION_BACKEND,
+        help="Map projection backend; digest and board must use the same one",
+    )
+    parser.add_argument(
+        "--tile",
+        help=f"Draw one panel of a tiled map, e.g. r0c1, from the {TILE_GEOMETRY_PATH} written by tiling.py",
+    )
+    parser.add_argument(
+        "--preflight",
+        choices=PREFLIGHT_MODES,
+        default="warn",
+        help="Check clearances before anything is written to the board: report them (warn), "
+        "stop without writing on any violation (strict), or skip the check (off)",
+    )
+    parser.add_argument(
+        "--arc-tolerance",
+        type=float,
+        default=ARC_FIT_TOLERANCE_MM,
+        help="Lay the light rail copper as straight and arc tracks within this many mm of the "
+        "midline; 0 draws one segment per vertex instead",
+    )
+    return parser.parse_args()
+
+
 if __name__=='__main__':
+    args = parse_args()
+    profiler = profiler_from_args(args)
     try:
         kicad = KiCad(timeout_ms=KICAD_TIMEOUT_MS)
         print(f"Connected to KiCad {kicad.get_version()}")
@@ -423,79 +590,157 @@ if __name__=='__main__':
         print(f"Not connected to KiCad: {e}")
         raise
 
-    board = kicad.get_board()
-    width_metres = 5000
-    height_metres = 8000
-    board_clip_rect = box(-width_metres / 2, -height_metres / 2, width_metres / 2, height_metres / 2)
-    scale = 25000
-    projection = MapProjection(
-        origin_lon=MAP_ORIGIN_LON,
-        origin_lat=MAP_ORIGIN_LAT,
-        scale=1 / scale,
-        pcb_origin_mm=PCB_ORIGIN_MM,
-    )
-    board_rect_pcb = get_board_rect_pcb(projection, width_metres, height_metres)
+    board = profiler.wrap_ipc(kicad.get_board())
+    if args.tile is None:
+        tile_geometry = None
+        width_metres = 5000
+        height_metres = 8000
+        board_clip_rect = box(-width_metres / 2, -height_metres / 2, width_metres / 2, height_metres / 2)
+        scale = 25000
+        projection = MapProjection(
+            origin_lon=MAP_ORIGIN_LON,
+            origin_lat=MAP_ORIGIN_LAT,
+            scale=1 / scale,
+            pcb_origin_mm=PCB_ORIGIN_MM,
+            backend=args.projection,
+        )
+        board_rect_pcb = get_board_rect_pcb(projection, width_metres, height_metres)
+        ground_pour_cache_path = GROUND_POUR_CACHE_PATH
+    else:
+        # Tiling already clipped the lines and picked the stations for this panel.
+        tile_geometry = load_tile_geometry(args.tile)
+        tile = tile_geometry['tile']
+        board_clip_rect = tile.rect_map
+        projection = tile.projection
+        board_rect_pcb = tile.rect_pcb
+        ground_pour_cache_path = f'ground_pour_geometry_{tile.name}.pckl'
 
     items_to_add = []
+    profiler.start()
 
     ### CREATE TOP COPPER GROUND POUR ###
-    create_items_in_batches(build_ground_pour_zones(projection, board_rect_pcb))
+    # Zones, edges and tracks are only built here; nothing is pushed until the pre-flight passes.
+    with profiler.stage("ground_pour") as record:
+        pour_polygons = load_copper_polygons(
+            projection, board_rect_pcb, ground_pour_cache_path, legend_keep_out=tile_geometry is None
+        )
+        zones = [create_zone_from_polygon(polygon) for polygon in pour_polygons]
+        record.features = len(zones)
 
     ### BOARD EDGES ###
 
-    edges = []   
-    edges.append(board_edge(-width_metres/2, +width_metres/2, +height_metres/2, +height_metres/2, projection))
-    edges.append(board_edge(-width_metres/2, +width_metres/2, -height_metres/2, -height_metres/2, projection))
-    edges.append(board_edge(+width_metres/2, +width_metres/2, +height_metres/2, -height_metres/2, projection))
-    edges.append(board_edge(-width_metres/2, -width_metres/2, +height_metres/2, -height_metres/2, projection))
-    board.create_items(edges)
+    with profiler.stage("board_edges") as record:
+        edges = board_edges(board_clip_rect, projection)
+        record.features = len(edges)
 
     ### TRACKS ###
 
-    with open('L2_track_geometry.pckl', 'rb') as file:
-        L2_track_geometry = pickle.load(file)
-    create_line(L2_track_geometry, projection, layer='BL_B_Cu', width = 1)
-    with open('L3_track_geometry.pckl', 'rb') as file:
-        L3_track_geometry = pickle.load(file)
-    create_line(L3_track_geometry, projection, layer='BL_B_Cu', width = 1)
-
-    ### TRACKS ###
-    for train_line in ['T1', 'T2', 'T3', 'T4', 'T8', 'T9']:
-        with open(f'{train_line}_tracks_geometry.pckl', 'rb') as file:
-            tracks = pickle.load(file)
-        create_line(tracks, projection, layer='BL_F_Mask', width = 0.3)
+    label_obstacles = []
+    copper_tracks = []
+    fit_reports = []
+    for line_ref, layer, width in (
+        *((ref, 'BL_B_Cu', 1.0) for ref in LIGHT_RAIL_REFS),
+        *((ref, 'BL_F_Mask', 0.3) for ref in TRAIN_REFS),
+    ):
+        with profiler.stage("track", line_ref) as record:
+            items_before = len(items_to_add)
+            if tile_geometry is None:
+                filename = f'{line_ref}_track_geometry.pckl' if line_ref.startswith('L') else f'{line_ref}_tracks_geometry.pckl'
+                with open(filename, 'rb') as file:
+                    line_geometry = pickle.load(file)
+                line_parts = clip_line_parts(line_geometry)
+                pcb_lines = track_to_pcb_lines(line_geometry, projection)
+            else:
+                line_parts = tile_geometry['lines'][line_ref]
+                pcb_lines = [project_map_geometry_to_pcb(part, projection) for part in line_parts]
+            if layer == 'BL_B_Cu' and args.arc_tolerance > 0:
+                # The pre-flight checks the fitted copper, not the midline it approximates.
+                copper_lines, fit_report = create_fitted_tracks(
+                    line_parts, projection, line_ref, layer=layer, width=width, tolerance_mm=args.arc_tolerance
+                )
+                fit_reports.append(fit_report)
+            else:
+                create_line_segments(line_parts, projection, layer=layer, width=width)
+                copper_lines = [project_map_geometry_to_pcb(part, projection) for part in line_parts]
+            label_obstacles.extend((line, width) for line in pcb_lines)
+            if layer == 'BL_B_Cu':
+                copper_tracks.extend((line_ref, line, width) for line in copper_lines)
+            record.vertices_in = sum(len(line.coords) for line in pcb_lines)
+            record.features = len(items_to_add) - items_before
+    for fit_report in fit_reports:
+        print(f"Arc-fitted {fit_report.describe()}")
 
     ### PLACE LEDS ###
 
-    with open('L2_stations_geometry.pckl', 'rb') as file:
-        L2_station_geometry = pickle.load(file)
-    with open('L3_stations_geometry.pckl', 'rb') as file:
-        L3_station_geometry = pickle.load(file)
-    reproject_stations(L2_station_geometry, projection)
-    reproject_stations(L3_station_geometry, projection)
-
-    LEDs = []
-    for footprint in board.get_footprints():
-        reference = footprint.reference_field.text.value
-        if reference[0] == 'D' and int(reference[1:]) >= 100:
-            LEDs.append(footprint)
-    LEDs.sort(key=lambda LED: int(LED.reference_field.text.value[1:]))
-
-    via_offset = 0.6
-    for idx, station in enumerate(L2_station_geometry):
-        LEDs[idx].position = Vector2.from_xy_mm(station.pcb_x,station.pcb_y)
-        LEDs[idx].orientation = Angle.from_degrees(station.orientation + 180)
-        add_adjacent_via(LEDs[idx], via_offset, 90, 'GND', 'BL_F_Cu', width=0.5)
-        add_adjacent_via(LEDs[idx], via_offset, 270, '+5V', 'BL_F_Cu', width=0.5, backside_power=True)
-        add_station_outline(station)
-        add_station_label(station, flip_label_side=(station.name == "UNSW High Street"))
-
-    for idx, station in enumerate(L3_station_geometry):
-        LEDs[idx + len(L2_station_geometry)].position = Vector2.from_xy_mm(station.pcb_x,station.pcb_y)
-        LEDs[idx + len(L2_station_geometry)].orientation = Angle.from_degrees(station.orientation + 180)
-        add_adjacent_via(LEDs[idx + len(L2_station_geometry)], via_offset, 90, 'GND', 'BL_F_Cu', width=0.5)
-        add_adjacent_via(LEDs[idx + len(L2_station_geometry)], via_offset, 270, '+5V', 'BL_F_Cu', width=0.5, backside_power=True)
-        add_station_outline(station)
-        add_station_label(station, flip_label_side=True)
-    board.update_items(LEDs)
-    create_items_in_batches(items_to_add)
\ No newline at end of file
+    with profiler.stage("place_leds") as record:
+        if tile_geometry is None:
+            with open('L2_stations_geometry.pckl', 'rb') as file:
+                L2_station_geometry = pickle.load(file)
+            with open('L3_stations_geometry.pckl', 'rb') as file:
+                L3_station_geometry = pickle.load(file)
+            stations = L2_station_geometry + L3_station_geometry
+        else:
+            stations = tile_geometry['stations']
+        reproject_stations(stations, projection)
+        # One LED per physical position; lines sharing it are multiplexed at runtime.
+        allocation = allocate_leds(stations)
+        stations = allocation.stations
+
+        LEDs = []
+        for footprint in board.get_footprints():
+            reference = footprint.reference_field.text.value
+            if reference[0] == 'D' and int(reference[1:]) >= 100:
+                LEDs.append(footprint)
+        LEDs.sort(key=lambda LED: int(LED.reference_field.text.value[1:]))
+
+        LEDs = LEDs[:len(stations)]
+        placement = compute_station_placements(stations, get_pad_offsets(LEDs, ('GND', '+5V')))
+        record.features = len(stations)
+
+    with profiler.stage("label_placement") as record:
+        labels = place_labels(
+            placement.names,
+            np.column_stack((placement.pcb_x, placement.pcb_y)),
+            placement.orientation,
+            [line for line, _ in label_obstacles],
+            [width for _, width in label_obstacles],
+            placement.outline_corners,
+            bounds=board_rect_pcb.bounds,
+        )
+        update_label_positions(placement, labels.label_angle, labels.offset_mm)
+        record.features = len(placement.names)
+    overlapping_labels = [name for name, overlap in zip(placement.names, labels.overlap_mm2) if overlap > 0]
+    if overlapping_labels:
+        print(f"Labels still overlapping after placement: {', '.join(overlapping_labels)}")
+
+    if args.preflight != "off":
+        with profiler.stage("preflight") as record:
+            preflight = run_preflight(
+                placement,
+                board_rect_pcb,
+                copper_tracks,
+                pour_polygons,
+                allocation,
+                [LED.reference_field.text.value for LED in LEDs],
+            )
+            record.features = preflight.item_count
+        print(preflight.describe())
+        if not preflight.ok and args.preflight == "strict":
+            profiler.stop()
+            report_profile(profiler, args)
+            raise SystemExit("Pre-flight failed; nothing was written to the board")
+
+    # Only once the pre-flight has passed, so a failed run leaves the firmware's allocation as it was.
+    allocation_path = LED_ALLOCATION_PATH if tile_geometry is None else f'led_allocation_{tile.name}.json'
+    write_led_allocation(allocation, [LED.reference_field.text.value for LED in LEDs], allocation_path)
+    print(f"Allocated {allocation.describe()}; wrote {allocation_path}")
+
+    with profiler.stage("create_items") as record:
+        create_items_in_batches(zones)
+        board.create_items(edges)
+        emit_station_placements(placement, LEDs)
+        board.update_items(LEDs)
+        record.features = len(zones) + len(edges) + len(items_to_add)
+        create_items_in_batches(items_to_add)
+    profiler.stop()
+    report_profile(profiler, args)
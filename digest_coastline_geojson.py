@@ -1,61 +1,332 @@
-from shapely.geometry import LineString, Point
-from shapely.ops import linemerge, unary_union
+import argparse
 import json
-import matplotlib.pyplot as plt
-from utils import get_total_length, degrees_to_metres
 import pickle
 
+import numpy as np
+import shapely
+from shapely.geometry import LineString, MultiLineString, MultiPolygon, Polygon, box
+from shapely.ops import unary_union
 
-def to_ordered_coords(segments):
-    merged = linemerge(unary_union(segments))
-    if merged.geom_type == "MultiLineString":
-        ordered_coords = [list(ls.coords) for ls in merged.geoms]
-    else:
-        ordered_coords = list(merged.coords)
-    return ordered_coords
-
-def within_boundary(x, y, width, height):
-    within_width = (-width / 2 < x) and (x < width/2)
-    within_height = (-height / 2 < y) and (y < height/2)
-    return within_width and within_height
-
-if __name__ == '__main__':
-    with open("coastline.geojson") as f:
-        data = json.load(f)
-
-    segments = []
-
-    
-    for feature in data['features']:
-        geom = feature['geometry']
-        if geom['type'] == 'LineString':
-            segments.append(LineString(geom["coordinates"]))
-            
-    origin = (151.22289335, -33.8937485)
-    width_metres = 5000
-    height_metres = 8000
-    ordered_segments = to_ordered_coords(segments)
-    coastline_geometry = []
-    coastline_geometry_ROI = []
-    
-    plt.figure()
-    for seg in ordered_segments:
-        xs_coastline, ys_coastline = degrees_to_metres(*zip(*seg), origin)
-        coastline_geometry.append((xs_coastline, ys_coastline))
-        plt.plot(xs_coastline, ys_coastline)
-
-    xs, ys = coastline_geometry[0]
-    plt.plot(xs[500:3000],ys[500:3000], c='k')
-    plt.gca().axis('equal')
-    coastline_geometry_ROI = [xs[500:3000],ys[500:3000]]
-
-    with open('coastline_geometry.pckl', 'wb') as file:
-        pickle.dump(coastline_geometry_ROI, file)
-
-    clark_island_geometry = coastline_geometry[14]
-    plt.plot(*clark_island_geometry, c='k')
-    with open('clark_island_geometry.pckl', 'wb') as file:
-        pickle.dump(clark_island_geometry, file)
-
-    plt.fill_between([-width_metres/2, width_metres/2], -height_metres/2, height_metres/2, color='lightgray', alpha=0.5)
-    plt.show()
\ No newline at end of file
+from MapProjection import DEFAULT_PROJECTION_BACKEND, PROJECTION_BACKENDS, MapProjection
+from simplify_geometry import PCB_SIMPLIFY_TOLERANCE_MM, map_tolerance_from_pcb_mm, simplify_lines
+
+MAP_ORIGIN_LON = 151.22289335
+MAP_ORIGIN_LAT = -33.8937485
+MAP_SCALE = 1 / 25000
+PCB_ORIGIN_MM = (148.5, 210.0)
+COASTLINE_INPUT_PATH = "coastline.geojson"
+COASTLINE_OUTPUT_PATH = "coastline_polygons.pckl"
+BOARD_WIDTH_METRES = 5000
+BOARD_HEIGHT_METRES = 8000
+# Polygonise a little beyond the board so pour outlines never end on a clipped coastline vertex.
+EXTENT_MARGIN_METRES = 250
+# Ways in the overpass export that share coastline nodes but are not shoreline themselves.
+NON_COASTLINE_TAGS = ("man_made", "barrier")
+BOUNDARY_TOLERANCE_M = 1e-6
+
+
+def iter_coastline_ways(data):
+    """Yields the coordinates of every coastline way, oriented as in OSM (land on the left)."""
+    for feature in data["features"]:
+        geometry = feature["geometry"]
+        properties = feature.get("properties", {})
+        if any(tag in properties for tag in NON_COASTLINE_TAGS):
+            continue
+        if geometry["type"] == "LineString":
+            yield np.asarray(geometry["coordinates"], dtype=float)
+        elif geometry["type"] == "Polygon" and properties.get("natural") == "coastline":
+            yield np.asarray(geometry["coordinates"][0], dtype=float)
+
+
+def bounds_intersect(coords, bounds):
+    min_x, min_y, max_x, max_y = bounds
+    return not (
+        coords[:, 0].max() < min_x
+        or coords[:, 0].min() > max_x
+        or coords[:, 1].max() < min_y
+        or coords[:, 1].min() > max_y
+    )
+
+
+def join_ways(ways):
+    """
+    Joins directed ways end-to-start into chains using a dict of way start
+    nodes. Returns chains that are either closed rings or open runs.
+    """
+    ways = [way for way in ways if len(way) >= 2]
+    start_index = {}
+    end_nodes = set()
+    for index, way in enumerate(ways):
+        if tuple(way[0]) == tuple(way[-1]):
+            continue
+        start_index.setdefault(tuple(way[0]), index)
+        end_nodes.add(tuple(way[-1]))
+
+    visited = [False] * len(ways)
+    chains = []
+
+    def follow(first_index):
+        parts = []
+        index = first_index
+        while index is not None and not visited[index]:
+            visited[index] = True
+            way = ways[index]
+            parts.append(way if not parts else way[1:])
+            if tuple(way[0]) == tuple(way[-1]):
+                break
+            index = start_index.get(tuple(way[-1]))
+        return np.concatenate(parts)
+
+    # Open runs first, starting from ways nothing leads into, then whatever is left is a cycle.
+    for index, way in enumerate(ways):
+        if not visited[index] and tuple(way[0]) not in end_nodes:
+            chains.append(follow(index))
+    for index in range(len(ways)):
+        if not visited[index]:
+            chains.append(follow(index))
+    return chains
+
+
+def is_closed(coords):
+    return len(coords) >= 4 and np.array_equal(coords[0], coords[-1])
+
+
+def boundary_position(point, extent):
+    """Distance of a boundary point measured counter-clockwise from the bottom-left corner."""
+    min_x, min_y, max_x, max_y = extent
+    width = max_x - min_x
+    height = max_y - min_y
+    x, y = point
+    if abs(y - min_y) <= BOUNDARY_TOLERANCE_M:
+        return x - min_x
+    if abs(x - max_x) <= BOUNDARY_TOLERANCE_M:
+        return width + (y - min_y)
+    if abs(y - max_y) <= BOUNDARY_TOLERANCE_M:
+        return width + height + (max_x - x)
+    return 2 * width + height + (max_y - y)
+
+
+def snap_to_boundary(point, extent):
+    min_x, min_y, max_x, max_y = extent
+    x, y = point
+    candidates = (
+        (y - min_y, (x, min_y)),
+        (max_x - x, (max_x, y)),
+        (max_y - y, (x, max_y)),
+        (x - min_x, (min_x, y)),
+    )
+    return min(candidates, key=lambda candidate: candidate[0])[1]
+
+
+def on_boundary(point, extent):
+    min_x, min_y, max_x, max_y = extent
+    x, y = point
+    return (
+        abs(x - min_x) <= BOUNDARY_TOLERANCE_M
+        or abs(x - max_x) <= BOUNDARY_TOLERANCE_M
+        or abs(y - min_y) <= BOUNDARY_TOLERANCE_M
+        or abs(y - max_y) <= BOUNDARY_TOLERANCE_M
+    )
+
+
+def clip_chains(chains, extent):
+    """
+    Clips chains to the extent. Closed rings wholly inside are returned as
+    rings; everything else becomes open pieces whose ends lie on the extent
+    boundary. Pieces that stop short of the boundary (gaps in the export)
+    are extended to the nearest boundary point and counted.
+    """
+    extent_box = box(*extent)
+    rings = []
+    pieces = []
+    for chain in chains:
+        line = LineString(chain)
+        if is_closed(chain) and extent_box.contains(line):
+            rings.append(chain)
+            continue
+        clipped = shapely.clip_by_rect(line, *extent)
+        if clipped.is_empty:
+            continue
+        pieces.extend(shapely.get_parts(clipped))
+
+    if pieces:
+        merged = shapely.line_merge(MultiLineString(pieces), directed=True)
+        pieces = [np.asarray(piece.coords) for piece in shapely.get_parts(merged)]
+
+    open_pieces = []
+    dangling_ends = 0
+    for piece in pieces:
+        if is_closed(piece):
+            rings.append(piece)
+            continue
+        if not on_boundary(piece[0], extent):
+            piece = np.vstack((snap_to_boundary(piece[0], extent), piece))
+            dangling_ends += 1
+        if not on_boundary(piece[-1], extent):
+            piece = np.vstack((piece, snap_to_boundary(piece[-1], extent)))
+            dangling_ends += 1
+        open_pieces.append(piece)
+    return rings, open_pieces, dangling_ends
+
+
+def close_along_boundary(open_pieces, extent):
+    """
+    Builds land polygons from open pieces by walking the extent boundary
+    counter-clockwise from each piece's end to the next piece's start, which
+    keeps the land on the left as OSM coastline ways require.
+    """
+    min_x, min_y, max_x, max_y = extent
+    width = max_x - min_x
+    height = max_y - min_y
+    perimeter = 2 * (width + height)
+    corners = (
+        (0.0, (min_x, min_y)),
+        (width, (max_x, min_y)),
+        (width + height, (max_x, max_y)),
+        (2 * width + height, (min_x, max_y)),
+    )
+    starts = [boundary_position(piece[0], extent) for piece in open_pieces]
+    ends = [boundary_position(piece[-1], extent) for piece in open_pieces]
+
+    used = [False] * len(open_pieces)
+    polygons = []
+    for first in range(len(open_pieces)):
+        if used[first]:
+            continue
+        ring = []
+        current = first
+        while not used[current]:
+            used[current] = True
+            ring.extend(map(tuple, open_pieces[current]))
+            end_position = ends[current]
+            following = min(
+                range(len(open_pieces)),
+                key=lambda index: (starts[index] - end_position) % perimeter,
+            )
+            walk = (starts[following] - end_position) % perimeter
+            for corner_position, corner in sorted(
+                corners, key=lambda corner: (corner[0] - end_position) % perimeter
+            ):
+                if 0 < (corner_position - end_position) % perimeter < walk:
+                    ring.append(corner)
+            current = following
+        if len(ring) >= 3:
+            polygons.append(Polygon(ring).buffer(0))
+    return polygons
+
+
+def build_coastline_polygons(chains, extent):
+    rings, open_pieces, dangling_ends = clip_chains(chains, extent)
+    extent_box = box(*extent)
+
+    land_parts = close_along_boundary(open_pieces, extent)
+    lakes = []
+    for ring in rings:
+        polygon = Polygon(ring).buffer(0)
+        if shapely.is_ccw(shapely.linearrings(ring)):
+            land_parts.append(polygon)
+        else:
+            lakes.append(polygon)
+
+    # A coastline ring running clockwise with nothing crossing the extent means we are on land around it.
+    if not open_pieces and lakes and not land_parts:
+        land_parts.append(extent_box)
+
+    land = unary_union(land_parts).difference(unary_union(lakes)) if lakes else unary_union(land_parts)
+    land = land.intersection(extent_box)
+    water = extent_box.difference(land)
+    return as_multipolygon(land), as_multipolygon(water), dangling_ends
+
+
+def as_multipolygon(geometry):
+    polygons = [part for part in shapely.get_parts(geometry) if isinstance(part, Polygon) and not part.is_empty]
+    return MultiPolygon(polygons)
+
+
+def get_extent(width_metres, height_metres, margin_metres):
+    return (
+        -width_metres / 2 - margin_metres,
+        -height_metres / 2 - margin_metres,
+        width_metres / 2 + margin_metres,
+        height_metres / 2 + margin_metres,
+    )
+
+
+def plot_coastline(land, water, extent):
+    """Writes an SVG preview of the polygons, for checking in a browser."""
+    from svg_preview import PREVIEW_OUTPUT_PATH, write_preview
+
+    write_preview(PREVIEW_OUTPUT_PATH, [], coastline={"extent": extent, "land": land, "water": water})
+    return PREVIEW_OUTPUT_PATH
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default=COASTLINE_INPUT_PATH, help="Path to the coastline geojson file")
+    parser.add_argument("--output", default=COASTLINE_OUTPUT_PATH, help="Where to write the land/water polygons")
+    parser.add_argument("--width-metres", type=float, default=BOARD_WIDTH_METRES)
+    parser.add_argument("--height-metres", type=float, default=BOARD_HEIGHT_METRES)
+    parser.add_argument("--margin-metres", type=float, default=EXTENT_MARGIN_METRES)
+    parser.add_argument(
+        "--simplify-tolerance-mm",
+        type=float,
+        default=PCB_SIMPLIFY_TOLERANCE_MM,
+        help="Maximum deviation of the simplified coastline in PCB millimetres (0 disables simplification)",
+    )
+    parser.add_argument("--plot", action="store_true", help="Write an SVG preview of the polygons to preview.svg")
+    parser.add_argument(
+        "--projection",
+        choices=PROJECTION_BACKENDS,
+        default=DEFAULT_PROJECTION_BACKEND,
+        help="Map projection backend; digest and board must use the same one",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with open(args.input) as file:
+        data = json.load(file)
+
+    projection = MapProjection(
+        origin_lon=MAP_ORIGIN_LON,
+        origin_lat=MAP_ORIGIN_LAT,
+        scale=MAP_SCALE,
+        pcb_origin_mm=PCB_ORIGIN_MM,
+        backend=args.projection,
+    )
+    extent = get_extent(args.width_metres, args.height_metres, args.margin_metres)
+    extent_lon, extent_lat = projection.map_to_geo(
+        np.array([extent[0], extent[2]]), np.array([extent[1], extent[3]])
+    )
+    extent_geo = (extent_lon.min(), extent_lat.min(), extent_lon.max(), extent_lat.max())
+
+    ways = list(iter_coastline_ways(data))
+    chains = [chain for chain in join_ways(ways) if bounds_intersect(chain, extent_geo)]
+    chains_map = [np.column_stack(projection.geo_to_map(chain[:, 0], chain[:, 1])) for chain in chains]
+
+    simplified_chains, reports = simplify_lines(
+        [(f"chain_{index}", (chain[:, 0], chain[:, 1])) for index, chain in enumerate(chains_map)],
+        map_tolerance_from_pcb_mm(args.simplify_tolerance_mm, projection.scale),
+        projection.scale,
+    )
+    chains_map = [np.column_stack(chain) for chain in simplified_chains]
+    land, water, dangling_ends = build_coastline_polygons(chains_map, extent)
+
+    with open(args.output, "wb") as file:
+        pickle.dump({"extent": extent, "land": land, "water": water}, file)
+
+    vertices_in = sum(report.vertices_in for report in reports)
+    vertices_out = sum(report.vertices_out for report in reports)
+    print(f"Loaded {len(ways)} coastline ways from {args.input}")
+    print(f"Joined into {len(chains)} chains intersecting the board extent ({vertices_in} -> {vertices_out} vertices)")
+    if dangling_ends:
+        print(f"Extended {dangling_ends} coastline ends that stop inside the extent to its boundary")
+    print(f"Wrote {len(land.geoms)} land and {len(water.geoms)} water polygons to {args.output}")
+
+    if args.plot:
+        print(f"Wrote preview to {plot_coastline(land, water, extent)}")
+
+
+if __name__ == "__main__":
+    main()
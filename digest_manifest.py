@@ -0,0 +1,130 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+DIGEST_MANIFEST_PATH = "digest_manifest.json"
+MANIFEST_VERSION = 1
+
+
+@dataclass(frozen=True)
+class ExportDiff:
+    added: frozenset[str]
+    removed: frozenset[str]
+    changed: frozenset[str]
+
+    @property
+    def is_empty(self):
+        return not (self.added or self.removed or self.changed)
+
+    def describe(self):
+        return f"{len(self.added)} added, {len(self.removed)} removed, {len(self.changed)} changed features"
+
+
+def get_feature_id(feature):
+    properties = feature.get("properties", {})
+    return properties.get("@id") or feature.get("id")
+
+
+def hash_feature(feature):
+    canonical = json.dumps(feature, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def get_feature_refs(feature):
+    """
+    Every route ref a feature can contribute to: the refs of the relations
+    it is a member of, and its own ref when it is a route relation itself.
+    """
+    properties = feature.get("properties", {})
+    refs = {
+        relation.get("reltags", {}).get("ref")
+        for relation in properties.get("@relations", [])
+    }
+    if str(get_feature_id(feature)).startswith("relation/"):
+        refs.add(properties.get("ref"))
+    refs.discard(None)
+    return refs
+
+
+def index_export(data):
+    """Maps each feature @id to [content hash, sorted refs], the unit the manifest diffs on."""
+    index = {}
+    for feature in data["features"]:
+        feature_id = get_feature_id(feature)
+        if feature_id is None:
+            continue
+        index[feature_id] = [hash_feature(feature), sorted(get_feature_refs(feature))]
+    return index
+
+
+def without_refs(index, refs):
+    """
+    The index minus every feature touching one of refs. Saving this for refs
+    that failed to build makes their features new again next time, so the
+    next incremental run retries them instead of trusting their old output.
+    """
+    refs = set(refs)
+    return {
+        feature_id: entry
+        for feature_id, entry in index.items()
+        if not refs.intersection(entry[1])
+    }
+
+
+def diff_exports(previous_index, current_index):
+    previous_ids = previous_index.keys()
+    current_ids = current_index.keys()
+    return ExportDiff(
+        added=frozenset(current_ids - previous_ids),
+        removed=frozenset(previous_ids - current_ids),
+        changed=frozenset(
+            feature_id
+            for feature_id in previous_ids & current_ids
+            if previous_index[feature_id][0] != current_index[feature_id][0]
+        ),
+    )
+
+
+def get_affected_refs(diff, previous_index, current_index):
+    """
+    Refs touched by the diff. A changed feature counts for both its old and
+    new refs, so moving a way from one route to another rebuilds both, and
+    removed features are resolved through the previous index.
+    """
+    refs = set()
+    for feature_id in diff.added:
+        refs.update(current_index[feature_id][1])
+    for feature_id in diff.removed:
+        refs.update(previous_index[feature_id][1])
+    for feature_id in diff.changed:
+        refs.update(previous_index[feature_id][1])
+        refs.update(current_index[feature_id][1])
+    return refs
+
+
+def load_manifest(path=DIGEST_MANIFEST_PATH):
+    if not Path(path).exists():
+        return None
+    with open(path) as file:
+        manifest = json.load(file)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(settings, indexes, path=DIGEST_MANIFEST_PATH):
+    with open(path, "w") as file:
+        json.dump({"version": MANIFEST_VERSION, "settings": settings, "inputs": indexes}, file)
+
+
+def plan_rebuild(manifest, settings, name, current_index):
+    """
+    The refs of one input that need rebuilding, or None when everything
+    does: there is no usable manifest, or the digest settings changed.
+    """
+    if manifest is None or manifest["settings"] != settings or name not in manifest["inputs"]:
+        return None, None
+    previous_index = manifest["inputs"][name]
+    diff = diff_exports(previous_index, current_index)
+    return get_affected_refs(diff, previous_index, current_index), diff
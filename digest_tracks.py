@@ -3,24 +3,37 @@ import json
 import pickle
 import sys
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 from pathlib import Path
 
-import matplotlib.pyplot as plt
-import numpy as np
 from shapely.geometry import GeometryCollection, LineString, MultiLineString, Point
 from shapely.ops import linemerge, unary_union
 
-from MapProjection import MapProjection
+from corridor_midline import SharedCorridor, corridor_midline, find_shared_corridors, pair_directional_lines
+from digest_manifest import index_export, load_manifest, plan_rebuild, save_manifest, without_refs
+from gap_bridging import GAP_BRIDGE_TOLERANCE_M, BridgeReport, bridge_gaps
+from firmware_bundle import build_firmware_bundle, write_firmware_bundle
+from line_refs import LIGHT_RAIL_REFS, TRAIN_REFS
+from lod_pyramid import LOD_LEVEL_NAMES, build_lod_pyramid, get_level_tolerances, write_lod_pyramid
+from MapProjection import DEFAULT_PROJECTION_BACKEND, PROJECTION_BACKENDS, MapProjection
+from profiling import NULL_PROFILER, add_profile_arguments, profiler_from_args, report_profile
+from simplify_geometry import (
+    PCB_SIMPLIFY_TOLERANCE_MM,
+    SimplificationReport,
+    combine_reports,
+    map_tolerance_from_pcb_mm,
+    simplify_lines,
+    simplify_polyline,
+)
 from Station import Station
 from Track import Track
+from track_graph import TrackGraph
 
 sys.modules.setdefault("digest_tracks", sys.modules[__name__])
 
 PCB_ORIGIN_MM = (148.5, 210.0)
 LIGHT_RAIL_INPUT_PATH = "lightrail.geojson"
 TRAIN_INPUT_CANDIDATES = ("train.geojson", "trains.geojson")
-LIGHT_RAIL_INTERPOLATION_POINTS = 3000
 
 
 @dataclass(frozen=True)
@@ -37,6 +50,10 @@ class LightRailLineGeometry:
     track: Track
     stations: list[Station]
     pseudo_stations: list[Station]
+    simplification: SimplificationReport | None = None
+    lod: dict | None = None
+    shared_corridors: list[SharedCorridor] = field(default_factory=list)
+    gap_reports: list[BridgeReport] = field(default_factory=list)
 
 
 @dataclass
@@ -48,6 +65,10 @@ class RouteGeometryGroup:
     geometry_geo: LineString | MultiLineString
     geometry_map: LineString | MultiLineString
     track_components: list[Track]
+    simplification: SimplificationReport | None = None
+    lod: dict | None = None
+    graph: TrackGraph | None = None
+    gap_report: BridgeReport | None = None
 
 
 LightRailLineGeometry.__module__ = "digest_tracks"
@@ -58,6 +79,7 @@ LIGHT_RAIL_SPECS = (
     LightRailLineSpec("L2", "Randwick", "Circular Quay"),
     LightRailLineSpec("L3", "Juniors Kingsford", "Circular Quay"),
 )
+assert tuple(spec.ref for spec in LIGHT_RAIL_SPECS) == LIGHT_RAIL_REFS
 
 
 def cut_line(line, distance):
@@ -103,19 +125,6 @@ def cut_line_between(line, start_dist, end_dist):
     return end_cut[0]
 
 
-def evenly_spaced_points(xs, ys, count):
-    xs = np.array(xs)
-    ys = np.array(ys)
-    dx = np.diff(xs)
-    dy = np.diff(ys)
-    segment_lengths = np.sqrt(dx**2 + dy**2)
-    cumulative = np.insert(np.cumsum(segment_lengths), 0, 0)
-    target_distance = np.linspace(0, cumulative[-1], count)
-    x_interp = np.interp(target_distance, cumulative, xs)
-    y_interp = np.interp(target_distance, cumulative, ys)
-    return x_interp, y_interp
-
-
 def load_json_data(path=None, default_candidates=()):
     if path:
         candidates = [Path(path)]
@@ -201,12 +210,21 @@ def explode_lines(geometry):
     raise ValueError(f"Unsupported geometry type: {geometry.geom_type}")
 
 
-def build_track_from_segments(ref, segments, projection):
-    geometry = merge_line_segments(segments)
+def count_vertices(lines):
+    return sum(len(line.coords) for line in lines)
+
+
+def count_track_vertices(tracks):
+    return sum(len(track.map_x) for track in tracks)
+
+
+def build_track_from_segments(ref, segments, projection, gap_tolerance_m=GAP_BRIDGE_TOLERANCE_M):
+    """The route as one Track, bridging small gaps between its pieces; also returns the BridgeReport."""
+    geometry, report = bridge_gaps(ref, merge_line_segments(segments), projection, gap_tolerance_m)
     if geometry.geom_type != "LineString":
-        raise ValueError(f"{ref} resolved to {geometry.geom_type}, expected a single LineString")
+        raise ValueError(f"{ref} resolved to {geometry.geom_type}, expected a single LineString ({report.describe()})")
     longitudes, latitudes = zip(*geometry.coords)
-    return Track(ref, list(longitudes), list(latitudes), projection)
+    return Track(ref, list(longitudes), list(latitudes), projection), report
 
 
 def build_track_components(ref, geometry, projection):
@@ -219,6 +237,24 @@ def build_track_components(ref, geometry, projection):
     return components
 
 
+def simplify_track(track, tolerance_m, projection):
+    map_x, map_y, report = simplify_polyline(
+        track.name, track.map_x, track.map_y, tolerance_m, projection.scale
+    )
+    longitudes, latitudes = projection.map_to_geo(map_x, map_y)
+    return Track(track.name, longitudes, latitudes, projection), report
+
+
+def simplify_track_components(ref, track_components, tolerance_m, projection):
+    named_lines = [(track.name, (track.map_x, track.map_y)) for track in track_components]
+    simplified_lines, reports = simplify_lines(named_lines, tolerance_m, projection.scale)
+    simplified_components = []
+    for track, (map_x, map_y) in zip(track_components, simplified_lines):
+        longitudes, latitudes = projection.map_to_geo(map_x, map_y)
+        simplified_components.append(Track(track.name, longitudes, latitudes, projection))
+    return simplified_components, combine_reports(ref, reports)
+
+
 def build_map_geometry(track_components):
     map_segments = [track.line_cartesian for track in track_components]
     if len(map_segments) == 1:
@@ -342,15 +378,6 @@ def project_stations_onto_track(track, stations_a, stations_b):
     return projected_stations
 
 
-def get_track_midline(track_a, track_b, count, projection, flip=True):
-    lon_a, lat_a = evenly_spaced_points(track_a.longitudes, track_a.latitudes, count)
-    lon_b, lat_b = evenly_spaced_points(track_b.longitudes, track_b.latitudes, count)
-    if flip:
-        lon_b = np.flip(lon_b)
-        lat_b = np.flip(lat_b)
-    return Track(track_a.name, (lon_a + lon_b) / 2, (lat_a + lat_b) / 2, projection)
-
-
 def get_pseudo_stations(stations, track, projection, minimum_distance):
     pseudo_stations = []
     for index in range(len(stations) - 1):
@@ -373,56 +400,181 @@ def get_pseudo_stations(stations, track, projection, minimum_distance):
     return pseudo_stations
 
 
-def build_light_rail_line(spec, data, projection):
-    segments_a = get_light_rail_route_segments(data, spec.ref, spec.destination_a)
-    segments_b = get_light_rail_route_segments(data, spec.ref, spec.destination_b)
-    missing_destinations = []
-    if not segments_a:
-        missing_destinations.append(spec.destination_a)
-    if not segments_b:
-        missing_destinations.append(spec.destination_b)
+def build_lod(named_lines, level_tolerances, projection, profiler, ref):
+    if level_tolerances is None:
+        return None
+    with profiler.stage("lod_pyramid", ref) as record:
+        lod = build_lod_pyramid(named_lines, level_tolerances, projection.scale)
+        record.vertices_in = sum(len(xs) for _, (xs, _) in named_lines)
+        record.vertices_out = sum(len(level.vertex_indices) for levels in lod.values() for level in levels)
+    return lod
+
+
+def get_light_rail_destinations(data, ref):
+    destinations = set()
+    for feature in data["features"]:
+        tags = get_primary_relation_tags(feature)
+        if tags is not None and tags.get("ref") == ref and tags.get("to"):
+            destinations.add(tags["to"])
+    return sorted(destinations)
+
+
+def get_light_rail_corridor(spec, directional_tracks):
+    """
+    The directional tracks that make up the spec's line: the one heading to
+    destination_a and whichever track pairs with it, so extra directional
+    routes (short workings, depot runs) cannot displace the real pair.
+    """
+    lines = {destination: (track.map_x, track.map_y) for destination, track in directional_tracks.items()}
+    for corridor in pair_directional_lines(lines):
+        if spec.destination_a in corridor:
+            return sorted(corridor, key=lambda destination: destination != spec.destination_a)
+    raise ValueError(f"No {spec.ref} corridor runs to {spec.destination_a}")
+
+
+def build_corridor_track(ref, corridor_tracks, projection):
+    track_a = corridor_tracks[0]
+    track_b = corridor_tracks[-1]
+    map_x, map_y = corridor_midline((track_a.map_x, track_a.map_y), (track_b.map_x, track_b.map_y))
+    longitudes, latitudes = projection.map_to_geo(map_x, map_y)
+    return Track(ref, longitudes, latitudes, projection)
+
+
+def build_light_rail_line(
+    spec, data, projection, simplify_tolerance_m=0.0, profiler=NULL_PROFILER, lod_level_tolerances=None
+):
+    with profiler.stage("light_rail_segments", spec.ref) as record:
+        segments = {
+            destination: get_light_rail_route_segments(data, spec.ref, destination)
+            for destination in get_light_rail_destinations(data, spec.ref)
+        }
+        record.features = sum(len(destination_segments) for destination_segments in segments.values())
+        record.vertices_out = sum(count_vertices(destination_segments) for destination_segments in segments.values())
+    missing_destinations = [
+        destination
+        for destination in (spec.destination_a, spec.destination_b)
+        if not segments.get(destination)
+    ]
     if missing_destinations:
         joined_destinations = ", ".join(missing_destinations)
         raise ValueError(f"Missing {spec.ref} route segments for: {joined_destinations}")
 
-    track_a = build_track_from_segments(
-        spec.ref,
-        segments_a,
-        projection,
-    )
-    track_b = build_track_from_segments(
-        spec.ref,
-        segments_b,
-        projection,
-    )
-    track = get_track_midline(
-        track_a,
-        track_b,
-        LIGHT_RAIL_INTERPOLATION_POINTS,
-        projection,
+    with profiler.stage("light_rail_merge", spec.ref) as record:
+        directional_tracks = {}
+        gap_reports = []
+        for destination, destination_segments in segments.items():
+            directional_tracks[destination], report = build_track_from_segments(
+                f"{spec.ref} to {destination}", destination_segments, projection
+            )
+            gap_reports.append(report)
+        record.features = sum(len(destination_segments) for destination_segments in segments.values())
+        record.vertices_in = sum(count_vertices(destination_segments) for destination_segments in segments.values())
+        record.vertices_out = count_track_vertices(directional_tracks.values())
+    with profiler.stage("light_rail_midline", spec.ref) as record:
+        corridor = get_light_rail_corridor(spec, directional_tracks)
+        corridor_tracks = [directional_tracks[destination] for destination in corridor]
+        track = build_corridor_track(spec.ref, corridor_tracks, projection)
+        record.vertices_in = count_track_vertices(corridor_tracks)
+        record.vertices_out = count_track_vertices((track,))
+    lod = build_lod(((track.name, (track.map_x, track.map_y)),), lod_level_tolerances, projection, profiler, spec.ref)
+    with profiler.stage("light_rail_simplify", spec.ref) as record:
+        record.vertices_in = count_track_vertices((track,))
+        track, simplification = simplify_track(track, simplify_tolerance_m, projection)
+        record.vertices_out = count_track_vertices((track,))
+
+    with profiler.stage("light_rail_stations", spec.ref) as record:
+        stations_a = get_light_rail_stations(track, data, destination=corridor[0])
+        stations_b = get_light_rail_stations(track, data, destination=corridor[-1])
+        stations = project_stations_onto_track(track, stations_a, stations_b)
+        pseudo_stations = get_pseudo_stations(
+            stations,
+            track,
+            projection,
+            minimum_distance=spec.pseudo_station_spacing_m,
+        )
+        record.features = len(stations) + len(pseudo_stations)
+    return LightRailLineGeometry(
+        spec.ref, track, stations, pseudo_stations, simplification, lod, gap_reports=gap_reports
     )
 
-    stations_a = get_light_rail_stations(track, data, destination=spec.destination_a)
-    stations_b = get_light_rail_stations(track, data, destination=spec.destination_b)
-    stations = project_stations_onto_track(track, stations_a, stations_b)
-    pseudo_stations = get_pseudo_stations(
-        stations,
-        track,
-        projection,
-        minimum_distance=spec.pseudo_station_spacing_m,
-    )
-    return LightRailLineGeometry(spec.ref, track, stations, pseudo_stations)
+
+def remove_shared_corridor_stations(light_rail_lines):
+    """
+    Finds where each line's track runs along an earlier line's and drops the
+    later line's stations and pseudo stations there, so a shared corridor
+    (L2 and L3 between Circular Quay and Moore Park) gets one set of LEDs.
+    """
+    earlier_lines = []
+    for line in light_rail_lines:
+        line_xy = (line.track.map_x, line.track.map_y)
+        for earlier_line in earlier_lines:
+            line.shared_corridors.extend(
+                find_shared_corridors(
+                    line.ref, line_xy, earlier_line.ref, (earlier_line.track.map_x, earlier_line.track.map_y)
+                )
+            )
+        if line.shared_corridors:
+            line.stations = [station for station in line.stations if not is_in_shared_corridor(line, station)]
+            line.pseudo_stations = [
+                station for station in line.pseudo_stations if not is_in_shared_corridor(line, station)
+            ]
+        earlier_lines.append(line)
 
 
-def write_light_rail_outputs(light_rail_line):
-    stations = sorted(
+def is_in_shared_corridor(line, station):
+    chainage = station.chainage
+    return any(corridor.contains(chainage) for corridor in line.shared_corridors)
+
+
+def get_board_stations(light_rail_line):
+    """The stations and pseudo stations that get LEDs, in the order create_board reads them."""
+    return sorted(
         light_rail_line.stations + light_rail_line.pseudo_stations,
         key=lambda station: station.chainage,
     )
+
+
+def write_light_rail_outputs(light_rail_line):
+    stations = get_board_stations(light_rail_line)
     with open(f"{light_rail_line.ref}_stations_geometry.pckl", "wb") as file:
         pickle.dump(stations, file)
     with open(f"{light_rail_line.ref}_track_geometry.pckl", "wb") as file:
         pickle.dump(light_rail_line.track, file)
+    if light_rail_line.lod is None:
+        return []
+    return list(write_lod_pyramid(light_rail_line.ref, light_rail_line.lod).values())
+
+
+def load_light_rail_outputs(ref):
+    with open(f"{ref}_track_geometry.pckl", "rb") as file:
+        track = pickle.load(file)
+    with open(f"{ref}_stations_geometry.pckl", "rb") as file:
+        stations = pickle.load(file)
+    return track, stations
+
+
+def export_firmware_bundle(light_rail_lines, path):
+    """
+    Writes the firmware bundle from the lines just built, or from the written
+    light rail outputs when an incremental digest left them untouched.
+    """
+    tracks = {}
+    stations = []
+    for spec in LIGHT_RAIL_SPECS:
+        if spec.ref in light_rail_lines:
+            line = light_rail_lines[spec.ref]
+            track, line_stations = line.track, get_board_stations(line)
+        elif light_rail_outputs_exist(spec.ref):
+            track, line_stations = load_light_rail_outputs(spec.ref)
+        else:
+            continue
+        tracks[spec.ref] = track
+        stations.extend(line_stations)
+    if not tracks:
+        raise ValueError("No light rail lines to export")
+    bundle = build_firmware_bundle(tracks, stations)
+    return bundle, write_firmware_bundle(bundle, path)
+
 
 def is_train_relation(tags):
     ref = tags.get("ref")
@@ -438,7 +590,19 @@ def is_train_relation(tags):
     return False
 
 
-def build_train_route_groups(data, projection):
+def build_train_route_groups(
+    data,
+    projection,
+    simplify_tolerance_m=0.0,
+    profiler=NULL_PROFILER,
+    lod_level_tolerances=None,
+    refs=None,
+    skipped=None,
+):
+    """
+    Builds a RouteGeometryGroup per train ref. A ref that fails to build is
+    recorded in skipped, {ref: message}, when given, and raises otherwise.
+    """
     grouped_segments = defaultdict(list)
     relation_names = defaultdict(set)
     destinations = defaultdict(set)
@@ -453,6 +617,8 @@ def build_train_route_groups(data, projection):
             continue
 
         ref = properties["ref"]
+        if refs is not None and ref not in refs:
+            continue
         grouped_segments[ref].extend(segments)
 
         route_name = properties.get("name")
@@ -465,18 +631,63 @@ def build_train_route_groups(data, projection):
 
     route_groups = {}
     for ref, segments in sorted(grouped_segments.items()):
-        geometry = merge_line_segments(segments)
+        try:
+            route_groups[ref] = build_train_route_group(
+                ref,
+                segments,
+                relation_names[ref],
+                destinations[ref],
+                projection,
+                simplify_tolerance_m,
+                profiler,
+                lod_level_tolerances,
+            )
+        except ValueError as error:
+            if skipped is None:
+                raise
+            skipped[ref] = str(error)
+    return route_groups
+
+
+def build_train_route_group(
+    ref, segments, relation_names, destinations, projection, simplify_tolerance_m, profiler, lod_level_tolerances
+):
+    with profiler.stage("train_merge", ref) as record:
+        geometry, gap_report = bridge_gaps(ref, merge_line_segments(segments), projection)
         track_components = build_track_components(ref, geometry, projection)
-        route_groups[ref] = RouteGeometryGroup(
-            ref=ref,
-            mode="train",
-            relation_names=tuple(sorted(relation_names[ref])),
-            destinations=tuple(sorted(destinations[ref])),
-            geometry_geo=geometry,
-            geometry_map=build_map_geometry(track_components),
-            track_components=track_components,
+        record.features = len(segments)
+        record.vertices_in = count_vertices(segments)
+        record.vertices_out = count_track_vertices(track_components)
+    lod = build_lod(
+        [(track.name, (track.map_x, track.map_y)) for track in track_components],
+        lod_level_tolerances,
+        projection,
+        profiler,
+        ref,
+    )
+    with profiler.stage("train_simplify", ref) as record:
+        record.features = len(track_components)
+        record.vertices_in = count_track_vertices(track_components)
+        track_components, simplification = simplify_track_components(
+            ref, track_components, simplify_tolerance_m, projection
         )
-    return route_groups
+        record.vertices_out = count_track_vertices(track_components)
+    with profiler.stage("train_graph", ref) as record:
+        graph = TrackGraph.from_tracks(track_components)
+        record.features = graph.edge_count
+    return RouteGeometryGroup(
+        ref=ref,
+        mode="train",
+        relation_names=tuple(sorted(relation_names)),
+        destinations=tuple(sorted(destinations)),
+        geometry_geo=geometry,
+        geometry_map=build_map_geometry(track_components),
+        track_components=track_components,
+        simplification=simplification,
+        lod=lod,
+        graph=graph,
+        gap_report=gap_report,
+    )
 
 
 def sanitise_ref_for_filename(ref):
@@ -485,12 +696,35 @@ def sanitise_ref_for_filename(ref):
 
 def write_train_route_outputs(route_groups):
     output_paths = {}
+    lod_paths = []
     for ref, route_group in route_groups.items():
         filename = f"{sanitise_ref_for_filename(ref)}_tracks_geometry.pckl"
         with open(filename, "wb") as file:
-            pickle.dump(route_group, file)
+            # The pyramid goes to its own per-level files rather than into every group pickle.
+            pickle.dump(replace(route_group, lod=None), file)
+        if route_group.lod is not None:
+            lod_paths.extend(write_lod_pyramid(sanitise_ref_for_filename(ref), route_group.lod).values())
         output_paths[ref] = filename
-    return output_paths
+    return output_paths, lod_paths
+
+
+def light_rail_outputs_exist(ref):
+    return all(
+        Path(path).exists()
+        for path in (f"{ref}_stations_geometry.pckl", f"{ref}_track_geometry.pckl")
+    )
+
+
+def get_train_refs_to_rebuild(changed_refs, train_index):
+    """Changed train refs, plus any train ref in the export whose output file is missing."""
+    refs = set(changed_refs)
+    for feature_id, (_, feature_refs) in train_index.items():
+        if not feature_id.startswith("relation/"):
+            continue
+        for ref in feature_refs:
+            if not Path(f"{sanitise_ref_for_filename(ref)}_tracks_geometry.pckl").exists():
+                refs.add(ref)
+    return refs
 
 
 def collect_available_route_refs(data):
@@ -508,77 +742,195 @@ def collect_available_route_refs(data):
 
 
 def plot_outputs(light_rail_lines, train_route_groups):
-    for line in light_rail_lines.values():
-        plt.plot(line.track.map_x, line.track.map_y, color="lightgrey")
-        for station in line.stations:
-            plt.plot(station.map_x, station.map_y, marker="s", color="r")
-        for station in line.pseudo_stations:
-            plt.plot(station.map_x, station.map_y, marker="*", color="b")
-
-    for route_group in train_route_groups.values():
-        for track in route_group.track_components:
-            plt.plot(track.map_x, track.map_y, color="black", linewidth=0.8)
+    """Writes an SVG preview of what this run built, for checking in a browser."""
+    from svg_preview import (
+        LIGHT_RAIL_LINE_WIDTH_PX,
+        PREVIEW_OUTPUT_PATH,
+        TRAIN_LINE_WIDTH_PX,
+        PreviewLine,
+        get_line_colour,
+        write_preview,
+    )
 
-    plt.gca().axis("equal")
-    plt.show()
+    lines = [
+        PreviewLine(ref, get_line_colour(ref), LIGHT_RAIL_LINE_WIDTH_PX, [(line.track.map_x, line.track.map_y)])
+        for ref, line in light_rail_lines.items()
+    ]
+    lines.extend(
+        PreviewLine(
+            ref,
+            get_line_colour(ref),
+            TRAIN_LINE_WIDTH_PX,
+            [(track.map_x, track.map_y) for track in route_group.track_components],
+        )
+        for ref, route_group in train_route_groups.items()
+    )
+    stations = [station for line in light_rail_lines.values() for station in get_board_stations(line)]
+    write_preview(PREVIEW_OUTPUT_PATH, lines, stations)
+    return PREVIEW_OUTPUT_PATH
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", help="Path to the light rail geojson/json file")
     parser.add_argument("--train-input", help="Path to the train geojson/json file")
-    parser.add_argument("--plot", action="store_true", help="Show a debug plot")
+    parser.add_argument("--plot", action="store_true", help="Write an SVG preview of the outputs to preview.svg")
+    parser.add_argument(
+        "--simplify-tolerance-mm",
+        type=float,
+        default=PCB_SIMPLIFY_TOLERANCE_MM,
+        help="Maximum deviation of simplified tracks in PCB millimetres (0 disables simplification)",
+    )
+    add_profile_arguments(parser)
+    parser.add_argument(
+        "--projection",
+        choices=PROJECTION_BACKENDS,
+        default=DEFAULT_PROJECTION_BACKEND,
+        help="Map projection backend; digest and board must use the same one",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only rebuild the refs whose OSM features changed since the last digest",
+    )
+    parser.add_argument(
+        "--firmware-bundle",
+        metavar="PATH",
+        help="Also write the light rail firmware bundle here, as a C header if PATH ends in .h",
+    )
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
-    light_rail_data, light_rail_input_path = load_export_data(args.input)
-
-    projection = MapProjection(
-        origin_lon=151.22289335,
-        origin_lat=-33.8937485,
-        scale=1 / 25000,
-        pcb_origin_mm=PCB_ORIGIN_MM,
-    )
-
-    light_rail_lines = {}
-    skipped_light_rail_lines = {}
-    for spec in LIGHT_RAIL_SPECS:
+    profiler = profiler_from_args(args, modules=(sys.modules[__name__],))
+    settings = {"simplify_tolerance_mm": args.simplify_tolerance_mm, "projection": args.projection}
+    manifest = load_manifest() if args.incremental else None
+    indexes = {}
+    unchanged_refs = []
+    with profiler:
+        with profiler.stage("load_light_rail") as record:
+            light_rail_data, light_rail_input_path = load_export_data(args.input)
+            record.features = len(light_rail_data["features"])
+        with profiler.stage("index_light_rail") as record:
+            indexes["lightrail"] = index_export(light_rail_data)
+            light_rail_refs, light_rail_diff = plan_rebuild(manifest, settings, "lightrail", indexes["lightrail"])
+            record.features = len(indexes["lightrail"])
+
+        projection = MapProjection(
+            origin_lon=151.22289335,
+            origin_lat=-33.8937485,
+            scale=1 / 25000,
+            pcb_origin_mm=PCB_ORIGIN_MM,
+            backend=args.projection,
+        )
+        simplify_tolerance_m = map_tolerance_from_pcb_mm(args.simplify_tolerance_mm, projection.scale)
+        lod_level_tolerances = get_level_tolerances(simplify_tolerance_m)
+
+        light_rail_lines = {}
+        skipped_light_rail_lines = {}
+        lod_paths = []
+        # Shared corridors tie the light rail lines together, so they are rebuilt all or none.
+        rebuild_light_rail = light_rail_refs is None or any(
+            spec.ref in light_rail_refs or not light_rail_outputs_exist(spec.ref) for spec in LIGHT_RAIL_SPECS
+        )
+        for spec in LIGHT_RAIL_SPECS:
+            if not rebuild_light_rail:
+                unchanged_refs.append(spec.ref)
+                continue
+            try:
+                line = build_light_rail_line(
+                    spec, light_rail_data, projection, simplify_tolerance_m, profiler, lod_level_tolerances
+                )
+            except ValueError as error:
+                skipped_light_rail_lines[spec.ref] = str(error)
+                continue
+            light_rail_lines[spec.ref] = line
+
+        with profiler.stage("light_rail_shared_corridors") as record:
+            remove_shared_corridor_stations(light_rail_lines.values())
+            record.features = sum(len(line.shared_corridors) for line in light_rail_lines.values())
+        for line in light_rail_lines.values():
+            with profiler.stage("write_light_rail", line.ref):
+                lod_paths.extend(write_light_rail_outputs(line))
+        if args.firmware_bundle:
+            with profiler.stage("firmware_bundle") as record:
+                firmware_bundle, firmware_bundle_size = export_firmware_bundle(light_rail_lines, args.firmware_bundle)
+                record.features = firmware_bundle.led_count
+
+        train_diff = None
+        skipped_train_routes = {}
         try:
-            line = build_light_rail_line(spec, light_rail_data, projection)
-        except ValueError as error:
-            skipped_light_rail_lines[spec.ref] = str(error)
-            continue
-
-        write_light_rail_outputs(line)
-        light_rail_lines[spec.ref] = line
-
-    try:
-        train_data, train_input_path = load_train_data(args.train_input)
-        train_route_groups = build_train_route_groups(train_data, projection)
-        train_output_paths = write_train_route_outputs(train_route_groups)
-    except FileNotFoundError:
-        train_input_path = None
-        train_route_groups = {}
-        train_output_paths = {}
-
-    if args.plot:
-        plot_outputs(light_rail_lines, train_route_groups)
+            with profiler.stage("load_trains") as record:
+                train_data, train_input_path = load_train_data(args.train_input)
+                record.features = len(train_data["features"])
+            with profiler.stage("index_trains") as record:
+                indexes["trains"] = index_export(train_data)
+                train_refs, train_diff = plan_rebuild(manifest, settings, "trains", indexes["trains"])
+                if train_refs is not None:
+                    train_refs = get_train_refs_to_rebuild(train_refs, indexes["trains"])
+                    unchanged_refs.extend(sorted(set(collect_available_route_refs(train_data)) - train_refs))
+                record.features = len(indexes["trains"])
+            train_route_groups = build_train_route_groups(
+                train_data,
+                projection,
+                simplify_tolerance_m,
+                profiler,
+                lod_level_tolerances,
+                train_refs,
+                skipped_train_routes,
+            )
+            with profiler.stage("write_trains") as record:
+                train_output_paths, train_lod_paths = write_train_route_outputs(train_route_groups)
+                lod_paths.extend(train_lod_paths)
+                record.features = len(train_output_paths)
+        except FileNotFoundError:
+            train_input_path = None
+            train_route_groups = {}
+            train_output_paths = {}
+        # Refs that failed keep their old outputs; leave their features out so the next run retries them.
+        for name, skipped in (("lightrail", skipped_light_rail_lines), ("trains", skipped_train_routes)):
+            if name in indexes and skipped:
+                indexes[name] = without_refs(indexes[name], skipped)
+        save_manifest(settings, indexes)
+    report_profile(profiler, args)
+
+    if args.plot and (light_rail_lines or train_route_groups):
+        print(f"Wrote preview to {plot_outputs(light_rail_lines, train_route_groups)}")
 
     print(f"Loaded light rail export from {light_rail_input_path}")
     if light_rail_lines:
         print(f"Wrote light rail outputs for: {', '.join(sorted(light_rail_lines))}")
+    for line in light_rail_lines.values():
+        for corridor in line.shared_corridors:
+            print(f"Shared corridor: {corridor.describe()}; its stations are placed once, on {corridor.shared_with}")
+    gap_reports = [report for line in light_rail_lines.values() for report in line.gap_reports]
+    gap_reports.extend(route_group.gap_report for route_group in train_route_groups.values() if route_group.gap_report)
+    for report in gap_reports:
+        if report.gaps or report.pieces_out > 1:
+            print(f"Track pieces: {report.describe()}")
+    if args.firmware_bundle:
+        print(
+            f"Wrote {firmware_bundle_size} byte firmware bundle to {args.firmware_bundle}: "
+            f"{firmware_bundle.describe()}"
+        )
     if skipped_light_rail_lines:
         print("Skipped light rail outputs for:")
         for ref, message in skipped_light_rail_lines.items():
             print(f"  {ref}: {message}")
 
+    if skipped_train_routes:
+        print("Skipped train outputs for:")
+        for ref, message in skipped_train_routes.items():
+            print(f"  {ref}: {message}")
+
     if train_output_paths:
         print(f"Loaded train export from {train_input_path}")
         print("Wrote train route geometry for:")
         for ref, filename in train_output_paths.items():
-            print(f"  {ref}: {filename}")
+            print(f"  {ref}: {filename} ({train_route_groups[ref].graph.describe()})")
+    elif train_diff is not None:
+        print(f"Loaded train export from {train_input_path}")
     else:
         if train_input_path is None:
             print("No train geojson/json file was found.")
@@ -588,6 +940,25 @@ def main():
             print("No train routes were found in the current train export.")
             print(f"Available route refs in this file: {available_refs}")
 
+    for name, diff in (("light rail", light_rail_diff), ("train", train_diff)):
+        if diff is not None:
+            print(f"Incremental {name} update: {diff.describe()}")
+    if unchanged_refs:
+        print(f"Unchanged since the last digest: {', '.join(unchanged_refs)}")
+
+    if lod_paths:
+        print(f"Wrote level-of-detail pyramids ({', '.join(LOD_LEVEL_NAMES)}): {', '.join(lod_paths)}")
+
+    simplification_reports = [
+        geometry.simplification
+        for geometry in (*light_rail_lines.values(), *train_route_groups.values())
+        if geometry.simplification is not None
+    ]
+    if simplification_reports and args.simplify_tolerance_mm > 0:
+        print(f"Simplified tracks to {args.simplify_tolerance_mm} mm PCB tolerance:")
+        for report in simplification_reports:
+            print(f"  {report.describe()}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,350 @@
+import bisect
+import re
+import struct
+import time
+
+import numpy as np
+
+from line_refs import MAP_ROUTE_REFS
+from network_status import get_route_ref
+
+DEFAULT_VEHICLE_CAPACITY = 1024
+
+# One row per vehicle; ref indexes the decoder's refs, direction is -1 when the feed omits it.
+VEHICLE_DTYPE = np.dtype([
+    ("ref", np.int16),
+    ("direction", np.int8),
+    ("latitude", np.float32),
+    ("longitude", np.float32),
+    ("bearing", np.float32),
+    ("timestamp", np.int64),
+])
+
+# Protobuf wire types.
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+# GTFS-realtime field numbers for the path down to what the map uses.
+FEED_HEADER = 1
+FEED_ENTITY = 2
+HEADER_TIMESTAMP = 3
+ENTITY_VEHICLE = 4
+VEHICLE_TRIP = 1
+VEHICLE_POSITION = 2
+VEHICLE_TIMESTAMP = 5
+VEHICLE_DESCRIPTOR = 8
+VEHICLE_DESCRIPTOR_ID = 1
+VEHICLE_DESCRIPTOR_LABEL = 2
+TRIP_TRIP_ID = 1
+TRIP_ROUTE_ID = 5
+TRIP_DIRECTION_ID = 6
+POSITION_LATITUDE = 1
+POSITION_LONGITUDE = 2
+POSITION_BEARING = 3
+
+
+def read_varint(data, position):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+def skip_field(data, position, wire_type):
+    if wire_type == VARINT:
+        while data[position] >= 0x80:
+            position += 1
+        return position + 1
+    if wire_type == LENGTH_DELIMITED:
+        length, position = read_varint(data, position)
+        return position + length
+    if wire_type == FIXED32:
+        return position + 4
+    if wire_type == FIXED64:
+        return position + 8
+    raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+
+
+class VehiclePositionDecoder:
+    """
+    Reads just the route, direction, position and timestamp of the vehicles
+    on the given refs straight from GTFS-realtime wire bytes into a reused
+    structured array. Top-level entities are stepped over by length, a regex
+    over the raw bytes picks out the few holding one of our route ids, and
+    only those are parsed, down to the fields the map uses.
+    """
+
+    def __init__(self, refs=MAP_ROUTE_REFS, route_refs=None, capacity=DEFAULT_VEHICLE_CAPACITY):
+        self.refs = tuple(refs)
+        self.route_refs = dict(route_refs or {})
+        self.vehicles = np.zeros(capacity, dtype=VEHICLE_DTYPE)
+        self._ref_indices = {}
+        prefixes = sorted({*self.refs, *self.route_refs}, key=len, reverse=True)
+        # A TripDescriptor.route_id field (key 0x2a, then a one or two byte length)
+        # starting with one of the refs or mapped route ids.
+        self.route_id_pattern = re.compile(
+            rb"\x2a(?:[\x80-\xff][\x00-\x7f]|[\x00-\x7f])(?:"
+            + b"|".join(re.escape(prefix.encode("utf-8")) for prefix in prefixes)
+            + rb")"
+        )
+
+    def ref_index(self, route_id):
+        """Index of route_id's ref in self.refs, or -1; cached per raw route id."""
+        index = self._ref_indices.get(route_id)
+        if index is None:
+            text = route_id.decode("utf-8")
+            ref = self.route_refs.get(text) or get_route_ref(text, self.refs)
+            index = self._ref_indices[route_id] = -1 if ref is None else self.refs.index(ref)
+        return index
+
+    def decode(self, data):
+        """Returns the feed timestamp and a view of the vehicles array holding this message's vehicles."""
+        data = bytes(data)
+        timestamp = 0
+        entity_starts = []
+        entity_ends = []
+        position = 0
+        end = len(data)
+        while position < end:
+            key = data[position]
+            position += 1
+            if key > 0x7F:
+                key, position = read_varint(data, position - 1)
+            if key & 7 != LENGTH_DELIMITED:
+                position = skip_field(data, position, key & 7)
+                continue
+            length = data[position]
+            position += 1
+            if length > 0x7F:
+                length, position = read_varint(data, position - 1)
+            if key == FEED_ENTITY << 3 | LENGTH_DELIMITED:
+                entity_starts.append(position)
+                entity_ends.append(position + length)
+            elif key == FEED_HEADER << 3 | LENGTH_DELIMITED:
+                timestamp = self.decode_header_timestamp(data, position, position + length)
+            position += length
+
+        # Only entities containing a wanted route id are parsed. The search runs
+        # in C over the raw bytes; a stray match costs one entity parse, no more.
+        candidates = sorted({
+            bisect.bisect_right(entity_starts, match.start()) - 1
+            for match in self.route_id_pattern.finditer(data)
+        })
+        # Per kept vehicle: ref, direction, timestamp, and the offsets of its
+        # latitude, longitude and bearing floats, gathered in one go at the end.
+        refs = []
+        directions = []
+        timestamps = []
+        float_offsets = []
+        for index in candidates:
+            if index < 0:
+                continue
+            self.decode_entity(
+                data, entity_starts[index], entity_ends[index], refs, directions, timestamps, float_offsets
+            )
+        return timestamp or int(time.time()), self.fill_vehicles(data, refs, directions, timestamps, float_offsets)
+
+    def decode_header_timestamp(self, data, position, end):
+        while position < end:
+            key, position = read_varint(data, position)
+            if key == HEADER_TIMESTAMP << 3 | VARINT:
+                return read_varint(data, position)[0]
+            position = skip_field(data, position, key & 7)
+        return 0
+
+    def decode_entity(self, data, position, end, refs, directions, timestamps, float_offsets):
+        """
+        Appends the entity's vehicle to the output lists if it is on one of our
+        refs. Every field key and length the map cares about fits in one byte,
+        so those are read inline and only longer ones go through read_varint.
+        """
+        ref = -1
+        direction = -1
+        vehicle_timestamp = 0
+        latitude_offset = longitude_offset = bearing_offset = -1
+        in_vehicle = False
+        while position < end:
+            key = data[position]
+            position += 1
+            if key > 0x7F:
+                key, position = read_varint(data, position - 1)
+            wire_type = key & 7
+            if wire_type == LENGTH_DELIMITED:
+                length = data[position]
+                position += 1
+                if length > 0x7F:
+                    length, position = read_varint(data, position - 1)
+                if key == ENTITY_VEHICLE << 3 | LENGTH_DELIMITED and not in_vehicle:
+                    # Descend into the VehiclePosition; its end becomes the loop's end.
+                    in_vehicle = True
+                    end = position + length
+                elif key == VEHICLE_TRIP << 3 | LENGTH_DELIMITED and in_vehicle:
+                    ref, direction = self.decode_trip(data, position, position + length)
+                    if ref < 0:
+                        return
+                    position += length
+                elif key == VEHICLE_POSITION << 3 | LENGTH_DELIMITED and in_vehicle:
+                    position_end = position + length
+                    while position < position_end:
+                        key = data[position]
+                        position += 1
+                        if key == POSITION_LATITUDE << 3 | FIXED32:
+                            latitude_offset = position
+                        elif key == POSITION_LONGITUDE << 3 | FIXED32:
+                            longitude_offset = position
+                        elif key == POSITION_BEARING << 3 | FIXED32:
+                            bearing_offset = position
+                        else:
+                            if key > 0x7F:
+                                key, position = read_varint(data, position - 1)
+                            position = skip_field(data, position, key & 7)
+                            continue
+                        position += 4
+                else:
+                    position += length
+            elif key == VEHICLE_TIMESTAMP << 3 | VARINT and in_vehicle:
+                vehicle_timestamp, position = read_varint(data, position)
+            else:
+                position = skip_field(data, position, wire_type)
+        if ref < 0 or latitude_offset < 0 or longitude_offset < 0:
+            return
+        refs.append(ref)
+        directions.append(direction)
+        timestamps.append(vehicle_timestamp)
+        float_offsets.extend((latitude_offset, longitude_offset, bearing_offset))
+
+    def decode_trip(self, data, position, end):
+        ref = -1
+        direction = -1
+        while position < end:
+            key = data[position]
+            position += 1
+            if key == TRIP_ROUTE_ID << 3 | LENGTH_DELIMITED:
+                length = data[position]
+                position += 1
+                if length > 0x7F:
+                    length, position = read_varint(data, position - 1)
+                route_id = data[position:position + length]
+                ref = self._ref_indices.get(route_id)
+                if ref is None:
+                    ref = self.ref_index(route_id)
+                position += length
+            elif key == TRIP_DIRECTION_ID << 3 | VARINT:
+                direction, position = read_varint(data, position)
+            else:
+                if key > 0x7F:
+                    key, position = read_varint(data, position - 1)
+                position = skip_field(data, position, key & 7)
+        return ref, direction
+
+    def fill_vehicles(self, data, refs, directions, timestamps, float_offsets):
+        count = len(refs)
+        if count > len(self.vehicles):
+            self.vehicles = np.zeros(max(count, 2 * len(self.vehicles)), dtype=VEHICLE_DTYPE)
+        vehicles = self.vehicles[:count]
+        if count == 0:
+            return vehicles
+        # Gather each float's four bytes from the raw message; a missing bearing becomes NaN.
+        offsets = np.array(float_offsets, dtype=np.int64).reshape(count, 3)
+        missing = offsets < 0
+        offsets[missing] = 0
+        raw = np.frombuffer(data, dtype=np.uint8)
+        floats = raw[offsets[..., None] + np.arange(4)].copy().view("<f4")[..., 0]
+        floats[missing] = np.nan
+        vehicles["ref"] = refs
+        vehicles["direction"] = directions
+        vehicles["latitude"] = floats[:, 0]
+        vehicles["longitude"] = floats[:, 1]
+        vehicles["bearing"] = floats[:, 2]
+        vehicles["timestamp"] = timestamps
+        return vehicles
+
+
+def decode_vehicle_positions_generic(data, refs=MAP_ROUTE_REFS):
+    """
+    The same rows through the full gtfs-realtime-bindings decode, which
+    builds an object for every entity; kept as the benchmark baseline.
+    """
+    try:
+        from google.transit import gtfs_realtime_pb2
+    except ImportError as error:
+        raise ImportError("The generic decoder needs the gtfs-realtime-bindings package") from error
+
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.ParseFromString(data)
+    rows = []
+    for entity in message.entity:
+        if not entity.HasField("vehicle") or not entity.vehicle.HasField("position"):
+            continue
+        vehicle = entity.vehicle
+        ref = get_route_ref(vehicle.trip.route_id, refs)
+        if ref is None:
+            continue
+        direction = vehicle.trip.direction_id if vehicle.trip.HasField("direction_id") else -1
+        position = vehicle.position
+        bearing = position.bearing if position.HasField("bearing") else np.nan
+        rows.append((refs.index(ref), direction, position.latitude, position.longitude, bearing, vehicle.timestamp))
+    return message.header.timestamp, np.array(rows, dtype=VEHICLE_DTYPE)
+
+
+def write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def write_message_field(buffer, field_number, payload):
+    write_varint(buffer, field_number << 3 | LENGTH_DELIMITED)
+    write_varint(buffer, len(payload))
+    buffer.extend(payload)
+
+
+def encode_vehicle_feed(timestamp, vehicles):
+    """
+    Serialises a VehiclePositions FeedMessage from (entity id, route id,
+    direction or None, latitude, longitude, bearing, timestamp) tuples, the
+    entity id doubling as trip and vehicle id; used to build feed fixtures
+    without the protobuf package.
+    """
+    header = bytearray(b"\x0a\x032.0")
+    write_varint(header, HEADER_TIMESTAMP << 3 | VARINT)
+    write_varint(header, timestamp)
+    feed = bytearray()
+    write_message_field(feed, FEED_HEADER, header)
+    for entity_id, route_id, direction, latitude, longitude, bearing, vehicle_timestamp in vehicles:
+        trip = bytearray()
+        write_message_field(trip, TRIP_TRIP_ID, entity_id.encode("utf-8"))
+        write_message_field(trip, TRIP_ROUTE_ID, route_id.encode("utf-8"))
+        if direction is not None:
+            write_varint(trip, TRIP_DIRECTION_ID << 3 | VARINT)
+            write_varint(trip, direction)
+        position = bytearray()
+        for field_number, value in (
+            (POSITION_LATITUDE, latitude),
+            (POSITION_LONGITUDE, longitude),
+            (POSITION_BEARING, bearing),
+        ):
+            write_varint(position, field_number << 3 | FIXED32)
+            position.extend(struct.pack("<f", value))
+        vehicle = bytearray()
+        write_message_field(vehicle, VEHICLE_TRIP, trip)
+        write_message_field(vehicle, VEHICLE_POSITION, position)
+        write_varint(vehicle, VEHICLE_TIMESTAMP << 3 | VARINT)
+        write_varint(vehicle, vehicle_timestamp)
+        descriptor = bytearray()
+        write_message_field(descriptor, VEHICLE_DESCRIPTOR_ID, entity_id.encode("utf-8"))
+        write_message_field(descriptor, VEHICLE_DESCRIPTOR_LABEL, f"{route_id} {entity_id}".encode("utf-8"))
+        write_message_field(vehicle, VEHICLE_DESCRIPTOR, descriptor)
+        entity = bytearray()
+        write_message_field(entity, 1, entity_id.encode("utf-8"))
+        write_message_field(entity, ENTITY_VEHICLE, vehicle)
+        write_message_field(feed, FEED_ENTITY, entity)
+    return bytes(feed)
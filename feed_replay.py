@@ -0,0 +1,221 @@
+import argparse
+import os
+import struct
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from feed_decoder import encode_vehicle_feed
+from network_status import API_KEY_ENVIRONMENT_VARIABLE, POLL_INTERVAL_S, read_feed
+
+FEED_LOG_MAGIC = b"SLRFEED\x01"
+# Per snapshot: capture time (unix seconds), flags, payload length.
+RECORD_HEADER = struct.Struct("<dBI")
+COMPRESSED = 0x01
+# Synthetic days: service hours, tram speed and how many trams each line runs per direction.
+SYNTHETIC_SERVICE_HOURS = 24.0
+SYNTHETIC_TRAM_SPEED_M_S = 6.0
+SYNTHETIC_TRAMS_PER_DIRECTION = 12
+
+
+@dataclass
+class ReplayStats:
+    snapshots: int = 0
+    payload_bytes: int = 0
+    feed_seconds: float = 0.0
+    wall_seconds: float = 0.0
+    sink_seconds: float = 0.0
+
+    def describe(self):
+        per_snapshot_ms = self.sink_seconds / self.snapshots * 1000 if self.snapshots else 0.0
+        return (
+            f"{self.snapshots} snapshots ({self.payload_bytes / 1e6:.1f} MB) covering {self.feed_seconds / 3600:.1f} h "
+            f"replayed in {self.wall_seconds:.1f} s; ingestion {per_snapshot_ms:.2f} ms per snapshot"
+        )
+
+
+class FeedLogWriter:
+    """
+    Appends timestamped feed snapshots to a log: a magic header, then per
+    snapshot a fixed header and its zlib-compressed payload. Each record is
+    written whole, so a log cut short by a crash loses at most the last one.
+    With append=False an existing log is replaced rather than extended.
+    """
+
+    def __init__(self, path, compress=True, append=True):
+        self.path = Path(path)
+        self.compress = compress
+        self.file = open(self.path, "ab" if append else "wb")
+        if self.file.tell() == 0:
+            self.file.write(FEED_LOG_MAGIC)
+
+    def append(self, captured_at, data):
+        flags = 0
+        if self.compress:
+            data = zlib.compress(data)
+            flags |= COMPRESSED
+        self.file.write(RECORD_HEADER.pack(captured_at, flags, len(data)) + data)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_feed_log(path):
+    """Yields (captured_at, payload) per snapshot, stopping quietly at a truncated last record."""
+    with open(path, "rb") as file:
+        if file.read(len(FEED_LOG_MAGIC)) != FEED_LOG_MAGIC:
+            raise ValueError(f"{path} is not a feed log")
+        while True:
+            header = file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            captured_at, flags, length = RECORD_HEADER.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                return
+            yield captured_at, zlib.decompress(data) if flags & COMPRESSED else data
+
+
+def record_feed(source, path, interval_s=POLL_INTERVAL_S, duration_s=None, api_key=None):
+    """Polls source every interval_s, appending each snapshot to the log, until duration_s has passed."""
+    started = time.time()
+    snapshots = 0
+    with FeedLogWriter(path) as writer:
+        while duration_s is None or time.time() - started < duration_s:
+            polled_at = time.time()
+            writer.append(polled_at, read_feed(source, api_key))
+            snapshots += 1
+            time.sleep(max(interval_s - (time.time() - polled_at), 0.0))
+    return snapshots
+
+
+def replay_feed(path, sink, speed=1.0):
+    """
+    Feeds every snapshot of a log to sink(captured_at, payload). speed 1 is
+    real time, 60 a minute of feed per second, and 0 as fast as sink allows.
+    """
+    stats = ReplayStats()
+    started = time.perf_counter()
+    first_captured_at = None
+    for captured_at, data in iter_feed_log(path):
+        if first_captured_at is None:
+            first_captured_at = captured_at
+        if speed > 0:
+            due = (captured_at - first_captured_at) / speed
+            time.sleep(max(due - (time.perf_counter() - started), 0.0))
+        sink_started = time.perf_counter()
+        sink(captured_at, data)
+        stats.sink_seconds += time.perf_counter() - sink_started
+        stats.snapshots += 1
+        stats.payload_bytes += len(data)
+        stats.feed_seconds = captured_at - first_captured_at
+    stats.wall_seconds = time.perf_counter() - started
+    return stats
+
+
+def synthesize_day(tracks, path, interval_s=POLL_INTERVAL_S, start=None, seed=0):
+    """
+    Writes a day of VehiclePositions snapshots for trams running up and down
+    the digested tracks, so the runtime can be benchmarked without a feed.
+    """
+    rng = np.random.default_rng(seed)
+    start = int(time.time()) if start is None else start
+    trams = []
+    for ref, track in tracks.items():
+        xs = np.asarray(track.map_x, dtype=float)
+        ys = np.asarray(track.map_y, dtype=float)
+        chainage = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(xs), np.diff(ys)))))
+        for direction in (0, 1):
+            offsets = rng.uniform(0, 2 * chainage[-1], SYNTHETIC_TRAMS_PER_DIRECTION)
+            trams.extend((ref, track, xs, ys, chainage, direction, offset) for offset in offsets)
+
+    # A fresh log each time: appending a second day would step the clock back mid-replay.
+    with FeedLogWriter(path, append=False) as writer:
+        for step in range(int(SYNTHETIC_SERVICE_HOURS * 3600 / interval_s)):
+            timestamp = start + step * interval_s
+            rows = []
+            for index, (ref, track, xs, ys, chainage, direction, offset) in enumerate(trams):
+                # Each tram shuttles end to end; direction 1 runs the track backwards.
+                travelled = (offset + SYNTHETIC_TRAM_SPEED_M_S * step * interval_s) % (2 * chainage[-1])
+                along = chainage[-1] - abs(travelled - chainage[-1])
+                if direction:
+                    along = chainage[-1] - along
+                longitude, latitude = track.projection.map_to_geo(
+                    np.interp(along, chainage, xs), np.interp(along, chainage, ys)
+                )
+                rows.append(
+                    (f"{ref}.{index}", f"{ref}_1", direction, float(latitude), float(longitude), 0.0, int(timestamp))
+                )
+            writer.append(timestamp, encode_vehicle_feed(int(timestamp), rows))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Record realtime feeds to a log and replay them into the live map")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record", help="Poll a feed and append its snapshots to a log")
+    record.add_argument("source", help="Feed file path or URL")
+    record.add_argument("log", help="Feed log to append to")
+    record.add_argument("--interval", type=float, default=POLL_INTERVAL_S, help="Seconds between polls")
+    record.add_argument("--duration", type=float, help="Stop after this many seconds (default: run until interrupted)")
+    record.add_argument("--api-key", help=f"Open data API key (default: ${API_KEY_ENVIRONMENT_VARIABLE})")
+
+    replay = commands.add_parser("replay", help="Replay a log into the live map and LED frames, reporting throughput")
+    replay.add_argument("log", help="Feed log to replay")
+    replay.add_argument(
+        "--speed",
+        type=float,
+        default=0.0,
+        help="1 for real time, N for N times faster, 0 (default) for as fast as possible",
+    )
+
+    synthesize = commands.add_parser("synthesize", help="Write a day of synthetic tram positions on the digested tracks")
+    synthesize.add_argument("log", help="Feed log to write")
+    synthesize.add_argument("--interval", type=float, default=POLL_INTERVAL_S, help="Seconds between snapshots")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "record":
+        api_key = args.api_key or os.environ.get(API_KEY_ENVIRONMENT_VARIABLE)
+        snapshots = record_feed(args.source, args.log, args.interval, args.duration, api_key)
+        print(f"Recorded {snapshots} snapshots to {args.log}")
+    elif args.command == "synthesize":
+        from live_map import LIVE_MAP_REFS, load_track
+
+        synthesize_day({ref: load_track(ref) for ref in LIVE_MAP_REFS}, args.log, args.interval)
+        print(f"Wrote a synthetic day of {', '.join(LIVE_MAP_REFS)} trams to {args.log}")
+    else:
+        from led_frame import FrameBuffer, build_palette
+        from live_map import LiveMap
+
+        live_map = LiveMap.from_digest()
+        frame_buffer = FrameBuffer(len(live_map.frame))
+        frame_buffer.set_palette(build_palette(live_map.refs))
+        lit = []
+
+        def ingest(captured_at, data):
+            masks = live_map.ingest(data)
+            frame_buffer.render(masks, len(lit))
+            frame_buffer.encode_spi()
+            lit.append(int(np.count_nonzero(masks)))
+
+        stats = replay_feed(args.log, ingest, args.speed)
+        print(stats.describe())
+        if lit:
+            print(f"LEDs lit per frame: mean {np.mean(lit):.1f}, max {max(lit)} of {len(live_map.frame)}")
+
+
+if __name__ == "__main__":
+    main()
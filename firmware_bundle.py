@@ -0,0 +1,283 @@
+import struct
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+
+from led_allocation import allocate_leds
+from led_frame import DIRECTION_LEVELS, LINE_COLOURS
+
+FIRMWARE_BUNDLE_MAGIC = b"SLRB"
+FIRMWARE_BUNDLE_VERSION = 1
+FIRMWARE_BUNDLE_PATH = "light_rail_bundle.bin"
+# Chainages and track coordinates are stored as multiples of this, in 16 bits: a
+# quarter metre is far finer than the ~50 m an LED covers, and reaches 16 km of track.
+FIXED_POINT_UNIT_M = 0.25
+NO_NAME = 0xFF
+# magic, version, line count, direction dim level, LED count, name count, then the byte
+# offsets of the per-LED name indices, the name offsets and the names; the fixed-point
+# unit; the projection origin; and the affine map from degrees about it to map metres.
+BUNDLE_HEADER = struct.Struct("<4sBBBxHHHHHxxfdd6f")
+# ref, RGB colour, frame bit of direction 0, vertex count, LED count, track length, and
+# the byte offsets of the vertex x, y and chainage arrays and the LED chainage and index arrays.
+LINE_RECORD = struct.Struct("<4s3BBHHHHHHHH")
+BUNDLE_CHECKSUM = struct.Struct("<I")
+C_HEADER_BYTES_PER_ROW = 16
+
+
+@dataclass
+class FirmwareBundleLine:
+    ref: str
+    colour: tuple[int, int, int]
+    frame_bit: int
+    track_length_m: float
+    vertex_x: np.ndarray
+    vertex_y: np.ndarray
+    vertex_chainage: np.ndarray
+    led_chainage: np.ndarray
+    led_index: np.ndarray
+
+
+@dataclass
+class FirmwareBundle:
+    """
+    Everything the board's firmware needs to turn vehicle positions into LED
+    frames, in fixed point: per line its simplified track and the LEDs along
+    it sorted by chainage, and per LED in chain order its station name.
+    """
+    origin: tuple[float, float]
+    geo_affine: tuple[float, ...]
+    lines: list[FirmwareBundleLine]
+    led_names: list[int]
+    names: list[str]
+    fit_error_m: float = 0.0
+
+    @property
+    def led_count(self):
+        return len(self.led_names)
+
+    def describe(self):
+        return (
+            f"{len(self.lines)} lines, {self.led_count} LEDs, {len(self.names)} station names; "
+            f"projection fit within {self.fit_error_m:.2f} m"
+        )
+
+
+def to_fixed_point(values, unit_m=FIXED_POINT_UNIT_M, signed=False):
+    dtype = np.int16 if signed else np.uint16
+    fixed = np.rint(np.asarray(values, dtype=float) / unit_m)
+    limits = np.iinfo(dtype)
+    if len(fixed) and (fixed.min() < limits.min or fixed.max() > limits.max):
+        raise ValueError(f"Values up to {np.abs(values).max():.0f} m do not fit 16 bits at {unit_m} m")
+    return fixed.astype(dtype)
+
+
+def fit_geo_affine(tracks):
+    """
+    The affine map from (longitude, latitude) about the projection origin to
+    map metres that best fits every track vertex, so firmware need not
+    carry the projection backend. Over the light rail network the fit is
+    good to well under a metre whichever backend digested it.
+    """
+    projection = next(iter(tracks.values())).projection
+    origin_lon, origin_lat = projection.origin
+    longitudes = np.concatenate([np.asarray(track.longitudes, dtype=float) for track in tracks.values()])
+    latitudes = np.concatenate([np.asarray(track.latitudes, dtype=float) for track in tracks.values()])
+    map_x = np.concatenate([np.asarray(track.map_x, dtype=float) for track in tracks.values()])
+    map_y = np.concatenate([np.asarray(track.map_y, dtype=float) for track in tracks.values()])
+    design = np.column_stack((longitudes - origin_lon, latitudes - origin_lat, np.ones(len(longitudes))))
+    (x_lon, y_lon), (x_lat, y_lat), (x_offset, y_offset) = np.linalg.lstsq(
+        design, np.column_stack((map_x, map_y)), rcond=None
+    )[0]
+    affine = (x_lon, x_lat, x_offset, y_lon, y_lat, y_offset)
+    fitted = design @ np.array(affine, dtype=np.float32).astype(float).reshape(2, 3).T
+    fit_error_m = float(np.max(np.hypot(fitted[:, 0] - map_x, fitted[:, 1] - map_y)))
+    return (origin_lon, origin_lat), affine, fit_error_m
+
+
+def build_firmware_bundle(tracks, stations):
+    """
+    Builds the bundle from the digested tracks ({ref: Track}, in frame bit
+    order) and the board's stations in the order create_board places them,
+    allocating LEDs exactly as create_board does so firmware and PCB agree.
+    """
+    allocation = allocate_leds(stations)
+    if len(allocation.slots) >= NO_NAME:
+        raise ValueError(f"{len(allocation.slots)} LEDs do not fit the bundle's 8-bit LED indices")
+    origin, geo_affine, fit_error_m = fit_geo_affine(tracks)
+
+    lines = []
+    for ref_index, (ref, track) in enumerate(tracks.items()):
+        map_x = np.asarray(track.map_x, dtype=float)
+        map_y = np.asarray(track.map_y, dtype=float)
+        vertex_chainage = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(map_x), np.diff(map_y)))))
+        slots = sorted((slot for slot in allocation.slots if ref in slot.chainage), key=lambda slot: slot.chainage[ref])
+        lines.append(FirmwareBundleLine(
+            ref,
+            LINE_COLOURS.get(ref, (255, 255, 255)),
+            2 * ref_index,
+            float(vertex_chainage[-1]),
+            to_fixed_point(map_x, signed=True),
+            to_fixed_point(map_y, signed=True),
+            to_fixed_point(vertex_chainage),
+            to_fixed_point([slot.chainage[ref] for slot in slots]),
+            np.array([slot.index for slot in slots], dtype=np.uint8),
+        ))
+
+    names = sorted({slot.name for slot in allocation.slots if slot.name})
+    if len(names) >= NO_NAME:
+        raise ValueError(f"{len(names)} station names do not fit the bundle's 8-bit name indices")
+    name_indices = {name: index for index, name in enumerate(names)}
+    led_names = [name_indices.get(slot.name, NO_NAME) for slot in allocation.slots]
+    return FirmwareBundle(origin, geo_affine, lines, led_names, names, fit_error_m)
+
+
+def encode_firmware_bundle(bundle):
+    """
+    Serialises the bundle little-endian: header, line records, the 16-bit
+    arrays, then the 8-bit arrays and NUL-terminated names, so every array
+    is aligned for its type, and a CRC-32 of all of it at the end.
+    """
+    offset = BUNDLE_HEADER.size + LINE_RECORD.size * len(bundle.lines)
+    wide = []
+    line_offsets = []
+    for line in bundle.lines:
+        arrays = (line.vertex_x, line.vertex_y, line.vertex_chainage, line.led_chainage)
+        offsets = []
+        for array in arrays:
+            offsets.append(offset)
+            wide.append(array.astype(array.dtype.newbyteorder("<")).tobytes())
+            offset += array.nbytes
+        line_offsets.append(offsets)
+
+    encoded_names = [name.encode("utf-8") + b"\0" for name in bundle.names]
+    name_offsets_offset = offset
+    name_starts = []
+    names_size = 0
+    for name in encoded_names:
+        name_starts.append(names_size)
+        names_size += len(name)
+    wide.append(np.array(name_starts, dtype="<u2").tobytes())
+    offset += 2 * len(encoded_names)
+
+    narrow = []
+    for line, offsets in zip(bundle.lines, line_offsets):
+        offsets.append(offset)
+        narrow.append(line.led_index.tobytes())
+        offset += line.led_index.nbytes
+    led_names_offset = offset
+    narrow.append(bytes(bundle.led_names))
+    offset += bundle.led_count
+    names_offset = offset
+    narrow.append(b"".join(encoded_names))
+    offset += names_size
+    if offset > 0xFFFF:
+        raise ValueError(f"A {offset} byte bundle does not fit its 16-bit offsets")
+
+    header = BUNDLE_HEADER.pack(
+        FIRMWARE_BUNDLE_MAGIC,
+        FIRMWARE_BUNDLE_VERSION,
+        len(bundle.lines),
+        round(DIRECTION_LEVELS[1] * 255),
+        bundle.led_count,
+        len(bundle.names),
+        led_names_offset,
+        name_offsets_offset,
+        names_offset,
+        FIXED_POINT_UNIT_M,
+        *bundle.origin,
+        *bundle.geo_affine,
+    )
+    records = b"".join(
+        LINE_RECORD.pack(
+            line.ref.encode("ascii"),
+            *line.colour,
+            line.frame_bit,
+            len(line.vertex_x),
+            len(line.led_index),
+            int(to_fixed_point([line.track_length_m])[0]),
+            *offsets,
+        )
+        for line, offsets in zip(bundle.lines, line_offsets)
+    )
+    data = header + records + b"".join(wide) + b"".join(narrow)
+    return data + BUNDLE_CHECKSUM.pack(zlib.crc32(data))
+
+
+def decode_firmware_bundle(data):
+    """Reads an encoded bundle back, as the firmware would; for checking a bundle against the board."""
+    body, (checksum,) = data[:-BUNDLE_CHECKSUM.size], BUNDLE_CHECKSUM.unpack(data[-BUNDLE_CHECKSUM.size:])
+    if zlib.crc32(body) != checksum:
+        raise ValueError("Firmware bundle checksum does not match")
+    (
+        magic, version, line_count, _, led_count, name_count,
+        led_names_offset, name_offsets_offset, names_offset, unit_m, *projection,
+    ) = BUNDLE_HEADER.unpack_from(body)
+    if magic != FIRMWARE_BUNDLE_MAGIC or version != FIRMWARE_BUNDLE_VERSION:
+        raise ValueError(f"Not a version {FIRMWARE_BUNDLE_VERSION} firmware bundle")
+
+    def array(dtype, offset, count):
+        return np.frombuffer(body, dtype=dtype, count=count, offset=offset)
+
+    lines = []
+    for line_index in range(line_count):
+        (
+            ref, red, green, blue, frame_bit, vertex_count, led_line_count, length,
+            x_offset, y_offset, vertex_chainage_offset, led_chainage_offset, led_index_offset,
+        ) = LINE_RECORD.unpack_from(body, BUNDLE_HEADER.size + line_index * LINE_RECORD.size)
+        lines.append(FirmwareBundleLine(
+            ref.rstrip(b"\0").decode("ascii"),
+            (red, green, blue),
+            frame_bit,
+            length * unit_m,
+            array("<i2", x_offset, vertex_count),
+            array("<i2", y_offset, vertex_count),
+            array("<u2", vertex_chainage_offset, vertex_count),
+            array("<u2", led_chainage_offset, led_line_count),
+            array(np.uint8, led_index_offset, led_line_count),
+        ))
+    name_offsets = array("<u2", name_offsets_offset, name_count)
+    names = [
+        body[names_offset + start:body.index(b"\0", names_offset + start)].decode("utf-8")
+        for start in name_offsets
+    ]
+    led_names = list(array(np.uint8, led_names_offset, led_count))
+    return FirmwareBundle((projection[0], projection[1]), tuple(projection[2:]), lines, led_names, names)
+
+
+def format_c_header(data, symbol="light_rail_bundle"):
+    """The encoded bundle as a C header, for compiling straight into the firmware image."""
+    guard = f"{symbol.upper()}_H"
+    rows = [
+        "    " + ", ".join(f"0x{byte:02x}" for byte in data[start:start + C_HEADER_BYTES_PER_ROW]) + ","
+        for start in range(0, len(data), C_HEADER_BYTES_PER_ROW)
+    ]
+    return "\n".join([
+        "// Generated by digest_tracks.py --firmware-bundle; do not edit.",
+        f"#ifndef {guard}",
+        f"#define {guard}",
+        "",
+        "#include <stdint.h>",
+        "",
+        f"#define {symbol.upper()}_VERSION {FIRMWARE_BUNDLE_VERSION}",
+        f"#define {symbol.upper()}_SIZE {len(data)}",
+        "",
+        f"static const uint8_t {symbol}[{symbol.upper()}_SIZE] __attribute__((aligned(4))) = {{",
+        *rows,
+        "};",
+        "",
+        f"#endif  // {guard}",
+        "",
+    ])
+
+
+def write_firmware_bundle(bundle, path=FIRMWARE_BUNDLE_PATH):
+    """Writes the encoded bundle, as a C header when path ends in .h and raw bytes otherwise."""
+    data = encode_firmware_bundle(bundle)
+    if str(path).endswith(".h"):
+        with open(path, "w") as file:
+            file.write(format_c_header(data))
+    else:
+        with open(path, "wb") as file:
+            file.write(data)
+    return len(data)
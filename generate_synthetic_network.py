@@ -0,0 +1,377 @@
+import argparse
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from digest_tracks import LIGHT_RAIL_SPECS, LightRailLineSpec
+from MapProjection import MapProjection
+
+MAP_ORIGIN_LON = 151.22289335
+MAP_ORIGIN_LAT = -33.8937485
+SYNTHETIC_OUTPUT_DIR = "synthetic"
+# Distance of each direction's track from the route centreline, as on a double-track line.
+TRACK_OFFSET_M = 3.0
+# Routes are placed well inside the extent so every vertex lands on the board.
+ROUTE_MARGIN_FRACTION = 0.1
+FIRST_NODE_ID = 9_000_000_000
+FIRST_WAY_ID = 2_000_000_000
+FIRST_RELATION_ID = 90_000_000
+
+
+@dataclass(frozen=True)
+class SyntheticNetworkSpec:
+    light_rail_routes: int = 2
+    train_routes: int = 9
+    vertices_per_route: int = 500
+    ways_per_route: int = 40
+    stops_per_route: int = 12
+    coastline_ways: int = 60
+    islands: int = 3
+    width_metres: float = 5000
+    height_metres: float = 8000
+    seed: int = 0
+
+
+class IdAllocator:
+    """Hands out OSM-style ids so repeated runs with one seed produce identical exports."""
+
+    def __init__(self):
+        self.next_ids = {"node": FIRST_NODE_ID, "way": FIRST_WAY_ID, "relation": FIRST_RELATION_ID}
+
+    def allocate(self, kind):
+        self.next_ids[kind] += 1
+        return self.next_ids[kind]
+
+
+def get_projection():
+    return MapProjection(origin_lon=MAP_ORIGIN_LON, origin_lat=MAP_ORIGIN_LAT)
+
+
+def generate_route_path(rng, spec, vertex_count):
+    """
+    A gently curving path across the extent. It is the graph of a sum of
+    sines in a rotated frame, so it never crosses itself and always
+    linemerges back into a single LineString.
+    """
+    half_width = spec.width_metres * (0.5 - ROUTE_MARGIN_FRACTION)
+    half_height = spec.height_metres * (0.5 - ROUTE_MARGIN_FRACTION)
+    heading = rng.uniform(0, np.pi)
+    length = rng.uniform(0.6, 1.0) * 2 * min(half_width, half_height)
+    centre = rng.uniform((-half_width + length / 2, -half_height + length / 2), (half_width - length / 2, half_height - length / 2))
+
+    along = np.linspace(-length / 2, length / 2, vertex_count)
+    wavelengths = rng.uniform(0.3, 1.5, size=3) * length
+    amplitudes = rng.uniform(0.01, 0.05, size=3) * length
+    phases = rng.uniform(0, 2 * np.pi, size=3)
+    across = (amplitudes * np.sin(2 * np.pi * along[:, None] / wavelengths + phases)).sum(axis=1)
+
+    cos, sin = np.cos(heading), np.sin(heading)
+    return centre[0] + along * cos - across * sin, centre[1] + along * sin + across * cos
+
+
+def offset_path(xs, ys, distance):
+    """Offsets a path sideways by distance, to the left of its direction of travel."""
+    dx = np.gradient(xs)
+    dy = np.gradient(ys)
+    lengths = np.hypot(dx, dy)
+    return xs - dy / lengths * distance, ys + dx / lengths * distance
+
+
+def split_into_ways(vertex_count, way_count):
+    """Index ranges of consecutive ways that share their end vertices, as OSM ways do."""
+    way_count = max(1, min(way_count, vertex_count - 1))
+    breaks = np.linspace(0, vertex_count - 1, way_count + 1).round().astype(int)
+    return list(zip(breaks[:-1], breaks[1:] + 1))
+
+
+def coordinate_list(longitudes, latitudes):
+    return np.round(np.column_stack((longitudes, latitudes)), 7).tolist()
+
+
+def route_tags(ref, mode, name, origin, destination, network):
+    return {
+        "from": origin,
+        "name": name,
+        "network": network,
+        "public_transport:version": "2",
+        "ref": ref,
+        "route": mode,
+        "to": destination,
+        "type": "route",
+    }
+
+
+def relation_membership(relation_id, role, tags):
+    return {"role": role, "rel": relation_id, "reltags": tags}
+
+
+def way_feature(way_id, coordinates, properties):
+    return {
+        "type": "Feature",
+        "properties": {"@id": f"way/{way_id}", **properties},
+        "geometry": {"type": "LineString", "coordinates": coordinates},
+        "id": f"way/{way_id}",
+    }
+
+
+def stop_feature(node_id, name, longitude, latitude, memberships):
+    return {
+        "type": "Feature",
+        "properties": {
+            "@id": f"node/{node_id}",
+            "name": name,
+            "public_transport": "stop_position",
+            "railway": "stop",
+            "@relations": memberships,
+        },
+        "geometry": {"type": "Point", "coordinates": [round(float(longitude), 7), round(float(latitude), 7)]},
+        "id": f"node/{node_id}",
+    }
+
+
+def feature_collection(features):
+    return {
+        "type": "FeatureCollection",
+        "generator": "generate_synthetic_network",
+        "copyright": "Synthetic data, not derived from OpenStreetMap.",
+        "features": features,
+    }
+
+
+def get_light_rail_specs(spec):
+    """The real line specs for the first routes, so digest_tracks runs unchanged on the output."""
+    specs = list(LIGHT_RAIL_SPECS[: spec.light_rail_routes])
+    for index in range(len(specs), spec.light_rail_routes):
+        ref = f"L{index + 2}"
+        specs.append(LightRailLineSpec(ref, f"{ref} North", f"{ref} South"))
+    return specs
+
+
+def get_train_refs(spec):
+    return [f"T{index + 1}" for index in range(spec.train_routes)]
+
+
+def build_direction_tracks(rng, spec, projection):
+    """Both directions of one route as (longitudes, latitudes), each offset to its own side."""
+    xs, ys = generate_route_path(rng, spec, spec.vertices_per_route)
+    track_a = projection.map_to_geo(*offset_path(xs, ys, TRACK_OFFSET_M))
+    reverse_x, reverse_y = xs[::-1], ys[::-1]
+    track_b = projection.map_to_geo(*offset_path(reverse_x, reverse_y, TRACK_OFFSET_M))
+    return track_a, track_b
+
+
+def build_stops(ids, ref, track, stop_count, memberships, reverse=False):
+    """
+    Evenly spaced stop positions along one direction's track. Stops are
+    numbered from the same end in both directions because digest_tracks
+    pairs the two platforms of a station by name.
+    """
+    longitudes, latitudes = track
+    indices = np.linspace(0, len(longitudes) - 1, max(stop_count, 2)).round().astype(int)
+    numbers = range(len(indices), 0, -1) if reverse else range(1, len(indices) + 1)
+    return [
+        stop_feature(ids.allocate("node"), f"{ref} Stop {number}", longitudes[index], latitudes[index], memberships)
+        for number, index in zip(numbers, indices)
+    ]
+
+
+def build_light_rail_export(spec, projection=None, ids=None):
+    """
+    Light rail exports carry one feature per way and per stop, each tagged
+    with the @relations of the route direction it belongs to.
+    """
+    projection = projection or get_projection()
+    ids = ids or IdAllocator()
+    rng = np.random.default_rng((spec.seed, 1))
+    features = []
+    for line_spec in get_light_rail_specs(spec):
+        track_a, track_b = build_direction_tracks(rng, spec, projection)
+        for origin, destination, track, reverse in (
+            (line_spec.destination_b, line_spec.destination_a, track_a, False),
+            (line_spec.destination_a, line_spec.destination_b, track_b, True),
+        ):
+            tags = route_tags(
+                line_spec.ref, "light_rail", f"{line_spec.ref} to {destination}", origin, destination, "Synthetic Light Rail"
+            )
+            relation_id = ids.allocate("relation")
+            longitudes, latitudes = track
+            for start, end in split_into_ways(len(longitudes), spec.ways_per_route):
+                features.append(way_feature(
+                    ids.allocate("way"),
+                    coordinate_list(longitudes[start:end], latitudes[start:end]),
+                    {"railway": "light_rail", "@relations": [relation_membership(relation_id, "", tags)]},
+                ))
+            features.extend(build_stops(
+                ids,
+                line_spec.ref,
+                track,
+                spec.stops_per_route,
+                [relation_membership(relation_id, "stop", tags)],
+                reverse=reverse,
+            ))
+    return feature_collection(features)
+
+
+def build_train_export(spec, projection=None, ids=None):
+    """
+    Train exports carry one relation feature per route direction, whose
+    geometry is the MultiLineString of its member ways, plus stop nodes
+    listing every relation that serves them.
+    """
+    projection = projection or get_projection()
+    ids = ids or IdAllocator()
+    rng = np.random.default_rng((spec.seed, 2))
+    features = []
+    for ref in get_train_refs(spec):
+        track_a, track_b = build_direction_tracks(rng, spec, projection)
+        memberships = []
+        for origin, destination, track in ((f"{ref} South", f"{ref} North", track_a), (f"{ref} North", f"{ref} South", track_b)):
+            relation_id = ids.allocate("relation")
+            tags = route_tags(ref, "train", f"{ref} to {destination}", origin, destination, "Synthetic Trains")
+            longitudes, latitudes = track
+            ways = [
+                coordinate_list(longitudes[start:end], latitudes[start:end])
+                for start, end in split_into_ways(len(longitudes), spec.ways_per_route)
+            ]
+            features.append({
+                "type": "Feature",
+                "properties": {"@id": f"relation/{relation_id}", **tags},
+                "geometry": {"type": "MultiLineString", "coordinates": ways},
+                "id": f"relation/{relation_id}",
+            })
+            memberships.append(relation_membership(relation_id, "stop", tags))
+        features.extend(build_stops(ids, ref, track_a, spec.stops_per_route, memberships))
+    return feature_collection(features)
+
+
+def generate_island(rng, centre, radius, vertex_count):
+    """A closed wobbly ring, counter-clockwise so the land is on the left as OSM requires."""
+    angles = np.linspace(0, 2 * np.pi, vertex_count, endpoint=False)
+    wobble = 1 + sum(
+        rng.uniform(0.02, 0.08) * np.sin(harmonic * angles + rng.uniform(0, 2 * np.pi)) for harmonic in (2, 3, 5)
+    )
+    xs = centre[0] + radius * wobble * np.cos(angles)
+    ys = centre[1] + radius * wobble * np.sin(angles)
+    return np.append(xs, xs[0]), np.append(ys, ys[0])
+
+
+def generate_mainland_coast(rng, spec, vertex_count):
+    """
+    A coast running west to east right across the extent, so land lies to
+    the north and the harbour to the south, like the real board.
+    """
+    half_width = spec.width_metres * 0.75
+    xs = np.linspace(-half_width, half_width, vertex_count)
+    ys = spec.height_metres * 0.1 + sum(
+        rng.uniform(100, 400) * np.sin(2 * np.pi * xs / rng.uniform(800, 3000) + rng.uniform(0, 2 * np.pi))
+        for _ in range(3)
+    )
+    return xs, ys
+
+
+def place_islands(rng, spec, coast_y_min):
+    """Islands in the water south of the coast, rejected if they would touch the coast or each other."""
+    islands = []
+    for _ in range(spec.islands * 20):
+        if len(islands) == spec.islands:
+            break
+        radius = rng.uniform(80, 300)
+        centre = rng.uniform(
+            (-spec.width_metres / 2 + radius, -spec.height_metres / 2 + radius),
+            (spec.width_metres / 2 - radius, coast_y_min - 2 * radius),
+        )
+        if all(np.hypot(*(centre - other)) > 1.5 * (radius + other_radius) for other, other_radius in islands):
+            islands.append((centre, radius))
+    return islands
+
+
+def build_coastline_export(spec, projection=None, ids=None):
+    """
+    Coastline exports are bare ways split from a handful of rings and one
+    mainland coast, with the OSM land-on-the-left orientation.
+    """
+    projection = projection or get_projection()
+    ids = ids or IdAllocator()
+    rng = np.random.default_rng((spec.seed, 3))
+    vertex_count = max(spec.vertices_per_route, 8)
+
+    coast_x, coast_y = generate_mainland_coast(rng, spec, vertex_count)
+    shores = [(coast_x, coast_y)]
+    for centre, radius in place_islands(rng, spec, coast_y.min()):
+        shores.append(generate_island(rng, centre, radius, max(vertex_count // 4, 8)))
+
+    ways_per_shore = max(1, spec.coastline_ways // len(shores))
+    features = []
+    for xs, ys in shores:
+        longitudes, latitudes = projection.map_to_geo(xs, ys)
+        for start, end in split_into_ways(len(longitudes), ways_per_shore):
+            features.append(way_feature(
+                ids.allocate("way"),
+                coordinate_list(longitudes[start:end], latitudes[start:end]),
+                {"natural": "coastline"},
+            ))
+    return feature_collection(features)
+
+
+def generate_network(spec):
+    """The three exports digest_tracks and digest_coastline_geojson read, keyed like the benchmark inputs."""
+    projection = get_projection()
+    ids = IdAllocator()
+    return {
+        "lightrail": build_light_rail_export(spec, projection, ids),
+        "trains": build_train_export(spec, projection, ids),
+        "coastline": build_coastline_export(spec, projection, ids),
+    }
+
+
+def count_vertices(data):
+    total = 0
+    for feature in data["features"]:
+        geometry = feature["geometry"]
+        if geometry["type"] == "LineString":
+            total += len(geometry["coordinates"])
+        elif geometry["type"] == "MultiLineString":
+            total += sum(len(coords) for coords in geometry["coordinates"])
+    return total
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Write synthetic overpass-style exports for scaling tests")
+    defaults = SyntheticNetworkSpec()
+    parser.add_argument("--light-rail-routes", type=int, default=defaults.light_rail_routes)
+    parser.add_argument("--train-routes", type=int, default=defaults.train_routes)
+    parser.add_argument("--vertices-per-route", type=int, default=defaults.vertices_per_route)
+    parser.add_argument("--ways-per-route", type=int, default=defaults.ways_per_route)
+    parser.add_argument("--stops-per-route", type=int, default=defaults.stops_per_route)
+    parser.add_argument("--coastline-ways", type=int, default=defaults.coastline_ways)
+    parser.add_argument("--islands", type=int, default=defaults.islands)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--output-dir", default=SYNTHETIC_OUTPUT_DIR, help="Directory the geojson files are written to")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    spec = SyntheticNetworkSpec(
+        light_rail_routes=args.light_rail_routes,
+        train_routes=args.train_routes,
+        vertices_per_route=args.vertices_per_route,
+        ways_per_route=args.ways_per_route,
+        stops_per_route=args.stops_per_route,
+        coastline_ways=args.coastline_ways,
+        islands=args.islands,
+        seed=args.seed,
+    )
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for name, data in generate_network(spec).items():
+        path = output_dir / f"{name}.geojson"
+        with open(path, "w") as file:
+            json.dump(data, file)
+        print(f"Wrote {path}: {len(data['features'])} features, {count_vertices(data)} vertices")
+
+
+if __name__ == "__main__":
+    main()
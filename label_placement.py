@@ -0,0 +1,263 @@
+from dataclasses import dataclass
+
+import numpy as np
+import shapely
+
+# Average advance of a bold Roboto Slab glyph relative to the font size.
+LABEL_CHAR_WIDTH_EM = 0.68
+# Height of one text line relative to the font size, including KiCad's interline gap at 0.8 spacing.
+LABEL_LINE_HEIGHT_EM = 1.3
+# Candidate label directions relative to the preferred one, with the cost (mm^2) of choosing them.
+CANDIDATE_ROTATIONS = ((0.0, 0.0), (180.0, 0.5), (35.0, 1.0), (-35.0, 1.0), (215.0, 1.5), (145.0, 1.5))
+# Extra leader length tried when every close position collides, and what it costs.
+CANDIDATE_EXTRA_OFFSETS = ((0.0, 0.0), (1.5, 1.0))
+MAX_IMPROVEMENT_PASSES = 5
+
+
+@dataclass
+class LabelPlacement:
+    label_angle: np.ndarray
+    offset_mm: np.ndarray
+    overlap_mm2: np.ndarray
+
+
+def format_station_name(name, wrap_at=14):
+    if len(name) <= wrap_at or " " not in name:
+        return name
+
+    words = name.split()
+    best_text = name
+    best_score = len(name)
+    for idx in range(1, len(words)):
+        line1 = " ".join(words[:idx])
+        line2 = " ".join(words[idx:])
+        score = max(len(line1), len(line2))
+        if score < best_score:
+            best_text = f"{line1}\n{line2}"
+            best_score = score
+    return best_text
+
+
+def estimate_label_size(text, size_mm):
+    lines = text.split("\n")
+    width = max(len(line) for line in lines) * size_mm * LABEL_CHAR_WIDTH_EM
+    height = len(lines) * size_mm * LABEL_LINE_HEIGHT_EM
+    return width, height
+
+
+def label_alignment(label_angle, anchor_x, station_x):
+    """Returns (horizontal, vertical) alignment as 'left'/'center'/'right' and 'top'/'center'/'bottom'."""
+    if 80 < label_angle < 100:
+        return "center", "bottom"
+    if 260 < label_angle < 280:
+        return "center", "top"
+    return ("left" if anchor_x >= station_x else "right"), "center"
+
+
+def preferred_label_angle(orientation):
+    """Perpendicular to the track, on whichever side reads left-to-right."""
+    label_angle = (orientation + 90) % 360
+    return np.where((90 < label_angle) & (label_angle < 270), (orientation - 90) % 360, label_angle)
+
+
+def label_offset(label_angle, offset_mm):
+    steep = ((60 < label_angle) & (label_angle < 120)) | ((240 < label_angle) & (label_angle < 300))
+    return offset_mm + np.where(steep, 0.5, 0.0)
+
+
+def label_anchor(centre, label_angle, offset_mm):
+    direction = np.column_stack((np.cos(np.radians(label_angle)), -np.sin(np.radians(label_angle))))
+    return np.round(centre + np.asarray(offset_mm)[:, None] * direction, 10)
+
+
+def label_bounds(anchors, label_angles, centres, sizes):
+    """Axis-aligned (min_x, min_y, max_x, max_y) of each label, from its anchor and alignment."""
+    bounds = np.zeros((len(anchors), 4))
+    for idx, ((anchor_x, anchor_y), label_angle, (centre_x, _), (width, height)) in enumerate(
+        zip(anchors.tolist(), label_angles.tolist(), centres.tolist(), sizes)
+    ):
+        horizontal, vertical = label_alignment(label_angle, anchor_x, centre_x)
+        min_x = {"left": anchor_x, "right": anchor_x - width, "center": anchor_x - width / 2}[horizontal]
+        min_y = {"top": anchor_y, "bottom": anchor_y - height, "center": anchor_y - height / 2}[vertical]
+        bounds[idx] = (min_x, min_y, min_x + width, min_y + height)
+    return bounds
+
+
+def box_overlap_area(bounds_a, bounds_b):
+    overlap_x = np.minimum(bounds_a[:, 2], bounds_b[:, 2]) - np.maximum(bounds_a[:, 0], bounds_b[:, 0])
+    overlap_y = np.minimum(bounds_a[:, 3], bounds_b[:, 3]) - np.maximum(bounds_a[:, 1], bounds_b[:, 1])
+    return np.clip(overlap_x, 0, None) * np.clip(overlap_y, 0, None)
+
+
+def clipped_segment_length(bounds, segments):
+    """Liang-Barsky: length of each segment (x0, y0, x1, y1) inside the matching box."""
+    x0, y0, x1, y1 = segments.T
+    dx = x1 - x0
+    dy = y1 - y0
+    t_min = np.zeros(len(segments))
+    t_max = np.ones(len(segments))
+    for delta, start, low, high in ((dx, x0, bounds[:, 0], bounds[:, 2]), (dy, y0, bounds[:, 1], bounds[:, 3])):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t_low = (low - start) / delta
+            t_high = (high - start) / delta
+        parallel = delta == 0
+        outside = parallel & ((start < low) | (start > high))
+        t_enter = np.where(parallel, 0.0, np.minimum(t_low, t_high))
+        t_exit = np.where(parallel, 1.0, np.maximum(t_low, t_high))
+        t_min = np.maximum(t_min, t_enter)
+        t_max = np.where(outside, t_min, np.minimum(t_max, t_exit))
+    return np.clip(t_max - t_min, 0, None) * np.hypot(dx, dy)
+
+
+@dataclass
+class LabelObstacles:
+    tree: shapely.STRtree
+    segments: np.ndarray
+    segment_widths: np.ndarray
+    led_outlines: np.ndarray
+
+
+def build_obstacle_tree(track_lines, track_widths, led_outlines):
+    """
+    Indexes tracks as single segments, so the R-tree prunes well, followed by
+    the LED outlines. Tree indices below len(segments) are segments.
+    """
+    segments = []
+    segment_widths = []
+    for line, width in zip(track_lines, track_widths):
+        coords = shapely.get_coordinates(line)
+        if len(coords) < 2:
+            continue
+        segments.append(np.hstack((coords[:-1], coords[1:])))
+        segment_widths.append(np.full(len(coords) - 1, width))
+    segments = np.vstack(segments) if segments else np.zeros((0, 4))
+    segment_widths = np.concatenate(segment_widths) if segment_widths else np.zeros(0)
+    led_outlines = shapely.polygons(np.asarray(led_outlines).reshape(-1, 4, 2))
+    geometries = np.concatenate((shapely.linestrings(segments.reshape(-1, 2, 2)), led_outlines))
+    return LabelObstacles(shapely.STRtree(geometries), segments, segment_widths, led_outlines)
+
+
+def obstacle_overlap(candidate_bounds, obstacles, bounds):
+    """Area of each candidate box covered by obstacles, plus any area hanging off the board."""
+    cost = np.zeros(len(candidate_bounds))
+    candidate_boxes = shapely.box(*candidate_bounds.T)
+    box_index, obstacle_index = obstacles.tree.query(candidate_boxes, predicate="intersects")
+
+    # Tracks cover their clipped length times their drawn width.
+    is_segment = obstacle_index < len(obstacles.segments)
+    segment_box, segment_index = box_index[is_segment], obstacle_index[is_segment]
+    covered = clipped_segment_length(candidate_bounds[segment_box], obstacles.segments[segment_index])
+    np.add.at(cost, segment_box, covered * obstacles.segment_widths[segment_index])
+
+    led_box = box_index[~is_segment]
+    led_index = obstacle_index[~is_segment] - len(obstacles.segments)
+    if len(led_box):
+        covered = shapely.area(shapely.intersection(candidate_boxes[led_box], obstacles.led_outlines[led_index]))
+        np.add.at(cost, led_box, covered)
+
+    if bounds is not None:
+        board_bounds = np.broadcast_to(np.asarray(bounds, dtype=float), candidate_bounds.shape)
+        box_area = (candidate_bounds[:, 2] - candidate_bounds[:, 0]) * (candidate_bounds[:, 3] - candidate_bounds[:, 1])
+        cost += box_area - box_overlap_area(candidate_bounds, board_bounds)
+    return cost
+
+
+def place_labels(
+    names,
+    centres,
+    orientations,
+    track_lines,
+    track_widths,
+    led_outlines,
+    size_mm=2.5,
+    offset_mm=4.0,
+    bounds=None,
+):
+    """
+    Chooses a direction and leader length for every named station's label.
+
+    Every label gets the same set of candidate positions around its station.
+    Candidates are scored against tracks and LEDs through one R-tree query,
+    and against each other through a second R-tree over all candidates. Each
+    label starts at its cheapest collision-free choice and labels are then
+    moved one at a time to their cheapest position given everyone else's
+    until nothing changes.
+    """
+    centres = np.asarray(centres, dtype=float)
+    preferred = preferred_label_angle(np.asarray(orientations, dtype=float))
+    labelled = np.array([bool(name) for name in names])
+    label_indices = np.flatnonzero(labelled)
+
+    label_angle = preferred.copy()
+    chosen_offset = label_offset(preferred, offset_mm)
+    overlap = np.zeros(len(names))
+    if len(label_indices) == 0:
+        return LabelPlacement(label_angle, chosen_offset, overlap)
+
+    sizes = [estimate_label_size(format_station_name(names[idx]), size_mm) for idx in label_indices]
+    candidates = [
+        (rotation, extra_offset, rotation_cost + offset_cost)
+        for rotation, rotation_cost in CANDIDATE_ROTATIONS
+        for extra_offset, offset_cost in CANDIDATE_EXTRA_OFFSETS
+    ]
+    candidate_count = len(candidates)
+
+    # Candidate arrays are laid out label-major: row label * candidate_count + candidate.
+    rotations = np.array([candidate[0] for candidate in candidates])
+    extra_offsets = np.array([candidate[1] for candidate in candidates])
+    preference_cost = np.tile([candidate[2] for candidate in candidates], len(label_indices))
+    angles = ((preferred[label_indices][:, None] + rotations) % 360).ravel()
+    offsets = label_offset(angles, offset_mm) + np.tile(extra_offsets, len(label_indices))
+    owner = np.repeat(np.arange(len(label_indices)), candidate_count)
+    candidate_centres = centres[label_indices][owner]
+    anchors = label_anchor(candidate_centres, angles, offsets)
+    candidate_bounds = label_bounds(anchors, angles, candidate_centres, [sizes[label] for label in owner])
+
+    obstacles = build_obstacle_tree(track_lines, track_widths, led_outlines)
+    static_cost = obstacle_overlap(candidate_bounds, obstacles, bounds) + preference_cost
+
+    candidate_tree = shapely.STRtree(shapely.box(*candidate_bounds.T))
+    left, right = candidate_tree.query(candidate_tree.geometries, predicate="intersects")
+    different_label = owner[left] != owner[right]
+    left, right = left[different_label], right[different_label]
+    pair_overlap = box_overlap_area(candidate_bounds[left], candidate_bounds[right])
+    # Conflicts sorted by candidate so each label's pairs are one contiguous slice.
+    order = np.argsort(left, kind="stable")
+    left, right, pair_overlap = left[order], right[order], pair_overlap[order]
+    label_pair_start = np.searchsorted(left, np.arange(len(label_indices) + 1) * candidate_count)
+
+    static_cost = static_cost.reshape(len(label_indices), candidate_count)
+    choice = static_cost.argmin(axis=1)
+    is_chosen = np.zeros(len(candidate_bounds), dtype=bool)
+    is_chosen[np.arange(len(label_indices)) * candidate_count + choice] = True
+
+    def candidate_costs(label):
+        pairs = slice(label_pair_start[label], label_pair_start[label + 1])
+        conflict_cost = np.bincount(
+            left[pairs] - label * candidate_count,
+            weights=pair_overlap[pairs] * is_chosen[right[pairs]],
+            minlength=candidate_count,
+        )
+        return static_cost[label] + conflict_cost
+
+    for _ in range(MAX_IMPROVEMENT_PASSES):
+        changed = False
+        for label in range(len(label_indices)):
+            costs = candidate_costs(label)
+            best = int(np.argmin(costs))
+            if costs[best] < costs[choice[label]] - 1e-9:
+                is_chosen[label * candidate_count + choice[label]] = False
+                is_chosen[label * candidate_count + best] = True
+                choice[label] = best
+                changed = True
+        if not changed:
+            break
+
+    chosen_rows = np.arange(len(label_indices)) * candidate_count + choice
+    label_angle[label_indices] = angles[chosen_rows]
+    chosen_offset[label_indices] = offsets[chosen_rows]
+    overlap[label_indices] = [
+        candidate_costs(label)[choice[label]] - preference_cost[row]
+        for label, row in enumerate(chosen_rows.tolist())
+    ]
+    return LabelPlacement(label_angle, chosen_offset, overlap)
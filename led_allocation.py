@@ -0,0 +1,156 @@
+import json
+from dataclasses import dataclass, field
+
+import numpy as np
+import shapely
+
+# Stations of different lines closer than this share one LED. Pseudo stations sit 75 m
+# apart, so half that plus a little catches every pair on a shared corridor while
+# staying under the ~2 mm (50 m at 1:25000) an LED footprint covers on the board.
+LED_MERGE_DISTANCE_M = 40.0
+# An LED also lights for any line whose track passes within this of it.
+LED_SERVICE_DISTANCE_M = 15.0
+LED_ALLOCATION_PATH = "led_allocation.json"
+
+
+@dataclass
+class LedSlot:
+    """
+    One physical LED. station is the one it is placed for; chainage maps
+    every line the LED lights for to its position along that line's track.
+    """
+    index: int
+    station: object
+    chainage: dict[str, float] = field(default_factory=dict)
+
+    @property
+    def name(self):
+        return self.station.name
+
+    @property
+    def refs(self):
+        return tuple(self.chainage)
+
+    @property
+    def is_shared(self):
+        return len(self.chainage) > 1
+
+
+@dataclass
+class LedAllocation:
+    slots: list[LedSlot]
+    station_count: int
+
+    @property
+    def stations(self):
+        return [slot.station for slot in self.slots]
+
+    @property
+    def shared_count(self):
+        return sum(slot.is_shared for slot in self.slots)
+
+    def describe(self):
+        return (
+            f"{len(self.slots)} LEDs for {self.station_count} stations "
+            f"({self.station_count - len(self.slots)} merged, {self.shared_count} shared between lines)"
+        )
+
+
+def group_stations_by_ref(stations):
+    stations_by_ref = {}
+    for station in stations:
+        stations_by_ref.setdefault(station.track.name, []).append(station)
+    return stations_by_ref
+
+
+def match_stations_to_slots(stations, slots, merge_distance_m):
+    """
+    Pairs each station with the nearest existing slot of the same name within
+    merge_distance_m, closest pairs first and at most one station per slot.
+    Returns {station index: slot}.
+    """
+    if not slots:
+        return {}
+    slot_points = shapely.points([(slot.station.map_x, slot.station.map_y) for slot in slots])
+    points = shapely.points([(station.map_x, station.map_y) for station in stations])
+    (station_indices, slot_indices), distances = shapely.STRtree(slot_points).query_nearest(
+        points, max_distance=merge_distance_m, return_distance=True, all_matches=False
+    )
+    matches = {}
+    used_slots = set()
+    for order in np.argsort(distances, kind="stable"):
+        station_index = int(station_indices[order])
+        slot_index = int(slot_indices[order])
+        if slot_index in used_slots or stations[station_index].name != slots[slot_index].name:
+            continue
+        matches[station_index] = slots[slot_index]
+        used_slots.add(slot_index)
+    return matches
+
+
+def allocate_leds(
+    stations,
+    merge_distance_m=LED_MERGE_DISTANCE_M,
+    service_distance_m=LED_SERVICE_DISTANCE_M,
+):
+    """
+    Assigns one LED per physical position. Lines are taken in the order
+    their stations first appear; a station joins an earlier line's LED when
+    one of the same name lies within merge_distance_m, otherwise it gets its
+    own. Every LED then lights for each line whose track passes within
+    service_distance_m, which covers shared corridors the digest has
+    already thinned to one line's stations.
+    """
+    stations_by_ref = group_stations_by_ref(stations)
+    slots = []
+    for ref, ref_stations in stations_by_ref.items():
+        matches = match_stations_to_slots(ref_stations, slots, merge_distance_m)
+        for station_index, station in enumerate(ref_stations):
+            if station_index not in matches:
+                slots.append(LedSlot(len(slots), station))
+
+    if slots:
+        points = shapely.points([(slot.station.map_x, slot.station.map_y) for slot in slots])
+        for ref, ref_stations in stations_by_ref.items():
+            line = ref_stations[0].track.line_cartesian
+            distances = shapely.distance(points, line)
+            chainages = shapely.line_locate_point(line, points)
+            for slot, distance, chainage in zip(slots, distances, chainages):
+                if distance <= service_distance_m:
+                    slot.chainage[ref] = float(chainage)
+        for slot in slots:
+            slot.chainage.setdefault(slot.station.track.name, slot.station.chainage)
+    return LedAllocation(slots, len(stations))
+
+
+def multiplexed_ref(slot_refs, active_refs, frame_index):
+    """
+    The line an LED shows in a given frame: it cycles through the lines
+    currently active at it, one per frame, so a shared LED alternates colours.
+    """
+    showing = [ref for ref in slot_refs if ref in active_refs]
+    if not showing:
+        return None
+    return showing[frame_index % len(showing)]
+
+
+def write_led_allocation(allocation, references, path=LED_ALLOCATION_PATH):
+    """Writes the LED map the live display runs from, in chain order, one entry per LED."""
+    entries = [
+        {
+            "index": slot.index,
+            "reference": reference,
+            "name": slot.name,
+            "pcb_x": float(slot.station.pcb_x),
+            "pcb_y": float(slot.station.pcb_y),
+            "chainage": slot.chainage,
+        }
+        for slot, reference in zip(allocation.slots, references)
+    ]
+    with open(path, "w") as file:
+        json.dump({"station_count": allocation.station_count, "leds": entries}, file, indent=1)
+
+
+def load_led_allocation(path=LED_ALLOCATION_PATH):
+    with open(path) as file:
+        return json.load(file)["leds"]
@@ -0,0 +1,131 @@
+import numpy as np
+
+# The board's LEDs are WS2812B (XL-1615RGBC-WS2812B-S): 24 bits per LED, green first.
+WIRE_CHANNEL_ORDER = (1, 0, 2)
+DEFAULT_GAMMA = 2.2
+# Over SPI at 2.4 MHz each data bit becomes three SPI bits, 0 -> 100 and 1 -> 110,
+# giving 0.42/0.83 us highs within the WS2812B's +-0.15 us timing.
+SPI_CLOCK_HZ = 2_400_000
+SPI_BITS_PER_DATA_BIT = 3
+# The -S variant latches after 280 us of low, 84 bytes at 2.4 MHz; a little extra for margin.
+SPI_RESET_BYTES = 96
+# TfNSW line colours; outbound trams (direction 1) show dimmed so both directions read apart.
+LINE_COLOURS = {
+    "L1": (190, 22, 34),
+    "L2": (221, 30, 37),
+    "L3": (120, 17, 64),
+}
+DIRECTION_LEVELS = (1.0, 0.35)
+
+
+def build_spi_table():
+    """The three SPI bytes encoding each data byte, most significant bit first."""
+    table = np.zeros((256, 3), dtype=np.uint8)
+    for value in range(256):
+        pattern = 0
+        for bit in range(7, -1, -1):
+            pattern = pattern << 3 | (0b110 if value >> bit & 1 else 0b100)
+        table[value] = ((pattern >> 16) & 0xFF, (pattern >> 8) & 0xFF, pattern & 0xFF)
+    return table
+
+
+SPI_TABLE = build_spi_table()
+
+
+def build_palette(refs, bits_per_ref=2):
+    """
+    Colours for live_map frame bits: row 2 * ref index + direction is that
+    bit's colour, and the extra last row is black for LEDs with no bits set.
+    One row per bit, so it stays small however many refs the map tracks.
+    """
+    bit_colours = [
+        tuple(round(channel * level) for channel in LINE_COLOURS.get(ref, (255, 255, 255)))
+        for ref in refs
+        for level in DIRECTION_LEVELS[:bits_per_ref]
+    ]
+    return np.array([*bit_colours, (0, 0, 0)], dtype=np.uint8).reshape(-1, 3)
+
+
+class FrameBuffer:
+    """
+    Colours for an LED chain in chain order (D100 first, as create_board
+    assigns them), stored in wire channel order, plus the preallocated
+    buffers they are encoded into. Brightness and gamma share one lookup
+    table, so encoding a frame is two np.take calls into existing arrays and
+    allocates nothing.
+    """
+
+    def __init__(self, led_count, brightness=1.0, gamma=DEFAULT_GAMMA):
+        self.led_count = led_count
+        self.colours = np.zeros((led_count, 3), dtype=np.uint8)
+        self.wire = np.zeros(led_count * 3, dtype=np.uint8)
+        self.spi = np.zeros(led_count * 3 * SPI_BITS_PER_DATA_BIT + SPI_RESET_BYTES, dtype=np.uint8)
+        self._spi_body = self.spi[:led_count * 3 * SPI_BITS_PER_DATA_BIT].reshape(led_count * 3, SPI_BITS_PER_DATA_BIT)
+        self._palette_index = np.zeros(led_count, dtype=np.intp)
+        self._bit_counts = np.zeros(led_count, dtype=np.intp)
+        self._phases = np.zeros(led_count, dtype=np.intp)
+        self._bits_seen = np.zeros(led_count, dtype=np.intp)
+        self._chosen = np.zeros(led_count, dtype=bool)
+        self.gamma = gamma
+        self.set_brightness(brightness)
+        self.set_palette(build_palette(()))
+
+    def set_brightness(self, brightness):
+        """brightness from 0 to 1, applied before gamma so equal steps look equally bright."""
+        self.brightness = min(max(brightness, 0.0), 1.0)
+        levels = (np.arange(256) / 255.0 * self.brightness) ** self.gamma * 255.0
+        self.lut = np.rint(levels).astype(np.uint8)
+
+    def set_palette(self, palette):
+        """Takes a build_palette result for render; stored in wire order so render need not reorder."""
+        self.palette = np.ascontiguousarray(palette[:, WIRE_CHANNEL_ORDER])
+        self.bit_count = len(palette) - 1
+        self._bit_planes = np.zeros((self.bit_count, self.led_count), dtype=np.intp)
+
+    def set_rgb(self, indices, rgb):
+        """Sets LEDs from (n, 3) RGB colours."""
+        self.colours[indices] = np.asarray(rgb, dtype=np.uint8)[..., WIRE_CHANNEL_ORDER]
+
+    def render(self, masks, frame_index):
+        """
+        Colours every LED from a live_map frame of per-LED bit masks, in
+        place. An LED with several bits set shows each of their colours in
+        turn, one per frame: it takes the colour of its (frame_index %
+        popcount)-th set bit. That costs a few array passes per bit, where a
+        lookup over every mask and phase would grow as 2**bits * lcm(1..bits).
+        """
+        planes, counts, phases, seen, chosen = (
+            self._bit_planes, self._bit_counts, self._phases, self._bits_seen, self._chosen
+        )
+        counts.fill(0)
+        for bit, plane in enumerate(planes):
+            np.right_shift(masks, bit, out=plane, casting="unsafe")
+            np.bitwise_and(plane, 1, out=plane)
+            counts += plane
+        np.maximum(counts, 1, out=phases)
+        np.remainder(frame_index, phases, out=phases)
+
+        # Unlit LEDs keep the black row past the bit colours.
+        self._palette_index.fill(self.bit_count)
+        seen.fill(0)
+        for bit, plane in enumerate(planes):
+            np.equal(seen, phases, out=chosen)
+            np.logical_and(chosen, plane, out=chosen)
+            np.copyto(self._palette_index, bit, where=chosen)
+            seen += plane
+        np.take(self.palette, self._palette_index, axis=0, out=self.colours)
+
+    def encode(self):
+        """Gamma-corrected, brightness-scaled GRB bytes, for a driver that clocks them out itself."""
+        np.take(self.lut, self.colours.reshape(-1), out=self.wire)
+        return self.wire
+
+    def encode_spi(self):
+        """The wire bytes as an SPI bit stream ending in the reset latch, ready for one SPI write."""
+        np.take(SPI_TABLE, self.encode(), axis=0, out=self._spi_body)
+        return self.spi
+
+    @property
+    def spi_seconds(self):
+        """How long the chain takes to clock in one frame over SPI, reset included."""
+        return len(self.spi) * 8 / SPI_CLOCK_HZ
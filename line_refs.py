@@ -0,0 +1,7 @@
+# The lines drawn on the board. This module imports nothing, so the live runtime can
+# share these with the digest pipeline without loading shapely and the geometry code.
+LIGHT_RAIL_REFS = ("L2", "L3")
+# The train lines drawn on the board, in the order every consumer draws and tracks them.
+TRAIN_REFS = ("T1", "T2", "T3", "T4", "T8", "T9")
+# Every line on the board, whose vehicles the live map tracks.
+MAP_ROUTE_REFS = (*LIGHT_RAIL_REFS, *TRAIN_REFS)
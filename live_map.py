@@ -0,0 +1,105 @@
+import pickle
+from pathlib import Path
+
+import numpy as np
+
+from feed_decoder import VehiclePositionDecoder
+from led_allocation import LED_ALLOCATION_PATH, allocate_leds, load_led_allocation
+from line_refs import LIGHT_RAIL_REFS
+
+# The lines whose vehicles the map shows moving, one LED per position.
+LIVE_MAP_REFS = LIGHT_RAIL_REFS
+# Vehicles further than this from their line's track are ignored (depots, bad fixes).
+SNAP_MAX_DISTANCE_M = 50.0
+# A vehicle lights the nearest LED on its line if that LED is within this along the track.
+LED_MAX_CHAINAGE_GAP_M = 100.0
+
+
+def load_track(ref):
+    with open(f"{ref}_track_geometry.pckl", "rb") as file:
+        return pickle.load(file)
+
+
+def load_led_chainages(refs, allocation_path=LED_ALLOCATION_PATH):
+    """
+    The chainage of every LED on each line, from the allocation create_board
+    wrote; before a board exists, from allocating the digested stations the
+    same way create_board does.
+    """
+    if Path(allocation_path).exists():
+        return [entry["chainage"] for entry in load_led_allocation(allocation_path)]
+    stations = []
+    for ref in refs:
+        with open(f"{ref}_stations_geometry.pckl", "rb") as file:
+            stations.extend(pickle.load(file))
+    return [slot.chainage for slot in allocate_leds(stations).slots]
+
+
+class LiveMap:
+    """
+    The runtime ingestion path: a feed message in, an LED frame out. Each
+    frame holds one uint16 per LED in chain order with bit 2 * ref index +
+    direction set for every vehicle that LED shows.
+    """
+
+    def __init__(self, tracks, led_chainages, max_snap_distance_m=SNAP_MAX_DISTANCE_M):
+        self.refs = tuple(tracks)
+        self.tracks = tracks
+        self.max_snap_distance_m = max_snap_distance_m
+        self.decoder = VehiclePositionDecoder(self.refs)
+        self.frame = np.zeros(len(led_chainages), dtype=np.uint16)
+        # Per ref, its LEDs sorted by chainage, so a vehicle finds its LED by bisection.
+        self.led_lookup = {}
+        for ref in self.refs:
+            indices = np.array([index for index, chainage in enumerate(led_chainages) if ref in chainage], dtype=np.int64)
+            chainages = np.array([led_chainages[index][ref] for index in indices], dtype=float)
+            order = np.argsort(chainages)
+            self.led_lookup[ref] = (chainages[order], indices[order])
+
+    @classmethod
+    def from_digest(cls, refs=LIVE_MAP_REFS, allocation_path=LED_ALLOCATION_PATH):
+        return cls({ref: load_track(ref) for ref in refs}, load_led_chainages(refs, allocation_path))
+
+    def snap(self, vehicles):
+        """Chainage of each vehicle along its line's track, NaN where it is off the track."""
+        import shapely
+
+        chainage = np.full(len(vehicles), np.nan)
+        for ref_index, ref in enumerate(self.refs):
+            on_ref = np.flatnonzero(vehicles["ref"] == ref_index)
+            if len(on_ref) == 0:
+                continue
+            track = self.tracks[ref]
+            map_x, map_y = track.projection.geo_to_map(
+                vehicles["longitude"][on_ref].astype(float), vehicles["latitude"][on_ref].astype(float)
+            )
+            points = shapely.points(map_x, map_y)
+            near = shapely.distance(points, track.line_cartesian) <= self.max_snap_distance_m
+            chainage[on_ref[near]] = shapely.line_locate_point(track.line_cartesian, points[near])
+        return chainage
+
+    def build_frame(self, vehicles, chainage):
+        """Fills self.frame in place from the snapped vehicles and returns it."""
+        frame = self.frame
+        frame[:] = 0
+        for ref_index, ref in enumerate(self.refs):
+            led_chainages, led_indices = self.led_lookup[ref]
+            on_ref = (vehicles["ref"] == ref_index) & ~np.isnan(chainage)
+            if len(led_chainages) == 0 or not on_ref.any():
+                continue
+            vehicle_chainage = chainage[on_ref]
+            after = np.clip(np.searchsorted(led_chainages, vehicle_chainage), 1, len(led_chainages) - 1)
+            before = after - 1
+            nearest = np.where(
+                vehicle_chainage - led_chainages[before] <= led_chainages[after] - vehicle_chainage, before, after
+            )
+            if len(led_chainages) == 1:
+                nearest[:] = 0
+            close = np.abs(led_chainages[nearest] - vehicle_chainage) <= LED_MAX_CHAINAGE_GAP_M
+            bits = (1 << (2 * ref_index + np.maximum(vehicles["direction"][on_ref], 0))).astype(np.uint16)
+            np.bitwise_or.at(frame, led_indices[nearest[close]], bits[close])
+        return frame
+
+    def ingest(self, data):
+        _, vehicles = self.decoder.decode(data)
+        return self.build_frame(vehicles, self.snap(vehicles))
@@ -0,0 +1,106 @@
+import pickle
+from dataclasses import dataclass
+
+import numpy as np
+
+# Levels of detail, finest first, with their Douglas-Peucker tolerance in map metres.
+# "pcb" takes the digest's --simplify-tolerance-mm; the others suit a small
+# status display (a few metres per pixel) and a zoomed-out web preview.
+LOD_PREVIEW_TOLERANCE_M = 5.0
+LOD_DISPLAY_TOLERANCE_M = 20.0
+LOD_LEVEL_NAMES = ("full", "pcb", "preview", "display")
+LOD_OUTPUT_PATH = "{ref}_lod_{level}.pckl"
+
+
+@dataclass(frozen=True)
+class TrackLevel:
+    """
+    One polyline at one level of detail. vertex_indices point into the
+    full-resolution vertices and chainage is measured along the
+    full-resolution line, so both agree across every level.
+    """
+    name: str
+    level: str
+    tolerance_m: float
+    vertex_indices: np.ndarray
+    map_x: np.ndarray
+    map_y: np.ndarray
+    chainage: np.ndarray
+
+
+def get_level_tolerances(pcb_tolerance_m):
+    return {
+        "full": 0.0,
+        "pcb": pcb_tolerance_m,
+        "preview": LOD_PREVIEW_TOLERANCE_M,
+        "display": LOD_DISPLAY_TOLERANCE_M,
+    }
+
+
+def cumulative_chainage(xs, ys):
+    return np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(xs), np.diff(ys)))))
+
+
+def subsequence_indices(xs, ys, kept_xs, kept_ys):
+    """
+    Indices of the kept vertices within the original ones. Douglas-Peucker
+    only ever drops vertices, so the kept ones appear in order; walking
+    forward keeps repeated coordinates (a line passing a point twice) apart.
+    """
+    indices = np.empty(len(kept_xs), dtype=np.int64)
+    position = 0
+    for kept_index, (x, y) in enumerate(zip(kept_xs, kept_ys)):
+        while xs[position] != x or ys[position] != y:
+            position += 1
+        indices[kept_index] = position
+        position += 1
+    return indices
+
+
+def build_lod_pyramid(named_lines, level_tolerances, scale):
+    """
+    Simplifies several polylines together at each tolerance in turn, each
+    level from the one before it so coarser levels keep a subset of the
+    finer levels' vertices. Returns {level: [TrackLevel per line]}.
+    """
+    from simplify_geometry import simplify_lines
+
+    names = [name for name, _ in named_lines]
+    full = [(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)) for _, (xs, ys) in named_lines]
+    chainages = [cumulative_chainage(xs, ys) for xs, ys in full]
+    current_indices = [np.arange(len(xs)) for xs, _ in full]
+
+    pyramid = {}
+    previous_tolerance = 0.0
+    for level, tolerance_m in sorted(level_tolerances.items(), key=lambda item: item[1]):
+        if tolerance_m > previous_tolerance:
+            current_lines = [(name, (xs[indices], ys[indices])) for name, (xs, ys), indices in zip(names, full, current_indices)]
+            simplified_lines, _ = simplify_lines(current_lines, tolerance_m, scale)
+            current_indices = [
+                indices[subsequence_indices(xs[indices], ys[indices], kept_xs, kept_ys)]
+                for (xs, ys), indices, (kept_xs, kept_ys) in zip(full, current_indices, simplified_lines)
+            ]
+            previous_tolerance = tolerance_m
+        pyramid[level] = [
+            TrackLevel(name, level, tolerance_m, indices, xs[indices], ys[indices], chainage[indices])
+            for name, (xs, ys), chainage, indices in zip(names, full, chainages, current_indices)
+        ]
+    return pyramid
+
+
+def write_lod_pyramid(ref, pyramid):
+    """Writes one file per level so consumers only load the detail they need."""
+    output_paths = {}
+    for level, track_levels in pyramid.items():
+        path = LOD_OUTPUT_PATH.format(ref=ref, level=level)
+        with open(path, "wb") as file:
+            pickle.dump(track_levels, file)
+        output_paths[level] = path
+    return output_paths
+
+
+def load_lod_level(ref, level):
+    if level not in LOD_LEVEL_NAMES:
+        raise ValueError(f"Unknown level of detail {level!r}, expected one of {LOD_LEVEL_NAMES}")
+    with open(LOD_OUTPUT_PATH.format(ref=ref, level=level), "rb") as file:
+        return pickle.load(file)
@@ -0,0 +1,324 @@
+import argparse
+import os
+import re
+import time
+import urllib.request
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from pathlib import Path
+
+# The connecting lines the README wants a status LED for.
+NETWORK_STATUS_REFS = ("T1", "T2", "T3", "T4", "T8", "M1", "M3", "L1")
+STATUS_WINDOW_S = 600.0
+# A line whose last feed is older than this shows UNKNOWN rather than a stale status.
+STALE_FEED_S = 120.0
+POLL_INTERVAL_S = 15.0
+MINOR_DELAY_S = 120
+MAJOR_DELAY_S = 300
+# Share of trips in the window at least MINOR_DELAY_S late (MAJOR_DELAY_S late or
+# cancelled) above which the line shows MINOR_DELAYS (MAJOR_DELAYS).
+DELAYED_TRIP_FRACTION = 0.25
+API_KEY_ENVIRONMENT_VARIABLE = "TFNSW_API_KEY"
+
+# GTFS-realtime Alert.Effect values.
+NO_SERVICE = 1
+REDUCED_SERVICE = 2
+SIGNIFICANT_DELAYS = 3
+DETOUR = 4
+MODIFIED_SERVICE = 6
+DISRUPTING_EFFECTS = frozenset((NO_SERVICE, REDUCED_SERVICE))
+DELAYING_EFFECTS = frozenset((SIGNIFICANT_DELAYS,))
+MINOR_EFFECTS = frozenset((DETOUR, MODIFIED_SERVICE))
+# GTFS-realtime TripDescriptor.ScheduleRelationship.CANCELED
+TRIP_CANCELED = 3
+
+ROUTE_REF_PATTERN = re.compile(r"^([A-Z]+\d+)")
+
+
+class RouteStatus(IntEnum):
+    """Ordered by severity, so the worst of several statuses is their max()."""
+    UNKNOWN = 0
+    GOOD = 1
+    MINOR_DELAYS = 2
+    MAJOR_DELAYS = 3
+    DISRUPTED = 4
+
+
+@dataclass(frozen=True)
+class ServiceAlert:
+    alert_id: str
+    route_ids: frozenset[str]
+    effect: int
+    active_periods: tuple[tuple[int, int], ...] = ()
+
+    def is_active(self, timestamp):
+        """Active at timestamp; no periods means always, and 0 leaves a period open-ended."""
+        if not self.active_periods:
+            return True
+        return any(
+            (start == 0 or start <= timestamp) and (end == 0 or timestamp < end)
+            for start, end in self.active_periods
+        )
+
+
+@dataclass
+class FeedSnapshot:
+    """
+    What the status engine needs from one feed message. trip_delays holds one
+    (route_id, delay_s) tuple per trip, delay_s None for a cancelled trip;
+    tuples rather than objects because a full network feed has thousands.
+    """
+    timestamp: int
+    trip_delays: list[tuple[str, int | None]] = field(default_factory=list)
+    alerts: list[ServiceAlert] = field(default_factory=list)
+    deleted_alert_ids: list[str] = field(default_factory=list)
+    is_full_dataset: bool = True
+
+
+class DelayWindow:
+    """
+    Trip delays of one line over the last window_s seconds. Each snapshot is
+    folded into one sample and the running totals are updated as samples
+    enter and leave, so neither adding nor expiring rescans the window.
+    """
+
+    def __init__(self, window_s=STATUS_WINDOW_S):
+        self.window_s = window_s
+        self.samples = deque()
+        self.trips = 0
+        self.total_delay_s = 0
+        self.late = 0
+        self.very_late = 0
+        self.cancelled = 0
+
+    def add(self, timestamp, trips, total_delay_s, late, very_late, cancelled):
+        sample = (timestamp, trips, total_delay_s, late, very_late, cancelled)
+        self.samples.append(sample)
+        self._apply(sample, 1)
+        self.expire(timestamp)
+
+    def expire(self, now):
+        while self.samples and self.samples[0][0] <= now - self.window_s:
+            self._apply(self.samples.popleft(), -1)
+
+    def _apply(self, sample, sign):
+        _, trips, total_delay_s, late, very_late, cancelled = sample
+        self.trips += sign * trips
+        self.total_delay_s += sign * total_delay_s
+        self.late += sign * late
+        self.very_late += sign * very_late
+        self.cancelled += sign * cancelled
+
+    @property
+    def mean_delay_s(self):
+        running = self.trips - self.cancelled
+        return self.total_delay_s / running if running else 0.0
+
+    @property
+    def minor_fraction(self):
+        return self.late / self.trips if self.trips else 0.0
+
+    @property
+    def major_fraction(self):
+        return (self.very_late + self.cancelled) / self.trips if self.trips else 0.0
+
+
+def get_route_ref(route_id, refs=NETWORK_STATUS_REFS):
+    """The line ref of a GTFS route id such as 'T1', 'T1_2a' or 'M1 Metro North West', if it is one we show."""
+    match = ROUTE_REF_PATTERN.match(route_id)
+    if match is None or match.group(1) not in refs:
+        return None
+    return match.group(1)
+
+
+class NetworkStatusEngine:
+    """
+    Per-line status from a stream of GTFS-realtime snapshots. Each snapshot
+    costs one pass over its entities; statuses are read from running totals.
+    """
+
+    def __init__(self, refs=NETWORK_STATUS_REFS, window_s=STATUS_WINDOW_S, stale_feed_s=STALE_FEED_S):
+        self.refs = tuple(refs)
+        self.stale_feed_s = stale_feed_s
+        self.windows = {ref: DelayWindow(window_s) for ref in self.refs}
+        self.alerts = {}
+        self.timestamp = None
+        self._route_refs = {}
+
+    def route_ref(self, route_id):
+        ref = self._route_refs.get(route_id, "")
+        if ref == "":
+            ref = self._route_refs[route_id] = get_route_ref(route_id, self.refs)
+        return ref
+
+    def ingest(self, snapshot, source=None):
+        counts = {ref: [0, 0, 0, 0, 0] for ref in self.refs}
+        for route_id, delay_s in snapshot.trip_delays:
+            ref = self.route_ref(route_id)
+            if ref is None:
+                continue
+            count = counts[ref]
+            count[0] += 1
+            if delay_s is None:
+                count[4] += 1
+                continue
+            count[1] += max(delay_s, 0)
+            if delay_s >= MINOR_DELAY_S:
+                count[2] += 1
+            if delay_s >= MAJOR_DELAY_S:
+                count[3] += 1
+        for ref, count in counts.items():
+            if count[0]:
+                self.windows[ref].add(snapshot.timestamp, *count)
+            else:
+                self.windows[ref].expire(snapshot.timestamp)
+
+        # Alerts are held per source: a full dataset replaces only the alerts its
+        # own feed sent, so a TripUpdates feed never clears a ServiceAlerts one.
+        if snapshot.is_full_dataset:
+            self.alerts[source] = {}
+        source_alerts = self.alerts.setdefault(source, {})
+        for alert in snapshot.alerts:
+            refs = {self.route_ref(route_id) for route_id in alert.route_ids} - {None}
+            if refs:
+                source_alerts[alert.alert_id] = (alert, refs)
+        for alert_id in snapshot.deleted_alert_ids:
+            source_alerts.pop(alert_id, None)
+        self.timestamp = snapshot.timestamp if self.timestamp is None else max(self.timestamp, snapshot.timestamp)
+
+    def status(self, ref, now=None):
+        if self.timestamp is None:
+            return RouteStatus.UNKNOWN
+        now = self.timestamp if now is None else now
+        if now - self.timestamp > self.stale_feed_s:
+            return RouteStatus.UNKNOWN
+
+        effects = {
+            alert.effect
+            for source_alerts in self.alerts.values()
+            for alert, refs in source_alerts.values()
+            if ref in refs and alert.is_active(now)
+        }
+        if effects & DISRUPTING_EFFECTS:
+            return RouteStatus.DISRUPTED
+
+        window = self.windows[ref]
+        window.expire(now)
+        if (
+            effects & DELAYING_EFFECTS
+            or window.mean_delay_s >= MAJOR_DELAY_S
+            or window.major_fraction >= DELAYED_TRIP_FRACTION
+        ):
+            return RouteStatus.MAJOR_DELAYS
+        if (
+            effects & MINOR_EFFECTS
+            or window.mean_delay_s >= MINOR_DELAY_S
+            or window.minor_fraction >= DELAYED_TRIP_FRACTION
+        ):
+            return RouteStatus.MINOR_DELAYS
+        if window.trips:
+            return RouteStatus.GOOD
+        return RouteStatus.UNKNOWN
+
+    def statuses(self, now=None):
+        return {ref: self.status(ref, now) for ref in self.refs}
+
+
+def get_trip_delay(trip_update):
+    """The trip's own delay, else that of its next stop update; None if it has neither."""
+    if trip_update.HasField("delay"):
+        return trip_update.delay
+    for stop_time_update in trip_update.stop_time_update:
+        for event in (stop_time_update.arrival, stop_time_update.departure):
+            if event.HasField("delay"):
+                return event.delay
+    return None
+
+
+def decode_feed(data):
+    """Decodes a serialised GTFS-realtime FeedMessage into a FeedSnapshot."""
+    try:
+        from google.transit import gtfs_realtime_pb2
+    except ImportError as error:
+        raise ImportError("Decoding GTFS-realtime feeds needs the gtfs-realtime-bindings package") from error
+
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.ParseFromString(data)
+    snapshot = FeedSnapshot(
+        timestamp=message.header.timestamp or int(time.time()),
+        is_full_dataset=message.header.incrementality == gtfs_realtime_pb2.FeedHeader.FULL_DATASET,
+    )
+    for entity in message.entity:
+        if entity.is_deleted:
+            snapshot.deleted_alert_ids.append(entity.id)
+        elif entity.HasField("trip_update"):
+            trip = entity.trip_update.trip
+            if trip.schedule_relationship == TRIP_CANCELED:
+                snapshot.trip_delays.append((trip.route_id, None))
+            else:
+                delay_s = get_trip_delay(entity.trip_update)
+                if delay_s is not None:
+                    snapshot.trip_delays.append((trip.route_id, delay_s))
+        elif entity.HasField("alert"):
+            alert = entity.alert
+            snapshot.alerts.append(ServiceAlert(
+                entity.id,
+                frozenset(informed.route_id for informed in alert.informed_entity if informed.route_id),
+                alert.effect,
+                tuple((period.start, period.end) for period in alert.active_period),
+            ))
+    return snapshot
+
+
+def read_feed(source, api_key=None):
+    """Raw feed bytes from a file path or an http(s) URL, such as a local stand-in server."""
+    if not source.startswith(("http://", "https://")):
+        return Path(source).read_bytes()
+    request = urllib.request.Request(source)
+    if api_key:
+        request.add_header("Authorization", f"apikey {api_key}")
+    with urllib.request.urlopen(request, timeout=POLL_INTERVAL_S) as response:
+        return response.read()
+
+
+def format_statuses(statuses):
+    return "  ".join(f"{ref} {status.name}" for ref, status in statuses.items())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Status of the connecting rail network from GTFS-realtime feeds")
+    parser.add_argument(
+        "--source",
+        action="append",
+        required=True,
+        help="TripUpdates or ServiceAlerts feed, as a file path or URL; repeat for several feeds",
+    )
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL_S, help="Seconds between polls")
+    parser.add_argument("--once", action="store_true", help="Poll every source once, print and exit")
+    parser.add_argument(
+        "--api-key",
+        default=os.environ.get(API_KEY_ENVIRONMENT_VARIABLE),
+        help=f"Open data API key for URL sources (default: ${API_KEY_ENVIRONMENT_VARIABLE})",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    engine = NetworkStatusEngine()
+    while True:
+        started = time.perf_counter()
+        for source in args.source:
+            engine.ingest(decode_feed(read_feed(source, args.api_key)), source)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        # A one-off poll is usually of a recorded feed, so judge it at the feed's own time.
+        now = None if args.once else time.time()
+        print(f"{format_statuses(engine.statuses(now))}  ({elapsed_ms:.1f} ms)")
+        if args.once:
+            break
+        time.sleep(max(args.interval - elapsed_ms / 1000, 0.0))
+
+
+if __name__ == "__main__":
+    main()
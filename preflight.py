@@ -0,0 +1,319 @@
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+import numpy as np
+import shapely
+
+from label_placement import estimate_label_size, format_station_name, label_bounds
+
+# Copper the board script draws around each LED, matching add_via and emit_station_placements.
+VIA_DIAMETER_MM = 0.5
+FEED_WIDTH_MM = 0.5
+# JLCPCB's standard process minimum; KiCad DRC would flag anything under it.
+COPPER_CLEARANCE_MM = 0.2
+# Below KiCad's DRC resolution; keeps items placed exactly at the clearance from reporting.
+CLEARANCE_TOLERANCE_MM = 0.001
+# LED outlines are the footprint courtyard, which KiCad only requires not to overlap.
+LED_CLEARANCE_MM = 0.0
+EDGE_CLEARANCE_MM = 0.5
+# Neighbouring LEDs along a line further apart than this leave a dark stretch on the
+# live map; pseudo stations are placed every 75 m, so twice that means one is missing.
+MAX_LED_GAP_M = 150.0
+LAYER_F_CU = 1
+LAYER_B_CU = 2
+NETS = ("GND", "+5V")
+PREFLIGHT_MODES = ("warn", "strict", "off")
+
+
+@dataclass(frozen=True)
+class ClearanceViolation:
+    kind: str
+    first: str
+    second: str
+    distance: float
+    limit: float
+    x: float
+    y: float
+    unit: str = "mm"
+
+    def describe(self):
+        against = f" / {self.second}" if self.second else ""
+        return (
+            f"{self.kind}: {self.first}{against} at ({self.x:.2f}, {self.y:.2f}) mm, "
+            f"{self.distance:.2f} {self.unit} (limit {self.limit:.2f} {self.unit})"
+        )
+
+
+@dataclass
+class PreflightReport:
+    violations: list[ClearanceViolation] = field(default_factory=list)
+    item_count: int = 0
+    seconds: float = 0.0
+
+    @property
+    def ok(self):
+        return not self.violations
+
+    def describe(self, limit=20):
+        lines = [
+            f"Pre-flight checked {self.item_count} items in {self.seconds * 1000:.1f} ms: "
+            + (
+                ", ".join(f"{count} {kind}" for kind, count in sorted(Counter(v.kind for v in self.violations).items()))
+                if self.violations else "no violations"
+            )
+        ]
+        lines.extend(f"  {violation.describe()}" for violation in self.violations[:limit])
+        if len(self.violations) > limit:
+            lines.append(f"  ... and {len(self.violations) - limit} more")
+        return "\n".join(lines)
+
+
+@dataclass
+class CopperItems:
+    """Copper as centreline geometry with a half width, a net index and the layers it occupies."""
+    geometries: list = field(default_factory=list)
+    half_widths: list = field(default_factory=list)
+    nets: list = field(default_factory=list)
+    layers: list = field(default_factory=list)
+    names: list = field(default_factory=list)
+
+    def extend(self, geometries, half_width, net, layers, names):
+        self.geometries.extend(geometries)
+        self.half_widths.extend([half_width] * len(geometries))
+        self.nets.extend([net] * len(geometries))
+        self.layers.extend([layers] * len(geometries))
+        self.names.extend(names)
+
+
+def get_item_names(placement, references=None):
+    if references is None:
+        references = [f"LED {index}" for index in range(len(placement.names))]
+    return [f"{reference} {name}".rstrip() for reference, name in zip(references, placement.names)]
+
+
+def find_close_pairs(geometries, distance_mm):
+    """Index pairs (i < j) of geometries within distance_mm of each other, from one STRtree query."""
+    tree = shapely.STRtree(geometries)
+    first, second = tree.query(geometries, predicate="dwithin", distance=distance_mm)
+    keep = first < second
+    return first[keep], second[keep]
+
+
+def violation_points(geometries_a, geometries_b):
+    """Midpoints of the shortest lines between matching geometries, to say where a violation is."""
+    if len(geometries_a) == 0:
+        return np.zeros((0, 2))
+    lines = shapely.shortest_line(geometries_a, geometries_b)
+    return shapely.get_coordinates(shapely.line_interpolate_point(lines, 0.5, normalized=True))
+
+
+def collect_copper(placement, item_names, copper_tracks, via_diameter_mm, feed_width_mm):
+    copper = CopperItems()
+    gnd, power = NETS.index("GND"), NETS.index("+5V")
+    both_layers = LAYER_F_CU | LAYER_B_CU
+    copper.extend(
+        list(shapely.points(placement.gnd_via)), via_diameter_mm / 2, gnd, both_layers,
+        [f"{name} GND via" for name in item_names],
+    )
+    copper.extend(
+        list(shapely.points(placement.power_via)), via_diameter_mm / 2, power, both_layers,
+        [f"{name} +5V via" for name in item_names],
+    )
+    for pads, vias, net, label in ((placement.gnd_pad, placement.gnd_via, gnd, "GND"), (placement.power_pad, placement.power_via, power, "+5V")):
+        copper.extend(
+            list(shapely.linestrings(np.stack((pads, vias), axis=1))), feed_width_mm / 2, net, LAYER_F_CU,
+            [f"{name} {label} feed" for name in item_names],
+        )
+    copper.extend(
+        list(shapely.linestrings(np.stack((placement.power_tap, placement.power_via), axis=1))),
+        feed_width_mm / 2, power, LAYER_B_CU, [f"{name} +5V tap" for name in item_names],
+    )
+    # The back copper tracks carry +5V to every LED's tap; split into segments so the index prunes well.
+    for ref, line, width in copper_tracks:
+        coords = shapely.get_coordinates(line)
+        if len(coords) < 2:
+            continue
+        segments = shapely.linestrings(np.stack((coords[:-1], coords[1:]), axis=1))
+        copper.extend(list(segments), width / 2, power, LAYER_B_CU, [f"{ref} track"] * len(segments))
+    return copper
+
+
+def check_copper(copper, clearance_mm):
+    if not copper.geometries:
+        return []
+    geometries = np.array(copper.geometries, dtype=object)
+    half_widths = np.array(copper.half_widths)
+    nets = np.array(copper.nets)
+    layers = np.array(copper.layers)
+    first, second = find_close_pairs(geometries, 2 * half_widths.max() + clearance_mm)
+    keep = (nets[first] != nets[second]) & (layers[first] & layers[second] > 0)
+    first, second = first[keep], second[keep]
+    gaps = shapely.distance(geometries[first], geometries[second]) - half_widths[first] - half_widths[second]
+    short = gaps < clearance_mm - CLEARANCE_TOLERANCE_MM
+    first, second, gaps = first[short], second[short], gaps[short]
+    # A via beside a track usually comes too close to several of its segments; report the closest.
+    closest = {}
+    for index in np.argsort(gaps, kind="stable").tolist():
+        closest.setdefault((copper.names[first[index]], copper.names[second[index]]), index)
+    keep = np.array(sorted(closest.values()), dtype=np.int64)
+    first, second, gaps = first[keep], second[keep], gaps[keep]
+    points = violation_points(geometries[first], geometries[second])
+    return [
+        ClearanceViolation("copper clearance", copper.names[a], copper.names[b], float(gap), clearance_mm, *point)
+        for a, b, gap, point in zip(first.tolist(), second.tolist(), gaps, points.tolist())
+    ]
+
+
+def check_led_outlines(outlines, item_names, clearance_mm):
+    if len(outlines) == 0:
+        return []
+    first, second = find_close_pairs(outlines, clearance_mm)
+    gaps = shapely.distance(outlines[first], outlines[second])
+    overlaps = shapely.area(shapely.intersection(outlines[first], outlines[second]))
+    # Outlines touching at exactly the clearance are fine; ones within it, or overlapping, are not.
+    keep = (gaps < clearance_mm - CLEARANCE_TOLERANCE_MM) | (overlaps > CLEARANCE_TOLERANCE_MM)
+    first, second, gaps, overlaps = first[keep], second[keep], gaps[keep], overlaps[keep]
+    points = violation_points(shapely.centroid(outlines[first]), shapely.centroid(outlines[second]))
+    return [
+        ClearanceViolation(
+            "LED overlap" if overlap > 0 else "LED clearance", item_names[a], item_names[b],
+            float(overlap) if overlap > 0 else float(gap), 0.0 if overlap > 0 else clearance_mm, *point,
+            unit="mm²" if overlap > 0 else "mm",
+        )
+        for a, b, gap, overlap, point in zip(first.tolist(), second.tolist(), gaps, overlaps, points.tolist())
+    ]
+
+
+def check_vias_under_leds(placement, outlines, item_names):
+    """A via inside another LED's outline lands under its pads."""
+    if len(outlines) == 0:
+        return []
+    violations = []
+    tree = shapely.STRtree(outlines)
+    for vias, label in ((placement.gnd_via, "GND via"), (placement.power_via, "+5V via")):
+        via_index, led_index = tree.query(shapely.points(vias), predicate="within")
+        for via, led in zip(via_index.tolist(), led_index.tolist()):
+            if via != led:
+                violations.append(ClearanceViolation(
+                    "via under LED", f"{item_names[via]} {label}", item_names[led], 0.0, 0.0, *vias[via]
+                ))
+    return violations
+
+
+def check_ground_vias_poured(placement, zones, item_names, via_diameter_mm):
+    """Each GND via reaches its pad to the top ground pour, so it must land inside one."""
+    if not zones or len(placement.gnd_via) == 0:
+        return []
+    pour = shapely.union_all(zones)
+    shapely.prepare(pour)
+    vias = shapely.buffer(shapely.points(placement.gnd_via), via_diameter_mm / 2)
+    outside = np.flatnonzero(~shapely.contains(pour, vias))
+    return [
+        ClearanceViolation("GND via off pour", f"{item_names[index]} GND via", "", 0.0, via_diameter_mm / 2, *placement.gnd_via[index])
+        for index in outside.tolist()
+    ]
+
+
+def check_labels(placement, outlines, item_names, size_mm):
+    """Label boxes against each other and against every LED outline."""
+    labelled = np.array([bool(name) for name in placement.names])
+    indices = np.flatnonzero(labelled)
+    if len(indices) == 0:
+        return []
+    centres = np.column_stack((placement.pcb_x, placement.pcb_y))[indices]
+    sizes = [estimate_label_size(format_station_name(placement.names[index]), size_mm) for index in indices]
+    bounds = label_bounds(placement.label_anchor[indices], placement.label_angle[indices], centres, sizes)
+    boxes = shapely.box(*bounds.T)
+
+    violations = []
+    first, second = find_close_pairs(boxes, 0.0)
+    overlaps = shapely.area(shapely.intersection(boxes[first], boxes[second]))
+    points = violation_points(shapely.centroid(boxes[first]), shapely.centroid(boxes[second]))
+    for a, b, overlap, point in zip(first.tolist(), second.tolist(), overlaps, points.tolist()):
+        if overlap > 0:
+            violations.append(ClearanceViolation(
+                "label overlap", f"{item_names[indices[a]]} label", f"{item_names[indices[b]]} label",
+                float(overlap), 0.0, *point, unit="mm²",
+            ))
+    label_index, led_index = shapely.STRtree(outlines).query(boxes, predicate="intersects")
+    for label, led in zip(label_index.tolist(), led_index.tolist()):
+        if indices[label] != led:
+            violations.append(ClearanceViolation(
+                "label on LED", f"{item_names[indices[label]]} label", item_names[led], 0.0, 0.0,
+                placement.pcb_x[led], placement.pcb_y[led],
+            ))
+    return violations
+
+
+def check_board_edge(placement, outlines, item_names, board_rect, edge_clearance_mm):
+    if len(outlines) == 0:
+        return []
+    inner = shapely.buffer(board_rect, -edge_clearance_mm, join_style="mitre")
+    outside = np.flatnonzero(~shapely.contains(inner, outlines))
+    return [
+        ClearanceViolation(
+            "board edge", item_names[index], "", float(shapely.distance(board_rect.exterior, outlines[index])),
+            edge_clearance_mm, placement.pcb_x[index], placement.pcb_y[index],
+        )
+        for index in outside.tolist()
+    ]
+
+
+def check_led_spacing(allocation, placement, item_names, max_gap_m):
+    """Neighbouring LEDs along each line, by chainage, too far apart to show a tram between them."""
+    violations = []
+    refs = sorted({ref for slot in allocation.slots for ref in slot.chainage})
+    for ref in refs:
+        slots = sorted((slot for slot in allocation.slots if ref in slot.chainage), key=lambda slot: slot.chainage[ref])
+        for before, after in zip(slots, slots[1:]):
+            gap_m = after.chainage[ref] - before.chainage[ref]
+            if gap_m > max_gap_m:
+                violations.append(ClearanceViolation(
+                    f"{ref} LED gap", item_names[before.index], item_names[after.index], gap_m, max_gap_m,
+                    (placement.pcb_x[before.index] + placement.pcb_x[after.index]) / 2,
+                    (placement.pcb_y[before.index] + placement.pcb_y[after.index]) / 2,
+                    unit="m",
+                ))
+    return violations
+
+
+def run_preflight(
+    placement,
+    board_rect,
+    copper_tracks=(),
+    zones=(),
+    allocation=None,
+    references=None,
+    label_size_mm=2.5,
+    via_diameter_mm=VIA_DIAMETER_MM,
+    feed_width_mm=FEED_WIDTH_MM,
+    copper_clearance_mm=COPPER_CLEARANCE_MM,
+    led_clearance_mm=LED_CLEARANCE_MM,
+    edge_clearance_mm=EDGE_CLEARANCE_MM,
+    max_led_gap_m=MAX_LED_GAP_M,
+):
+    """
+    Checks everything create_board is about to push, in PCB millimetres:
+    copper of different nets (LED feeds, taps and vias against each other
+    and the +5V back tracks, given as (ref, line, width)), LED outlines,
+    vias under other LEDs, GND vias off the ground pour zones, labels,
+    the board edge and, with the LED allocation, gaps along each line.
+    Every check is one STRtree query, so the whole board takes milliseconds.
+    """
+    started = time.perf_counter()
+    item_names = get_item_names(placement, references)
+    outlines = shapely.polygons(np.asarray(placement.outline_corners))
+    copper = collect_copper(placement, item_names, copper_tracks, via_diameter_mm, feed_width_mm)
+
+    violations = check_copper(copper, copper_clearance_mm)
+    violations += check_led_outlines(outlines, item_names, led_clearance_mm)
+    violations += check_vias_under_leds(placement, outlines, item_names)
+    violations += check_ground_vias_poured(placement, list(zones), item_names, via_diameter_mm)
+    violations += check_labels(placement, outlines, item_names, label_size_mm)
+    violations += check_board_edge(placement, outlines, item_names, board_rect, edge_clearance_mm)
+    if allocation is not None:
+        violations += check_led_spacing(allocation, placement, item_names, max_led_gap_m)
+
+    item_count = len(copper.geometries) + len(outlines) + sum(bool(name) for name in placement.names)
+    return PreflightReport(violations, item_count, time.perf_counter() - started)
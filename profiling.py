@@ -0,0 +1,274 @@
+import cProfile
+import functools
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+PROFILE_CAPTURE_CHOICES = ("cprofile", "pyinstrument")
+DEFAULT_PROFILE_DIR = "profiles"
+# Geometry methods that do real GEOS work; property access and constructors are not counted.
+SHAPELY_GEOMETRY_METHODS = (
+    "buffer",
+    "contains",
+    "difference",
+    "distance",
+    "interpolate",
+    "intersection",
+    "intersects",
+    "project",
+    "simplify",
+    "symmetric_difference",
+    "union",
+)
+SHAPELY_OPS_FUNCTIONS = ("linemerge", "polygonize", "unary_union")
+SHAPELY_UNCOUNTED_MODULES = ("shapely.io",)
+
+
+@dataclass
+class StageRecord:
+    name: str
+    ref: str | None = None
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    features: int | None = None
+    vertices_in: int | None = None
+    vertices_out: int | None = None
+    shapely_calls: int = 0
+    ipc_calls: int = 0
+    capture_path: str | None = None
+    calls: dict[str, int] = field(default_factory=dict)
+
+
+class _NullRecord:
+    """Accepts and ignores the attributes a stage sets when profiling is off."""
+
+    def __setattr__(self, name, value):
+        pass
+
+
+class ShapelyCallCounter:
+    """
+    Counts GEOS calls by temporarily wrapping shapely's module-level
+    functions, shapely.ops helpers (including copies already imported into
+    the given modules) and the heavy BaseGeometry methods.
+    """
+
+    def __init__(self, counts, modules=()):
+        self.counts = counts
+        self.modules = modules
+        self._patches = []
+
+    def _wrap(self, owner, name, label):
+        original = getattr(owner, name)
+        counts = self.counts
+
+        @functools.wraps(original)
+        def counted(*args, **kwargs):
+            counts[label] += 1
+            return original(*args, **kwargs)
+
+        setattr(owner, name, counted)
+        self._patches.append((owner, name, original))
+
+    def __enter__(self):
+        import shapely
+        import shapely.ops
+        from shapely.geometry.base import BaseGeometry
+
+        for name in dir(shapely):
+            value = getattr(shapely, name)
+            # Geometry pickling looks up shapely.from_wkb, so the io functions stay unwrapped.
+            if name.startswith("_") or not callable(value) or isinstance(value, type):
+                continue
+            if getattr(value, "__module__", None) not in SHAPELY_UNCOUNTED_MODULES:
+                self._wrap(shapely, name, f"shapely.{name}")
+        for name in SHAPELY_OPS_FUNCTIONS:
+            original = getattr(shapely.ops, name)
+            self._wrap(shapely.ops, name, f"shapely.ops.{name}")
+            for module in self.modules:
+                if getattr(module, name, None) is original:
+                    self._wrap(module, name, f"shapely.ops.{name}")
+        for name in SHAPELY_GEOMETRY_METHODS:
+            self._wrap(BaseGeometry, name, f"geometry.{name}")
+        return self
+
+    def __exit__(self, *exc_info):
+        for owner, name, original in reversed(self._patches):
+            setattr(owner, name, original)
+        self._patches.clear()
+
+
+class CountingProxy:
+    """Wraps an IPC object (the KiCad board) and counts every method call made through it."""
+
+    def __init__(self, target, counts):
+        self._target = target
+        self._counts = counts
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value
+        counts = self._counts
+
+        @functools.wraps(value)
+        def counted(*args, **kwargs):
+            counts[f"ipc.{name}"] += 1
+            return value(*args, **kwargs)
+
+        return counted
+
+
+class StageProfiler:
+    """
+    Collects per-stage wall/CPU time, caller-supplied feature and vertex
+    counts, shapely and IPC call counts, and optionally a cProfile or
+    pyinstrument capture per stage. A disabled profiler costs nothing.
+    """
+
+    def __init__(self, enabled=True, capture=None, capture_dir=DEFAULT_PROFILE_DIR, modules=()):
+        if capture is not None and capture not in PROFILE_CAPTURE_CHOICES:
+            raise ValueError(f"Unknown profile capture {capture!r}, expected one of {PROFILE_CAPTURE_CHOICES}")
+        self.enabled = enabled
+        self.capture = capture
+        self.capture_dir = Path(capture_dir)
+        self.modules = modules
+        self.records = []
+        self.counts = Counter()
+        self._shapely_counter = None
+
+    def start(self):
+        """Starts counting shapely calls; stages only see calls made between start and stop."""
+        if self.enabled and self._shapely_counter is None:
+            self._shapely_counter = ShapelyCallCounter(self.counts, self.modules).__enter__()
+
+    def stop(self):
+        if self._shapely_counter is not None:
+            self._shapely_counter.__exit__(None, None, None)
+            self._shapely_counter = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def wrap_ipc(self, target):
+        if not self.enabled:
+            return target
+        return CountingProxy(target, self.counts)
+
+    @contextmanager
+    def stage(self, name, ref=None):
+        if not self.enabled:
+            yield _NullRecord()
+            return
+
+        record = StageRecord(name=name, ref=ref)
+        counts_before = Counter(self.counts)
+        capture = self._start_capture()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record.cpu_s = time.process_time() - cpu_start
+            record.wall_s = time.perf_counter() - wall_start
+            record.capture_path = self._finish_capture(capture, name, ref)
+            calls = self.counts - counts_before
+            record.calls = dict(calls)
+            record.shapely_calls = sum(count for key, count in calls.items() if not key.startswith("ipc."))
+            record.ipc_calls = sum(count for key, count in calls.items() if key.startswith("ipc."))
+            self.records.append(record)
+
+    def _start_capture(self):
+        if self.capture == "cprofile":
+            capture = cProfile.Profile()
+            capture.enable()
+            return capture
+        if self.capture == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError as error:
+                raise ImportError("--profile-capture pyinstrument needs the pyinstrument package") from error
+            capture = Profiler()
+            capture.start()
+            return capture
+        return None
+
+    def _finish_capture(self, capture, name, ref):
+        if capture is None:
+            return None
+        self.capture_dir.mkdir(parents=True, exist_ok=True)
+        stem = name if ref is None else f"{name}_{''.join(c if c.isalnum() else '_' for c in ref)}"
+        if self.capture == "cprofile":
+            capture.disable()
+            path = self.capture_dir / f"{stem}.prof"
+            capture.dump_stats(path)
+        else:
+            capture.stop()
+            path = self.capture_dir / f"{stem}.html"
+            path.write_text(capture.output_html())
+        return str(path)
+
+    def format_table(self):
+        def show(value):
+            return "" if value is None else str(value)
+
+        lines = [
+            f"{'stage':28s} {'ref':8s} {'wall s':>8s} {'cpu s':>8s} {'features':>8s} "
+            f"{'vert in':>8s} {'vert out':>8s} {'shapely':>8s} {'ipc':>6s}"
+        ]
+        for record in self.records:
+            lines.append(
+                f"{record.name:28s} {show(record.ref):8s} {record.wall_s:>8.3f} {record.cpu_s:>8.3f} "
+                f"{show(record.features):>8s} {show(record.vertices_in):>8s} {show(record.vertices_out):>8s} "
+                f"{record.shapely_calls:>8d} {record.ipc_calls:>6d}"
+            )
+        return "\n".join(lines)
+
+    def write_json(self, path):
+        with open(path, "w") as file:
+            json.dump([asdict(record) for record in self.records], file, indent=2)
+
+
+NULL_PROFILER = StageProfiler(enabled=False)
+
+
+def add_profile_arguments(parser):
+    parser.add_argument("--profile", action="store_true", help="Print a per-stage timing table")
+    parser.add_argument("--profile-json", help="Write the per-stage profile to this JSON file")
+    parser.add_argument(
+        "--profile-capture",
+        choices=PROFILE_CAPTURE_CHOICES,
+        help="Also capture a cProfile/pyinstrument profile per stage",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default=DEFAULT_PROFILE_DIR,
+        help="Directory for per-stage captures",
+    )
+
+
+def profiler_from_args(args, modules=()):
+    enabled = bool(args.profile or args.profile_json or args.profile_capture)
+    return StageProfiler(
+        enabled=enabled,
+        capture=args.profile_capture,
+        capture_dir=args.profile_dir,
+        modules=modules,
+    )
+
+
+def report_profile(profiler, args):
+    if not profiler.enabled:
+        return
+    if args.profile or args.profile_capture:
+        print(profiler.format_table())
+    if args.profile_json:
+        profiler.write_json(args.profile_json)
+        print(f"Wrote stage profile to {args.profile_json}")
@@ -0,0 +1,90 @@
+from dataclasses import dataclass
+
+import numpy as np
+import shapely
+from shapely.geometry import LineString, MultiLineString
+
+# Half the width of the finest silkscreen line we draw; anything below this is invisible on the board.
+PCB_SIMPLIFY_TOLERANCE_MM = 0.05
+
+
+@dataclass(frozen=True)
+class SimplificationReport:
+    name: str
+    vertices_in: int
+    vertices_out: int
+    max_deviation_m: float
+    max_deviation_mm: float
+
+    def describe(self):
+        return (
+            f"{self.name}: {self.vertices_in} -> {self.vertices_out} vertices "
+            f"(max deviation {self.max_deviation_m:.2f} m / {self.max_deviation_mm:.3f} mm)"
+        )
+
+
+def map_tolerance_from_pcb_mm(tolerance_mm, scale):
+    """Converts a tolerance in PCB millimetres to map metres for the given map scale."""
+    return tolerance_mm / (scale * 1000)
+
+
+def max_deviation(xs, ys, simplified_line):
+    """Largest distance from any original vertex to the simplified line."""
+    if len(xs) == 0:
+        return 0.0
+    points = shapely.points(np.column_stack((xs, ys)))
+    return float(shapely.distance(points, simplified_line).max())
+
+
+def simplify_lines(named_lines, tolerance_m, scale):
+    """
+    Douglas-Peucker simplification of several polylines at once.
+
+    The lines are simplified together as one MultiLineString so the topology
+    preserving simplifier also stops separate lines from crossing each other.
+    Returns a list of (xs, ys) arrays in the same order and a report per line.
+    """
+    names = [name for name, _ in named_lines]
+    originals = [(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)) for _, (xs, ys) in named_lines]
+
+    if tolerance_m <= 0:
+        simplified_coords = [np.column_stack(line) for line in originals]
+    else:
+        multi_line = MultiLineString([np.column_stack(line) for line in originals])
+        simplified = multi_line.simplify(tolerance_m, preserve_topology=True)
+        simplified_coords = [np.asarray(line.coords) for line in shapely.get_parts(simplified)]
+        if len(simplified_coords) != len(originals):
+            raise ValueError("Simplification dropped a line; lower the tolerance")
+
+    simplified_lines = []
+    reports = []
+    for name, (xs, ys), coords in zip(names, originals, simplified_coords):
+        deviation_m = max_deviation(xs, ys, LineString(coords)) if tolerance_m > 0 else 0.0
+        simplified_lines.append((coords[:, 0], coords[:, 1]))
+        reports.append(
+            SimplificationReport(
+                name=name,
+                vertices_in=len(xs),
+                vertices_out=len(coords),
+                max_deviation_m=deviation_m,
+                max_deviation_mm=deviation_m * scale * 1000,
+            )
+        )
+    return simplified_lines, reports
+
+
+def simplify_polyline(name, xs, ys, tolerance_m, scale):
+    simplified_lines, reports = simplify_lines(((name, (xs, ys)),), tolerance_m, scale)
+    simplified_xs, simplified_ys = simplified_lines[0]
+    return simplified_xs, simplified_ys, reports[0]
+
+
+def combine_reports(name, reports):
+    reports = list(reports)
+    return SimplificationReport(
+        name=name,
+        vertices_in=sum(report.vertices_in for report in reports),
+        vertices_out=sum(report.vertices_out for report in reports),
+        max_deviation_m=max((report.max_deviation_m for report in reports), default=0.0),
+        max_deviation_mm=max((report.max_deviation_mm for report in reports), default=0.0),
+    )
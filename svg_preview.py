@@ -0,0 +1,279 @@
+import argparse
+import glob
+import pickle
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from pathlib import Path
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+
+from led_frame import LINE_COLOURS
+from line_refs import LIGHT_RAIL_REFS
+from lod_pyramid import LOD_LEVEL_NAMES, LOD_OUTPUT_PATH
+
+PREVIEW_OUTPUT_PATH = "preview.svg"
+PREVIEW_WIDTH_PX = 1600
+# Map metres are written to this many decimals; a tenth of a metre is well inside any level's tolerance.
+PREVIEW_PRECISION = 1
+# TfNSW line colours for the train network; light rail takes the LED colours.
+TRAIN_LINE_COLOURS = {
+    "T1": "#f99d1c",
+    "T2": "#0098cd",
+    "T3": "#f37021",
+    "T4": "#005aa3",
+    "T5": "#c4258f",
+    "T7": "#6f818e",
+    "T8": "#00954c",
+    "T9": "#d11f2f",
+}
+DEFAULT_LINE_COLOUR = "#555555"
+LAND_COLOUR = "#f4f1ea"
+WATER_COLOUR = "#aad3f0"
+# Screen sizes in pixels at PREVIEW_WIDTH_PX; lines keep theirs at any zoom.
+TRAIN_LINE_WIDTH_PX = 1.5
+LIGHT_RAIL_LINE_WIDTH_PX = 2.5
+STATION_RADIUS_PX = 2.5
+LED_SIZE_PX = 3.0
+ICON_SIZE_PX = 10.0
+ICON_PATH = str(Path(__file__).with_name("TfNSW_{mode}.svg"))
+# Light rail stops that connect to other modes, with the TfNSW icons drawn beside them.
+INTERCHANGE_MODES = {
+    "Central Chalmers Street": ("T", "M"),
+    "Circular Quay": ("T", "F"),
+    "Town Hall": ("T",),
+    "Wynyard": ("T",),
+}
+SVG_NAMESPACE = "http://www.w3.org/2000/svg"
+
+
+@dataclass
+class PreviewLine:
+    """One line of the map, drawn as a single path of one or more parts."""
+    ref: str
+    colour: str
+    width_px: float
+    parts: list[tuple[np.ndarray, np.ndarray]]
+
+
+def rgb_to_hex(rgb):
+    return "#" + "".join(f"{channel:02x}" for channel in rgb)
+
+
+def get_line_colour(ref):
+    if ref in LINE_COLOURS:
+        return rgb_to_hex(LINE_COLOURS[ref])
+    return TRAIN_LINE_COLOURS.get(ref, DEFAULT_LINE_COLOUR)
+
+
+def line_path_data(parts, precision=PREVIEW_PRECISION):
+    """Path data for polylines: a moveto per part, its later points implicit linetos."""
+    xs = np.concatenate([np.asarray(part_xs, dtype=float) for part_xs, _ in parts])
+    ys = np.concatenate([np.asarray(part_ys, dtype=float) for _, part_ys in parts])
+    pairs = np.char.add(
+        np.char.add(np.char.mod(f"%.{precision}f", xs), ","),
+        np.char.mod(f"%.{precision}f", np.negative(ys)),
+    ).tolist()
+    for start in np.cumsum([0] + [len(part_xs) for part_xs, _ in parts[:-1]]):
+        pairs[start] = "M" + pairs[start]
+    return " ".join(pairs)
+
+
+def polygon_path_data(polygons, precision=PREVIEW_PRECISION):
+    """Path data for shapely polygons, holes as extra closed rings for an evenodd fill."""
+    rings = []
+    for polygon in polygons:
+        for ring in (polygon.exterior, *polygon.interiors):
+            xs, ys = ring.xy
+            rings.append((np.asarray(xs)[:-1], np.asarray(ys)[:-1]))
+    if not rings:
+        return ""
+    return line_path_data(rings, precision).replace(" M", " Z M") + " Z"
+
+
+def load_icon_symbol(mode, icon_path=ICON_PATH):
+    """A TfNSW_*.svg icon as a <symbol>, dropping the Inkscape metadata."""
+    root = ET.parse(icon_path.format(mode=mode)).getroot()
+
+    def serialise(element):
+        tag = element.tag.rpartition("}")[2]
+        if element.tag.startswith("{") and not element.tag.startswith(f"{{{SVG_NAMESPACE}}}"):
+            return ""
+        if tag in ("defs", "title", "metadata"):
+            return ""
+        attributes = "".join(
+            f" {name}={quoteattr(value)}" for name, value in element.attrib.items() if name != "id" and "}" not in name
+        )
+        children = "".join(serialise(child) for child in element)
+        return f"<{tag}{attributes}>{children}</{tag}>" if children else f"<{tag}{attributes}/>"
+
+    body = "".join(serialise(child) for child in root)
+    return f'<symbol id="icon-{mode}" viewBox={quoteattr(root.get("viewBox"))}>{body}</symbol>'
+
+
+def get_bounds(lines, points):
+    xs = [np.asarray(part_xs, dtype=float) for line in lines for part_xs, _ in line.parts]
+    ys = [np.asarray(part_ys, dtype=float) for line in lines for _, part_ys in line.parts]
+    xs.append(np.array([point[0] for point in points], dtype=float))
+    ys.append(np.array([point[1] for point in points], dtype=float))
+    xs = np.concatenate(xs)
+    ys = np.concatenate(ys)
+    if len(xs) == 0:
+        raise ValueError("Nothing to preview")
+    return xs.min(), ys.min(), xs.max(), ys.max()
+
+
+def iter_svg(lines, stations=(), leds=(), coastline=None, bounds=None, width_px=PREVIEW_WIDTH_PX):
+    """
+    Yields the preview SVG in pieces: coastline, one path per line (train
+    lines under light rail), LEDs, then stations with their interchange
+    icons. Coordinates are map metres, so the file scales without loss.
+    """
+    stations = list(stations)
+    leds = list(leds)
+    if bounds is None:
+        bounds = coastline["extent"] if coastline is not None else get_bounds(
+            lines, [(station.map_x, station.map_y) for station in stations]
+        )
+    min_x, min_y, max_x, max_y = bounds
+    width_m = max(max_x - min_x, 1.0)
+    height_m = max(max_y - min_y, 1.0)
+    metres_per_px = width_m / width_px
+    yield (
+        f'<svg xmlns="{SVG_NAMESPACE}" xmlns:xlink="http://www.w3.org/1999/xlink" '
+        f'width="{width_px}" height="{round(height_m / metres_per_px)}" '
+        f'viewBox="{min_x:.1f} {-max_y:.1f} {width_m:.1f} {height_m:.1f}">\n'
+    )
+
+    modes = sorted({mode for station in stations for mode in INTERCHANGE_MODES.get(station.name, ())})
+    if modes:
+        yield "<defs>" + "".join(load_icon_symbol(mode) for mode in modes) + "</defs>\n"
+
+    if coastline is not None:
+        yield f'<rect x="{min_x:.1f}" y="{-max_y:.1f}" width="{width_m:.1f}" height="{height_m:.1f}" fill="{LAND_COLOUR}"/>\n'
+        yield (
+            f'<path id="water" fill="{WATER_COLOUR}" fill-rule="evenodd" '
+            f'd="{polygon_path_data(coastline["water"].geoms)}"/>\n'
+        )
+
+    yield '<g id="lines" fill="none" stroke-linecap="round" stroke-linejoin="round">\n'
+    for line in sorted(lines, key=lambda line: line.width_px):
+        if not line.parts:
+            continue
+        yield (
+            f'<path id={quoteattr(f"line-{line.ref}")} stroke="{line.colour}" stroke-width="{line.width_px}" '
+            f'vector-effect="non-scaling-stroke" d="{line_path_data(line.parts)}"><title>{escape(line.ref)}</title></path>\n'
+        )
+    yield "</g>\n"
+
+    if leds:
+        size = LED_SIZE_PX * metres_per_px
+        yield f'<g id="leds" fill="#ffffff" stroke="#000000" stroke-width="{0.5 * metres_per_px:.2f}">\n'
+        for slot in leds:
+            station = slot.station
+            fill = ' fill="#ffd54f"' if slot.is_shared else ""
+            yield (
+                f'<rect x="{station.map_x - size / 2:.1f}" y="{-station.map_y - size / 2:.1f}" '
+                f'width="{size:.1f}" height="{size:.1f}"{fill}><title>LED {slot.index}'
+                f'{escape(" " + slot.name) if slot.name else ""} ({", ".join(slot.refs)})</title></rect>\n'
+            )
+        yield "</g>\n"
+
+    radius = STATION_RADIUS_PX * metres_per_px
+    icon_size = ICON_SIZE_PX * metres_per_px
+    yield f'<g id="stations" fill="#ffffff" stroke="#000000" stroke-width="{metres_per_px:.2f}">\n'
+    for station in stations:
+        if not station.name:
+            # Pseudo stations, which only place LEDs, show as dots.
+            yield f'<circle cx="{station.map_x:.1f}" cy="{-station.map_y:.1f}" r="{radius / 2:.1f}"/>\n'
+            continue
+        yield (
+            f'<circle cx="{station.map_x:.1f}" cy="{-station.map_y:.1f}" r="{radius:.1f}">'
+            f"<title>{escape(station.name)}</title></circle>\n"
+        )
+        for offset, mode in enumerate(INTERCHANGE_MODES.get(station.name, ())):
+            yield (
+                f'<use href="#icon-{mode}" xlink:href="#icon-{mode}" x="{station.map_x + radius + offset * icon_size:.1f}" '
+                f'y="{-station.map_y - icon_size / 2:.1f}" width="{icon_size:.1f}" height="{icon_size:.1f}"/>\n'
+            )
+    yield "</g>\n</svg>\n"
+
+
+def write_preview(path, lines, stations=(), leds=(), coastline=None, bounds=None, width_px=PREVIEW_WIDTH_PX):
+    with open(path, "w") as file:
+        for chunk in iter_svg(lines, stations, leds, coastline, bounds, width_px):
+            file.write(chunk)
+
+
+def get_track_parts(tracks, ref, level=None):
+    """The tracks' polylines at a level of detail, or as digested when level is None or was not written."""
+    if level is not None and Path(LOD_OUTPUT_PATH.format(ref=ref, level=level)).exists():
+        with open(LOD_OUTPUT_PATH.format(ref=ref, level=level), "rb") as file:
+            return [(track_level.map_x, track_level.map_y) for track_level in pickle.load(file)]
+    return [(track.map_x, track.map_y) for track in tracks]
+
+
+def load_digest_preview(level=None, light_rail_refs=LIGHT_RAIL_REFS):
+    """Lines and stations from the digest outputs in the working directory."""
+    lines = []
+    stations = []
+    for ref in light_rail_refs:
+        if not Path(f"{ref}_track_geometry.pckl").exists():
+            continue
+        with open(f"{ref}_track_geometry.pckl", "rb") as file:
+            track = pickle.load(file)
+        with open(f"{ref}_stations_geometry.pckl", "rb") as file:
+            stations.extend(pickle.load(file))
+        lines.append(PreviewLine(ref, get_line_colour(ref), LIGHT_RAIL_LINE_WIDTH_PX, get_track_parts([track], ref, level)))
+    for path in sorted(glob.glob("*_tracks_geometry.pckl")):
+        with open(path, "rb") as file:
+            route_group = pickle.load(file)
+        lines.append(PreviewLine(
+            route_group.ref,
+            get_line_colour(route_group.ref),
+            TRAIN_LINE_WIDTH_PX,
+            get_track_parts(route_group.track_components, path.removesuffix("_tracks_geometry.pckl"), level),
+        ))
+    return lines, stations
+
+
+def load_coastline(path):
+    if not Path(path).exists():
+        return None
+    with open(path, "rb") as file:
+        return pickle.load(file)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Render the digested map to an SVG preview, without matplotlib")
+    parser.add_argument("--output", default=PREVIEW_OUTPUT_PATH, help="Where to write the SVG")
+    parser.add_argument("--level", choices=LOD_LEVEL_NAMES, help="Level of detail to draw (default: as digested)")
+    parser.add_argument("--coastline", default="coastline_polygons.pckl", help="Coastline polygons to draw under the lines")
+    parser.add_argument("--no-coastline", action="store_true", help="Leave the coastline out")
+    parser.add_argument("--leds", action="store_true", help="Also draw the LED allocation over the light rail stations")
+    parser.add_argument("--width", type=int, default=PREVIEW_WIDTH_PX, help="Width of the preview in pixels")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+    lines, stations = load_digest_preview(args.level)
+    coastline = None if args.no_coastline else load_coastline(args.coastline)
+    leds = ()
+    if args.leds and stations:
+        from led_allocation import allocate_leds
+
+        leds = allocate_leds(stations).slots
+    # Without a coastline the view fits the lines, which for the train network spans far beyond the board.
+    write_preview(args.output, lines, stations, leds, coastline, width_px=args.width)
+    vertices = sum(len(xs) for line in lines for xs, _ in line.parts)
+    print(
+        f"Wrote {args.output}: {len(lines)} lines ({vertices} vertices), {len(stations)} stations "
+        f"in {(time.perf_counter() - started) * 1000:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import argparse
+import pickle
+import sys
+from dataclasses import dataclass
+
+import numpy as np
+import shapely
+from shapely.geometry import GeometryCollection, LineString, MultiLineString, box
+
+from line_refs import LIGHT_RAIL_REFS, TRAIN_REFS
+from MapProjection import DEFAULT_PROJECTION_BACKEND, PROJECTION_BACKENDS, MapProjection
+
+MAP_ORIGIN_LON = 151.22289335
+MAP_ORIGIN_LAT = -33.8937485
+MAP_SCALE = 1 / 25000
+PCB_ORIGIN_MM = (148.5, 210.0)
+BOARD_WIDTH_METRES = 5000
+BOARD_HEIGHT_METRES = 8000
+TILE_GEOMETRY_PATH = "tile_{name}_geometry.pckl"
+
+sys.modules.setdefault("tiling", sys.modules[__name__])
+
+
+@dataclass(frozen=True)
+class Tile:
+    """One panel of a tiled map: its extent in map metres and the projection that centres it on the PCB."""
+    row: int
+    column: int
+    bounds_map: tuple[float, float, float, float]
+    projection: MapProjection
+
+    @property
+    def name(self):
+        return f"r{self.row}c{self.column}"
+
+    @property
+    def rect_map(self):
+        return box(*self.bounds_map)
+
+    @property
+    def rect_pcb(self):
+        min_x, min_y, max_x, max_y = self.bounds_map
+        pcb_x, pcb_y = self.projection.map_to_pcb(np.array([min_x, max_x]), np.array([min_y, max_y]))
+        return box(pcb_x.min(), pcb_y.min(), pcb_x.max(), pcb_y.max())
+
+
+Tile.__module__ = "tiling"
+
+
+def parse_grid(text):
+    """Parses a COLUMNSxROWS grid such as '3x4'."""
+    try:
+        columns, rows = (int(part) for part in text.lower().split("x"))
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"Expected COLUMNSxROWS, got {text!r}") from error
+    if columns < 1 or rows < 1:
+        raise argparse.ArgumentTypeError(f"Grid must be at least 1x1, got {text!r}")
+    return columns, rows
+
+
+def tile_projection(projection, centre_x, centre_y):
+    """A copy of projection whose PCB origin is moved so the map point (centre_x, centre_y) lands on it."""
+    origin_x, origin_y = projection.pcb_origin_mm
+    offset_x, offset_y = projection.map_to_pcb(centre_x, centre_y)
+    return MapProjection(
+        *projection.origin,
+        scale=projection.scale,
+        pcb_origin_mm=(origin_x - (offset_x - origin_x), origin_y - (offset_y - origin_y)),
+        backend=projection.backend,
+        central_meridian=projection.central_meridian,
+    )
+
+
+def make_tiles(projection, width_metres, height_metres, columns, rows):
+    """
+    Splits the map extent centred on the projection origin into a grid of
+    panels, row 0 at the top, each centred on the PCB origin of its own
+    projection so every panel uses the same board outline.
+    """
+    xs = np.linspace(-width_metres / 2, width_metres / 2, columns + 1)
+    ys = np.linspace(height_metres / 2, -height_metres / 2, rows + 1)
+    tiles = []
+    for row in range(rows):
+        for column in range(columns):
+            bounds = (float(xs[column]), float(ys[row + 1]), float(xs[column + 1]), float(ys[row]))
+            centre_x = (bounds[0] + bounds[2]) / 2
+            centre_y = (bounds[1] + bounds[3]) / 2
+            tiles.append(Tile(row, column, bounds, tile_projection(projection, centre_x, centre_y)))
+    return tiles
+
+
+def line_to_map_geometries(line):
+    """The map-coordinate LineStrings of a Track, route group, or (xs, ys) tuple."""
+    if hasattr(line, "track_components"):
+        return [
+            geometry
+            for track_component in line.track_components
+            for geometry in line_to_map_geometries(track_component)
+        ]
+    if hasattr(line, "map_x") and hasattr(line, "map_y"):
+        xs = line.map_x
+        ys = line.map_y
+    elif isinstance(line, tuple) and len(line) == 2:
+        xs, ys = line
+    else:
+        raise TypeError(f"Unsupported line geometry type: {type(line)}")
+    return [LineString(zip(xs, ys))]
+
+
+def iter_line_parts(geometry):
+    """Yields the LineStrings of a clipping result, dropping any points it degenerated to."""
+    if geometry.is_empty:
+        return
+    if isinstance(geometry, LineString):
+        yield geometry
+    elif isinstance(geometry, (MultiLineString, GeometryCollection)):
+        for part in geometry.geoms:
+            yield from iter_line_parts(part)
+
+
+def clip_lines_to_tiles(lines, tiles):
+    """
+    Clips every line to every tile in one pass. An STRtree over the lines
+    finds the (line, tile) pairs whose envelopes meet, lines lying wholly
+    inside a tile are kept as they are, and only the remaining pairs are
+    intersected, in a single vectorised call. Returns one list of
+    (line index, LineString) per tile.
+    """
+    lines = np.asarray(lines, dtype=object)
+    tile_rects = np.array([tile.rect_map for tile in tiles], dtype=object)
+    clipped = [[] for _ in tiles]
+    if len(lines) == 0:
+        return clipped
+
+    tree = shapely.STRtree(lines)
+    tile_indices, line_indices = tree.query(tile_rects, predicate="intersects")
+    inside = shapely.contains_properly(tile_rects[tile_indices], lines[line_indices])
+    for tile_index, line_index in zip(tile_indices[inside], line_indices[inside]):
+        clipped[tile_index].append((int(line_index), lines[line_index]))
+
+    crossing_tiles = tile_indices[~inside]
+    crossing_lines = line_indices[~inside]
+    pieces = shapely.intersection(lines[crossing_lines], tile_rects[crossing_tiles])
+    for tile_index, line_index, piece in zip(crossing_tiles, crossing_lines, pieces):
+        clipped[tile_index].extend((int(line_index), part) for part in iter_line_parts(piece))
+    return clipped
+
+
+def assign_stations_to_tiles(stations, tiles):
+    """Each station goes to the first tile containing it, so stations on a seam are not placed twice."""
+    assigned = [[] for _ in tiles]
+    if not stations:
+        return assigned
+    xs = np.array([station.map_x for station in stations], dtype=float)
+    ys = np.array([station.map_y for station in stations], dtype=float)
+    unassigned = np.ones(len(stations), dtype=bool)
+    for tile_index, tile in enumerate(tiles):
+        min_x, min_y, max_x, max_y = tile.bounds_map
+        inside = unassigned & (xs >= min_x) & (xs <= max_x) & (ys >= min_y) & (ys <= max_y)
+        assigned[tile_index] = [stations[index] for index in np.flatnonzero(inside)]
+        unassigned &= ~inside
+    return assigned
+
+
+def split_digest_into_tiles(lines_by_ref, stations, tiles):
+    """
+    Clips the digested lines and assigns the stations to every tile at once.
+    Returns, per tile name, the tile, its clipped map-coordinate lines keyed
+    by ref, and its stations.
+    """
+    refs = []
+    geometries = []
+    for ref, line in lines_by_ref.items():
+        for geometry in line_to_map_geometries(line):
+            refs.append(ref)
+            geometries.append(geometry)
+
+    clipped = clip_lines_to_tiles(geometries, tiles)
+    tile_stations = assign_stations_to_tiles(stations, tiles)
+    tile_geometry = {}
+    for tile, tile_lines, stations_in_tile in zip(tiles, clipped, tile_stations):
+        lines = {ref: [] for ref in lines_by_ref}
+        for line_index, part in tile_lines:
+            lines[refs[line_index]].append(part)
+        tile_geometry[tile.name] = {"tile": tile, "lines": lines, "stations": stations_in_tile}
+    return tile_geometry
+
+
+def load_tile_geometry(name):
+    with open(TILE_GEOMETRY_PATH.format(name=name), "rb") as file:
+        return pickle.load(file)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Split the digested map into PCB panels")
+    parser.add_argument("--tiles", type=parse_grid, required=True, help="Panel grid as COLUMNSxROWS, e.g. 2x3")
+    parser.add_argument("--width-metres", type=float, default=BOARD_WIDTH_METRES)
+    parser.add_argument("--height-metres", type=float, default=BOARD_HEIGHT_METRES)
+    parser.add_argument(
+        "--projection",
+        choices=PROJECTION_BACKENDS,
+        default=DEFAULT_PROJECTION_BACKEND,
+        help="Map projection backend; digest and board must use the same one",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    projection = MapProjection(
+        origin_lon=MAP_ORIGIN_LON,
+        origin_lat=MAP_ORIGIN_LAT,
+        scale=MAP_SCALE,
+        pcb_origin_mm=PCB_ORIGIN_MM,
+        backend=args.projection,
+    )
+    columns, rows = args.tiles
+    tiles = make_tiles(projection, args.width_metres, args.height_metres, columns, rows)
+
+    lines_by_ref = {}
+    stations = []
+    for ref in LIGHT_RAIL_REFS:
+        with open(f"{ref}_track_geometry.pckl", "rb") as file:
+            lines_by_ref[ref] = pickle.load(file)
+        with open(f"{ref}_stations_geometry.pckl", "rb") as file:
+            stations.extend(pickle.load(file))
+    for ref in TRAIN_REFS:
+        with open(f"{ref}_tracks_geometry.pckl", "rb") as file:
+            lines_by_ref[ref] = pickle.load(file)
+
+    for name, geometry in split_digest_into_tiles(lines_by_ref, stations, tiles).items():
+        path = TILE_GEOMETRY_PATH.format(name=name)
+        with open(path, "wb") as file:
+            pickle.dump(geometry, file)
+        line_count = sum(len(parts) for parts in geometry["lines"].values())
+        print(f"Wrote {path}: {line_count} line parts, {len(geometry['stations'])} stations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import heapq
+from dataclasses import dataclass
+
+import numpy as np
+
+# Component ends closer than this are the same junction. linemerge leaves the pieces of
+# one route sharing exact endpoint coordinates, so this only absorbs float noise.
+JUNCTION_TOLERANCE_M = 0.01
+# Geometry built on demand; dropped when pickling so loading a graph does not import shapely.
+CACHED_GEOMETRY_ATTRIBUTES = ("_edge_lines", "_edge_tree")
+
+
+@dataclass(frozen=True)
+class TrackPosition:
+    """A point on the graph: an edge and the distance along it from the edge's start node."""
+    edge: int
+    offset_m: float
+    distance_m: float = 0.0
+
+
+class TrackGraph:
+    """
+    The pieces of a route's track joined at their shared ends. Nodes are
+    junctions and line ends, edges are the track components between them,
+    and both adjacency and edge geometry are stored CSR style: flat arrays
+    indexed by per-node and per-edge offsets, so a graph for the whole
+    train network is a handful of numpy arrays.
+    """
+
+    def __init__(self, node_x, node_y, edge_nodes, edge_names, vertex_offsets, vertex_x, vertex_y, vertex_chainage):
+        self.node_x = node_x
+        self.node_y = node_y
+        self.edge_nodes = edge_nodes
+        self.edge_names = edge_names
+        self.vertex_offsets = vertex_offsets
+        self.vertex_x = vertex_x
+        self.vertex_y = vertex_y
+        self.vertex_chainage = vertex_chainage
+        self.edge_lengths = vertex_chainage[vertex_offsets[1:] - 1]
+
+        # Each edge appears twice in the adjacency, once from each end.
+        from_nodes = np.concatenate((edge_nodes[:, 0], edge_nodes[:, 1]))
+        to_nodes = np.concatenate((edge_nodes[:, 1], edge_nodes[:, 0]))
+        edges = np.tile(np.arange(len(edge_nodes)), 2)
+        order = np.argsort(from_nodes, kind="stable")
+        self.adjacency_offsets = np.zeros(len(node_x) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(from_nodes, minlength=len(node_x)), out=self.adjacency_offsets[1:])
+        self.adjacency_nodes = to_nodes[order]
+        self.adjacency_edges = edges[order]
+
+    @classmethod
+    def from_tracks(cls, tracks, junction_tolerance_m=JUNCTION_TOLERANCE_M):
+        """Builds the graph from Track components in map metres, one edge per component."""
+        tracks = [track for track in tracks if len(track.map_x) >= 2]
+        if not tracks:
+            raise ValueError("No track to build a graph from")
+        lengths = np.array([len(track.map_x) for track in tracks], dtype=np.int64)
+        vertex_offsets = np.concatenate(([0], np.cumsum(lengths)))
+        vertex_x = np.concatenate([np.asarray(track.map_x, dtype=float) for track in tracks])
+        vertex_y = np.concatenate([np.asarray(track.map_y, dtype=float) for track in tracks])
+        steps = np.hypot(np.diff(vertex_x), np.diff(vertex_y))
+        # Chainage restarts at each edge: zero the step from one edge's last vertex to the next's first.
+        steps[vertex_offsets[1:-1] - 1] = 0.0
+        vertex_chainage = np.concatenate(([0.0], np.cumsum(steps)))
+        vertex_chainage -= np.repeat(vertex_chainage[vertex_offsets[:-1]], lengths)
+
+        ends = np.concatenate((vertex_offsets[:-1], vertex_offsets[1:] - 1))
+        end_keys = np.round(np.column_stack((vertex_x[ends], vertex_y[ends])) / junction_tolerance_m)
+        nodes, end_nodes = np.unique(end_keys, axis=0, return_inverse=True)
+        end_nodes = end_nodes.reshape(-1)
+        node_x = np.zeros(len(nodes))
+        node_y = np.zeros(len(nodes))
+        node_x[end_nodes] = vertex_x[ends]
+        node_y[end_nodes] = vertex_y[ends]
+        edge_nodes = end_nodes.reshape(2, -1).T.astype(np.int64)
+        return cls(
+            node_x,
+            node_y,
+            edge_nodes,
+            tuple(track.name for track in tracks),
+            vertex_offsets,
+            vertex_x,
+            vertex_y,
+            vertex_chainage,
+        )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for attribute in CACHED_GEOMETRY_ATTRIBUTES:
+            state.pop(attribute, None)
+        return state
+
+    @property
+    def node_count(self):
+        return len(self.node_x)
+
+    @property
+    def edge_count(self):
+        return len(self.edge_nodes)
+
+    @property
+    def node_degrees(self):
+        return np.diff(self.adjacency_offsets)
+
+    @property
+    def total_length_m(self):
+        return float(self.edge_lengths.sum())
+
+    def connected_components(self):
+        """A component label per node, numbered from 0 in order of each component's first node."""
+        labels = np.full(self.node_count, -1, dtype=np.int64)
+        component = 0
+        for start in range(self.node_count):
+            if labels[start] >= 0:
+                continue
+            labels[start] = component
+            stack = [start]
+            while stack:
+                node = stack.pop()
+                for neighbour in self.adjacency_nodes[self.adjacency_offsets[node]:self.adjacency_offsets[node + 1]]:
+                    if labels[neighbour] < 0:
+                        labels[neighbour] = component
+                        stack.append(neighbour)
+            component += 1
+        return labels
+
+    def describe(self):
+        junctions = int(np.count_nonzero(self.node_degrees >= 3))
+        components = len(np.unique(self.connected_components())) if self.node_count else 0
+        return (
+            f"{self.edge_count} edges, {self.node_count} nodes ({junctions} junctions), "
+            f"{components} connected pieces, {self.total_length_m / 1000:.1f} km"
+        )
+
+    def edge_coordinates(self, edge):
+        start, end = self.vertex_offsets[edge], self.vertex_offsets[edge + 1]
+        return self.vertex_x[start:end], self.vertex_y[start:end]
+
+    @property
+    def edge_lines(self):
+        if "_edge_lines" not in self.__dict__:
+            import shapely
+
+            self._edge_lines = shapely.linestrings(
+                np.column_stack((self.vertex_x, self.vertex_y)),
+                indices=np.repeat(np.arange(self.edge_count), np.diff(self.vertex_offsets)),
+            )
+        return self._edge_lines
+
+    def locate(self, x, y, max_distance_m=None):
+        """
+        The nearest TrackPosition to each point in map metres, as arrays of
+        edge (-1 where nothing is within max_distance_m), offset and distance.
+        """
+        import shapely
+
+        if "_edge_tree" not in self.__dict__:
+            self._edge_tree = shapely.STRtree(self.edge_lines)
+        points = shapely.points(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        (point_indices, edge_indices), distances = self._edge_tree.query_nearest(
+            points, max_distance=max_distance_m, return_distance=True, all_matches=False
+        )
+        edges = np.full(len(points), -1, dtype=np.int64)
+        offsets = np.full(len(points), np.nan)
+        point_distances = np.full(len(points), np.nan)
+        edges[point_indices] = edge_indices
+        offsets[point_indices] = shapely.line_locate_point(self.edge_lines[edge_indices], points[point_indices])
+        point_distances[point_indices] = distances
+        return edges, offsets, point_distances
+
+    def locate_point(self, x, y, max_distance_m=None):
+        edges, offsets, distances = self.locate([x], [y], max_distance_m)
+        if edges[0] < 0:
+            return None
+        return TrackPosition(int(edges[0]), float(offsets[0]), float(distances[0]))
+
+    def distances_from(self, sources):
+        """
+        Dijkstra over the adjacency from {node: starting distance}. Returns
+        the distance to every node (inf where unreachable) and the edge each
+        node was reached by (-1 at sources and unreachable nodes).
+        """
+        distances = np.full(self.node_count, np.inf)
+        via_edges = np.full(self.node_count, -1, dtype=np.int64)
+        queue = []
+        for node, distance in sources.items():
+            if distance < distances[node]:
+                distances[node] = distance
+                heapq.heappush(queue, (distance, node))
+        offsets, neighbours, edges, lengths = (
+            self.adjacency_offsets, self.adjacency_nodes, self.adjacency_edges, self.edge_lengths
+        )
+        while queue:
+            distance, node = heapq.heappop(queue)
+            if distance > distances[node]:
+                continue
+            for index in range(offsets[node], offsets[node + 1]):
+                neighbour = neighbours[index]
+                candidate = distance + lengths[edges[index]]
+                if candidate < distances[neighbour]:
+                    distances[neighbour] = candidate
+                    via_edges[neighbour] = edges[index]
+                    heapq.heappush(queue, (candidate, neighbour))
+        return distances, via_edges
+
+    def route(self, source, target):
+        """
+        The shortest distance along the track between two TrackPositions and
+        the edges it runs over, source edge first; (inf, []) if the track
+        does not connect them.
+        """
+        source_start, source_end = self.edge_nodes[source.edge]
+        source_length = self.edge_lengths[source.edge]
+        distances, via_edges = self.distances_from(
+            {source_start: source.offset_m, source_end: source_length - source.offset_m}
+            if source_start != source_end
+            else {source_start: min(source.offset_m, source_length - source.offset_m)}
+        )
+        target_start, target_end = self.edge_nodes[target.edge]
+        candidates = [
+            (distances[target_start] + target.offset_m, target_start),
+            (distances[target_end] + self.edge_lengths[target.edge] - target.offset_m, target_end),
+        ]
+        length, node = min(candidates)
+        if source.edge == target.edge and abs(target.offset_m - source.offset_m) <= length:
+            return abs(target.offset_m - source.offset_m), [source.edge]
+        if not np.isfinite(length):
+            return np.inf, []
+
+        edges = [target.edge]
+        while via_edges[node] >= 0:
+            edge = int(via_edges[node])
+            if edge != edges[-1]:
+                edges.append(edge)
+            start, end = self.edge_nodes[edge]
+            node = start if end == node else end
+        if edges[-1] != source.edge:
+            edges.append(source.edge)
+        return float(length), edges[::-1]
+
+    def distance_between(self, source_x, source_y, target_x, target_y, max_distance_m=None):
+        """Track distance between two map points, each snapped to its nearest edge; None if either is off the track."""
+        source = self.locate_point(source_x, source_y, max_distance_m)
+        target = self.locate_point(target_x, target_y, max_distance_m)
+        if source is None or target is None:
+            return None
+        return self.route(source, target)[0]